@@ -1,22 +1,47 @@
 from pathlib import Path
 import requests
 import json
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import os
 from dotenv import load_dotenv
 import re
-from models.schemas import ProcedureSchema, AgentResponse
+from models.responses import AgentReply
+from models.catalog import NO_CONTEXT_REQUIRED, CompiledProcedure, as_compiled
+from services.metrics import stage
+from services import deadline
+from services.log import get_logger
 
 dotenv_path = Path(__file__).resolve().parent.parent.parent / '.env'
 load_dotenv(dotenv_path=dotenv_path)
 
+NO_PROCEDURE_FOUND_TEXT = "Désolé, je n'ai pas trouvé de procédure correspondant à votre demande. Pouvez-vous reformuler ou préciser ce que vous souhaitez faire ?"
+CONTEXT_QUESTIONS = {
+    "type d'offre souhaitée": "Quel type d'offre internet souhaitez-vous ? (Fibre, ADSL, ou Box 5G)",
+    "adresse du domicile": "Quelle est votre adresse complète ?",
+    "mode de paiement": "Quel mode de paiement préférez-vous ? (Carte bancaire, prélèvement automatique, etc.)",
+    "type de client": "Êtes-vous un particulier ou une entreprise ?",
+    "numéro de la ligne": "Quel est le numéro de la ligne concernée ?",
+    "volume à transférer": "Quel volume de données souhaitez-vous transférer ? (en Mo ou Go)",
+    "identité du titulaire": "Pouvez-vous confirmer l'identité du titulaire de la ligne ?"
+}
+
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "30"))
+# The LLM intent fallback is skipped (the top retrieval hit is taken) when less than this is left of the request's
+# budget; otherwise it takes at most OLLAMA_BUDGET_SHARE of what is left, keeping the rest for TTS.
+LLM_INTENT_MIN_BUDGET_S = float(os.getenv("LLM_INTENT_MIN_BUDGET_S", "3"))
+OLLAMA_BUDGET_SHARE = 0.8
+
+log = get_logger(__name__)
+
 class AIAssistantAgent:
-    def __init__(self):
+    def __init__(self, llm: Optional[Callable[[str, str], str]] = None):
         self.ollama_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self.model_name = os.getenv("MODEL_NAME", "llama3")
         if not self.ollama_url or not self.model_name:
-            print("Warning: OLLAMA_BASE_URL or MODEL_NAME not set in .env or environment.")
+            log.warning("assistant.config_missing", hint="set OLLAMA_BASE_URL and MODEL_NAME in .env or the environment")
         self.conversation_history: Dict[str, List[Dict]] = {}
+        # (prompt, system_prompt) -> completion; Ollama unless replaced (e.g. by a stub or cache for offline replays).
+        self.llm = llm or self._call_ollama
 
     def _call_ollama(self, prompt: str, system_prompt: str = "") -> str:
         try:
@@ -32,45 +57,52 @@ class AIAssistantAgent:
                     "num_predict": 500,  # Limit response length
                 }
             }
-            response = requests.post(url, json=payload, timeout=30)
+            with stage("llm"):
+                response = requests.post(url, json=payload, timeout=deadline.timeout(OLLAMA_TIMEOUT_S, OLLAMA_BUDGET_SHARE))
             response.raise_for_status()
             response_json = response.json()
             return response_json.get("response", "Désolé, je n'ai pas pu générer de réponse.")
+        except requests.exceptions.Timeout as e:
+            deadline.degrade("llm_timed_out", model=self.model_name)
+            return "Erreur de connexion avec l'assistant Ollama. Veuillez vérifier qu'il est bien lancé et accessible."
         except requests.exceptions.RequestException as e:
-            print(f"Ollama API request error: {e}")
+            log.error("ollama.request_failed", error=str(e), model=self.model_name)
             return "Erreur de connexion avec l'assistant Ollama. Veuillez vérifier qu'il est bien lancé et accessible."
         except json.JSONDecodeError as e:
-            print(f"Ollama API JSON decode error: {e}")
+            log.error("ollama.invalid_json", error=str(e), model=self.model_name)
             return "Réponse invalide reçue de l'assistant Ollama."
         except Exception as e:
-            print(f"Unexpected error calling Ollama API: {e}")
+            log.error("ollama.unexpected_error", exc_info=True, model=self.model_name)
             return "Une erreur inattendue est survenue avec l'assistant."
 
-    def analyze_user_intent(self, user_input: str, relevant_procedures: List[ProcedureSchema]) -> Dict:
+    def analyze_user_intent(self, user_input: str, relevant_procedures: List[CompiledProcedure]) -> Dict:
         """Analyze user intent and match to procedures with better logic"""
         if not relevant_procedures:
             return {"intent": "unknown", "confidence": 0.0, "detected_language": "fr"}
         
         # Simple keyword matching first for exact procedure names
         user_lower = user_input.lower()
-        for proc in relevant_procedures:
-            proc_lower = proc.procedure.lower()
-            # Check for key terms in the procedure name
-            key_terms = proc_lower.split()
-            if len(key_terms) > 2:  # For compound procedure names
-                if all(term in user_lower for term in key_terms[:2]):  # Match first two key terms
+        for proc in map(as_compiled, relevant_procedures):
+            # Key terms of the procedure name are tokenized when the catalog is compiled
+            if proc.intent_requires_all:  # For compound procedure names
+                if all(term in user_lower for term in proc.intent_terms):  # Match first two key terms
                     return {
                         "intent": proc.procedure,
                         "confidence": 0.9,
                         "detected_language": "fr"
                     }
-            elif any(term in user_lower for term in key_terms if len(term) > 3):  # Match significant terms
+            elif any(term in user_lower for term in proc.intent_terms):  # Match significant terms
                 return {
                     "intent": proc.procedure,
                     "confidence": 0.8,
                     "detected_language": "fr"
                 }
         
+        if not deadline.can_afford(LLM_INTENT_MIN_BUDGET_S):
+            # Not enough time left for the model: go with the best retrieval hit
+            deadline.degrade("llm_intent_skipped")
+            return {"intent": relevant_procedures[0].procedure, "confidence": 0.5, "detected_language": "fr"}
+
         # Fallback to Ollama for complex cases
         system_prompt = """Tu es un assistant pour un opérateur télécom. 
         Analyse l'intention de l'utilisateur et détermine quelle procédure correspond le mieux.
@@ -86,7 +118,7 @@ class AIAssistantAgent:
         Quelle procédure correspond exactement à cette demande?
         """
         
-        response_str = self._call_ollama(prompt, system_prompt)
+        response_str = self.llm(prompt, system_prompt)
         
         # Find matching procedure
         for proc in relevant_procedures:
@@ -103,20 +135,20 @@ class AIAssistantAgent:
             "detected_language": "fr"
         }
 
-    def collect_missing_context(self, procedure: ProcedureSchema, user_input: str, conversation_history: List[Dict]) -> AgentResponse:
+    def collect_missing_context(self, procedure: CompiledProcedure, user_input: str, conversation_history: List[Dict]) -> AgentReply:
         """Collect missing context with improved logic"""
-        required_context = procedure.ai_assistant_agent.required_context if procedure.ai_assistant_agent else []
-        
-        # Filter out "Aucun context requis"
-        required_context_items = [ctx for ctx in required_context if ctx != "Aucun context requis"]
+        procedure = as_compiled(procedure)
+        # "Aucun context requis" is already filtered out by the catalog
+        required_context_items = procedure.required_slots
         
         if not required_context_items:
             return self._generate_complete_response(procedure, {})
         
         # Extract context from current input and conversation
-        collected_context = self._extract_context_from_conversation(
-            user_input, conversation_history, required_context_items
-        )
+        with stage("slot_extraction"):
+            collected_context = self._extract_context_from_conversation(
+                user_input, conversation_history, required_context_items
+            )
         
         # Find missing context
         missing_context_items = [ctx for ctx in required_context_items if not collected_context.get(ctx)]
@@ -126,7 +158,7 @@ class AIAssistantAgent:
         else:
             # Ask for next missing context item
             next_question = self._generate_context_question(missing_context_items[0], procedure)
-            return AgentResponse(
+            return AgentReply(
                 response_text=next_question,
                 todo_list=[],
                 missing_context=missing_context_items,
@@ -191,40 +223,32 @@ class AIAssistantAgent:
         
         return context_values
 
-    def _generate_context_question(self, missing_context_item: str, procedure: ProcedureSchema) -> str:
+    def _generate_context_question(self, missing_context_item: str, procedure: CompiledProcedure) -> str:
         """Generate appropriate questions for missing context"""
-        questions_map = {
-            "type d'offre souhaitée": "Quel type d'offre internet souhaitez-vous ? (Fibre, ADSL, ou Box 5G)",
-            "adresse du domicile": "Quelle est votre adresse complète ?",
-            "mode de paiement": "Quel mode de paiement préférez-vous ? (Carte bancaire, prélèvement automatique, etc.)",
-            "type de client": "Êtes-vous un particulier ou une entreprise ?",
-            "numéro de la ligne": "Quel est le numéro de la ligne concernée ?",
-            "volume à transférer": "Quel volume de données souhaitez-vous transférer ? (en Mo ou Go)",
-            "identité du titulaire": "Pouvez-vous confirmer l'identité du titulaire de la ligne ?"
-        }
-        
         # Find matching question
-        for key, question in questions_map.items():
+        for key, question in CONTEXT_QUESTIONS.items():
             if key.lower() in missing_context_item.lower():
                 return question
         
         # Default question
         return f"Pour continuer avec '{procedure.procedure}', j'ai besoin de connaître : {missing_context_item}. Pouvez-vous me le fournir ?"
 
-    def _generate_complete_response(self, procedure: ProcedureSchema, context: Dict) -> AgentResponse:
+    def fixed_response_texts(self, procedures: List[CompiledProcedure]) -> List[str]:
+        """Responses whose text never depends on user input, for TTS pre-rendering"""
+        texts = [NO_PROCEDURE_FOUND_TEXT] + list(CONTEXT_QUESTIONS.values())
+        for procedure in map(as_compiled, procedures):
+            for ctx in procedure.required_slots:
+                texts.append(self._generate_context_question(ctx, procedure))
+            if not procedure.required_slots:
+                texts.append(self._generate_complete_response(procedure, {}).response_text)
+        return list(dict.fromkeys(texts))
+
+    def _generate_complete_response(self, procedure: CompiledProcedure, context: Dict) -> AgentReply:
         """Generate final response with procedure details"""
-        todo_list = []
-        
-        # Handle different document structures
-        if isinstance(procedure.documents_required, list):
-            todo_list = procedure.documents_required
-        elif isinstance(procedure.documents_required, dict):
-            # Use context to determine client type
-            client_type = context.get("Type de client", "").lower()
-            if "entreprise" in client_type:
-                todo_list = procedure.documents_required.get("entreprise", procedure.documents_required.get("particulier", []))
-            else:
-                todo_list = procedure.documents_required.get("particulier", [])
+        procedure = as_compiled(procedure)
+        # Both document lists are resolved by the catalog; use context to determine client type
+        client_type = next((value or "" for key, value in context.items() if "client" in key.lower()), "").lower()
+        todo_list = list(procedure.documents_entreprise if "entreprise" in client_type else procedure.documents_particulier)
         
         # Build response text
         response_parts = [
@@ -249,7 +273,7 @@ class AIAssistantAgent:
         
         response_text = "\n".join(response_parts)
         
-        return AgentResponse(
+        return AgentReply(
             response_text=response_text,
             todo_list=todo_list,
             missing_context=[],
@@ -257,7 +281,7 @@ class AIAssistantAgent:
             next_question=None
         )
 
-    def generate_response(self, user_input: str, relevant_procedures: List[ProcedureSchema], user_id: str) -> AgentResponse:
+    def generate_response(self, user_input: str, relevant_procedures: List[CompiledProcedure], user_id: str) -> AgentReply:
         """Main response generation with improved flow"""
         # Initialize conversation history
         if user_id not in self.conversation_history:
@@ -268,9 +292,9 @@ class AIAssistantAgent:
 
         # Handle no procedures found
         if not relevant_procedures:
-            response_text = "Désolé, je n'ai pas trouvé de procédure correspondant à votre demande. Pouvez-vous reformuler ou préciser ce que vous souhaitez faire ?"
+            response_text = NO_PROCEDURE_FOUND_TEXT
             current_conversation.append({"role": "assistant", "content": response_text})
-            return AgentResponse(
+            return AgentReply(
                 response_text=response_text,
                 todo_list=[],
                 missing_context=[],
@@ -279,7 +303,8 @@ class AIAssistantAgent:
             )
 
         # Analyze intent
-        intent_result = self.analyze_user_intent(user_input, relevant_procedures)
+        with stage("intent"):
+            intent_result = self.analyze_user_intent(user_input, relevant_procedures)
         target_procedure = next((p for p in relevant_procedures if p.procedure == intent_result["intent"]), None)
 
         # Handle ambiguous intent
@@ -287,7 +312,7 @@ class AIAssistantAgent:
             proc_names = [p.procedure for p in relevant_procedures[:3]]
             clarification = f"Je vois plusieurs procédures possibles. Laquelle vous intéresse ?\n" + "\n".join([f"• {name}" for name in proc_names])
             current_conversation.append({"role": "assistant", "content": clarification})
-            return AgentResponse(
+            return AgentReply(
                 response_text=clarification,
                 todo_list=[],
                 missing_context=proc_names,
@@ -0,0 +1,96 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import date
+import re
+
+TD3_LINE_LENGTH = 44
+_MRZ_LINE_RE = re.compile(r"^[A-Z0-9<]{30,48}$")
+_CHECK_WEIGHTS = (7, 3, 1)
+# OCR-B confusions that only ever make sense in one direction for a numeric field.
+_DIGIT_FIXES = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "G": "6", "B": "8"})
+
+def check_digit(field: str) -> int:
+    """ICAO 9303 check digit: weights 7-3-1 over digits, A-Z as 10-35 and '<' as 0"""
+    total = 0
+    for i, char in enumerate(field):
+        if char.isdigit():
+            value = int(char)
+        elif "A" <= char <= "Z":
+            value = ord(char) - 55
+        else:
+            value = 0
+        total += value * _CHECK_WEIGHTS[i % 3]
+    return total % 10
+
+def _digits(field: str) -> str:
+    return field.translate(_DIGIT_FIXES)
+
+def _check(field: str, digit: str) -> bool:
+    digit = _digits(digit)
+    if digit == "<":
+        # Optional fields left empty may use a filler check digit.
+        return field.strip("<") == ""
+    return digit.isdigit() and check_digit(field) == int(digit)
+
+def _parse_date(yymmdd: str, future: bool) -> Optional[str]:
+    if not yymmdd.isdigit():
+        return None
+    year, month, day = int(yymmdd[:2]), int(yymmdd[2:4]), int(yymmdd[4:])
+    current = date.today().year % 100
+    # Expiry dates are in this century; birth dates later than this year are last century.
+    century = 2000 if future or year <= current else 1900
+    try:
+        return date(century + year, month, day).isoformat()
+    except ValueError:
+        return None
+
+def _name(field: str) -> str:
+    return " ".join(part.replace("<", " ").strip() for part in field.split("<<") if part.strip("<")).strip()
+
+def find_td3_lines(text: str) -> Optional[Tuple[str, str]]:
+    """Pick the bottom-most pair of MRZ lines out of OCR text, normalized to 44 characters"""
+    lines: List[str] = []
+    for raw_line in text.upper().splitlines():
+        line = re.sub(r"\s+", "", raw_line).replace("«", "<")
+        if _MRZ_LINE_RE.match(line):
+            lines.append(line[:TD3_LINE_LENGTH].ljust(TD3_LINE_LENGTH, "<"))
+    pairs = list(zip(lines, lines[1:]))
+    for first, second in reversed(pairs):
+        if first.startswith("P"):
+            return first, second
+    return None
+
+def parse_td3(line1: str, line2: str) -> Dict:
+    """Parse a passport (TD3) MRZ and verify its check digits"""
+    document_number = line2[0:9]
+    birth_date = _digits(line2[13:19])
+    expiry_date = _digits(line2[21:27])
+    personal_number = line2[28:42]
+    composite = line2[0:10] + birth_date + _digits(line2[19]) + expiry_date + _digits(line2[27]) + line2[28:43]
+    names = line1[5:44]
+    surname, _, given_names = names.partition("<<")
+    result = {
+        "document_type": line1[0:2].replace("<", ""),
+        "issuing_country": line1[2:5].replace("<", ""),
+        "surname": _name(surname),
+        "given_names": _name(given_names),
+        "document_number": document_number.replace("<", ""),
+        "nationality": line2[10:13].replace("<", ""),
+        "birth_date": _parse_date(birth_date, future=False),
+        "sex": line2[20],
+        "expiry_date": _parse_date(expiry_date, future=True),
+        "personal_number": personal_number.replace("<", ""),
+        "checks": {
+            "document_number": _check(document_number, line2[9]),
+            "birth_date": _check(birth_date, line2[19]),
+            "expiry_date": _check(expiry_date, line2[27]),
+            "personal_number": _check(personal_number, line2[42]),
+            "composite": _check(composite, line2[43]),
+        },
+    }
+    checks = result["checks"]
+    result["is_valid"] = bool(
+        result["document_number"]
+        and checks["document_number"] and checks["birth_date"] and checks["expiry_date"]
+        and result["birth_date"] and result["expiry_date"]
+    )
+    return result
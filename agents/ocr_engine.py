@@ -0,0 +1,186 @@
+import os
+import re
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+from PIL import Image
+
+# "auto" uses the in-process tesserocr binding when installed, else the tesseract CLI via pytesseract.
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto").lower()
+_CONFIG_RE = re.compile(r"--(oem|psm)\s+(\d+)|-c\s+(\w+)=(\S*)")
+
+def parse_tesseract_config(config: str) -> Tuple[int, int, Dict[str, str]]:
+    """Split a tesseract CLI config string into (oem, psm, -c variables)"""
+    oem, psm, variables = 3, 3, {}
+    for flag, number, name, value in _CONFIG_RE.findall(config or ""):
+        if flag == "oem":
+            oem = int(number)
+        elif flag == "psm":
+            psm = int(number)
+        else:
+            variables[name] = value
+    return oem, psm, variables
+
+class OCRTimeout(TimeoutError):
+    """The document's time limit ran out, or its caller went away, before OCR finished"""
+
+class OCREngine(ABC):
+    """Runs Tesseract on in-memory PIL images; ValidationAgent decides what to read and where."""
+    name = "base"
+    _expires_at: Optional[float] = None
+    _cancelled: Optional[Callable[[], bool]] = None
+
+    def set_limit(self, expires_at: Optional[float], cancelled: Optional[Callable[[], bool]] = None):
+        """Bound the calls that follow: they raise OCRTimeout past time.monotonic() expires_at, or once cancelled() is true"""
+        self._expires_at, self._cancelled = expires_at, cancelled
+
+    def _time_left(self) -> Optional[float]:
+        """Seconds the next call may take, None without a limit; raises OCRTimeout when nothing is left"""
+        if self._cancelled is not None and self._cancelled():
+            raise OCRTimeout("OCR cancelled by the caller")
+        if self._expires_at is None:
+            return None
+        left = self._expires_at - time.monotonic()
+        if left <= 0:
+            raise OCRTimeout("OCR time limit reached")
+        return left
+
+    @abstractmethod
+    def version(self) -> str:
+        """Tesseract version string, e.g. 5.3.0"""
+
+    @abstractmethod
+    def languages(self) -> List[str]:
+        """Installed traineddata languages"""
+
+    @abstractmethod
+    def image_to_string(self, image: Image.Image, lang: str, config: str = "") -> str:
+        """Text of image, read with a tesseract CLI config string"""
+
+    @abstractmethod
+    def image_to_data(self, image: Image.Image, lang: str, config: str = "") -> Dict[str, list]:
+        """Word boxes in pytesseract's Output.DICT layout (text, conf, left, top, width, height)"""
+
+class SubprocessEngine(OCREngine):
+    """pytesseract: one tesseract process, temp image file and traineddata load per call."""
+    name = "pytesseract"
+
+    def __init__(self):
+        import pytesseract # type: ignore
+        self._pytesseract = pytesseract
+
+    def version(self) -> str:
+        return str(self._pytesseract.get_tesseract_version())
+
+    def languages(self) -> List[str]:
+        return self._pytesseract.get_languages(config='')
+
+    def _call(self, function, image: Image.Image, **kwargs):
+        # pytesseract kills the tesseract process once timeout runs out (0 disables it).
+        try:
+            return function(image, timeout=self._time_left() or 0, **kwargs)
+        except RuntimeError as e:
+            if str(e) == "Tesseract process timeout":
+                raise OCRTimeout(str(e)) from e
+            raise
+
+    def image_to_string(self, image: Image.Image, lang: str, config: str = "") -> str:
+        return self._call(self._pytesseract.image_to_string, image, lang=lang, config=config)
+
+    def image_to_data(self, image: Image.Image, lang: str, config: str = "") -> Dict[str, list]:
+        return self._call(self._pytesseract.image_to_data, image, lang=lang, config=config, output_type=self._pytesseract.Output.DICT)
+
+class TesserocrEngine(OCREngine):
+    """In-process libtesseract via tesserocr, keeping one initialized API per (thread, lang, oem).
+
+    Each worker pays the traineddata load once; every later call hands the PIL image straight to
+    the loaded API instead of forking tesseract and round-tripping through a temp file.
+    """
+    name = "tesserocr"
+
+    def __init__(self, tessdata_path: str = os.getenv("TESSDATA_PREFIX", "")):
+        try:
+            import tesserocr # type: ignore
+        except ImportError as e:
+            raise RuntimeError("OCR_ENGINE=tesserocr requires the 'tesserocr' package.") from e
+        self._tesserocr = tesserocr
+        self._tessdata_path = tessdata_path
+        self._local = threading.local()
+
+    def _api(self, lang: str, oem: int):
+        """This thread's API for (lang, oem) and the names of the variables its last call set"""
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = {}
+        entry = apis.get((lang, oem))
+        if entry is None:
+            kwargs = {"lang": lang, "oem": oem}
+            if self._tessdata_path:
+                kwargs["path"] = self._tessdata_path
+            entry = apis[(lang, oem)] = [self._tesserocr.PyTessBaseAPI(**kwargs), set()]
+        return entry
+
+    def _prepare(self, image: Image.Image, lang: str, config: str):
+        # libtesseract cannot be interrupted mid-call, so the limit is only checked between calls; ValidationPool
+        # recycles a worker stuck past it.
+        self._time_left()
+        oem, psm, variables = parse_tesseract_config(config)
+        entry = self._api(lang, oem)
+        api = entry[0]
+        # Variables persist on a reused API; clear the ones the previous call set (e.g. a whitelist).
+        for name in entry[1] - set(variables):
+            api.SetVariable(name, "")
+        for name, value in variables.items():
+            api.SetVariable(name, value)
+        entry[1] = set(variables)
+        api.SetPageSegMode(psm)
+        api.SetImage(image)
+        return api
+
+    def version(self) -> str:
+        return self._tesserocr.tesseract_version().split()[1]
+
+    def languages(self) -> List[str]:
+        path, languages = self._tesserocr.get_languages(self._tessdata_path) if self._tessdata_path else self._tesserocr.get_languages()
+        return languages
+
+    def image_to_string(self, image: Image.Image, lang: str, config: str = "") -> str:
+        api = self._prepare(image, lang, config)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def image_to_data(self, image: Image.Image, lang: str, config: str = "") -> Dict[str, list]:
+        api = self._prepare(image, lang, config)
+        data = {"text": [], "conf": [], "left": [], "top": [], "width": [], "height": []}
+        try:
+            api.Recognize()
+            level = self._tesserocr.RIL.WORD
+            for word in self._tesserocr.iterate_level(api.GetIterator(), level):
+                box = word.BoundingBox(level)
+                if box is None:
+                    continue
+                left, top, right, bottom = box
+                data["text"].append(word.GetUTF8Text(level) or "")
+                data["conf"].append(word.Confidence(level))
+                data["left"].append(left)
+                data["top"].append(top)
+                data["width"].append(right - left)
+                data["height"].append(bottom - top)
+        finally:
+            api.Clear()
+        return data
+
+def create_ocr_engine(name: str = OCR_ENGINE) -> OCREngine:
+    if name == "tesserocr":
+        return TesserocrEngine()
+    if name == "pytesseract":
+        return SubprocessEngine()
+    if name == "auto":
+        try:
+            return TesserocrEngine()
+        except RuntimeError:
+            return SubprocessEngine()
+    raise ValueError(f"Unknown OCR_ENGINE '{name}'. Expected 'auto', 'tesserocr' or 'pytesseract'.")
@@ -0,0 +1,105 @@
+from typing import Optional, Tuple
+import os
+import numpy as np
+from PIL import Image, ImageOps
+
+# Tesseract is most accurate around 300 DPI; scans above that only cost time.
+TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+# Phone photos carry no usable DPI; cap their longest side instead.
+MAX_SIDE_PX = int(os.getenv("OCR_MAX_SIDE_PX", "1600"))
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.5
+
+Box = Tuple[int, int, int, int]
+
+def load_grayscale(image_path: str) -> Image.Image:
+    """Open an image upright (EXIF orientation applied) and in 8-bit grayscale"""
+    with Image.open(image_path) as img:
+        return ImageOps.exif_transpose(img).convert("L")
+
+def downscale(img: Image.Image, target_dpi: int = TARGET_DPI, max_side: int = MAX_SIDE_PX) -> Image.Image:
+    """Shrink to target_dpi when the scan's DPI is known, else to max_side; never upscale"""
+    dpi = img.info.get("dpi")
+    if dpi and dpi[0] and dpi[0] > target_dpi:
+        scale = target_dpi / float(dpi[0])
+    else:
+        scale = max_side / float(max(img.size))
+    if scale >= 1.0:
+        return img
+    new_size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+    return img.resize(new_size, Image.LANCZOS)
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(hist) / gray.size
+    means = np.cumsum(hist * np.arange(256)) / gray.size
+    between_variance = (means[-1] * weights - means) ** 2 / (weights * (1.0 - weights) + 1e-12)
+    return int(np.argmax(between_variance))
+
+def binarize(img: Image.Image) -> Image.Image:
+    gray = np.asarray(img, dtype=np.uint8)
+    threshold = otsu_threshold(gray)
+    return Image.fromarray(np.where(gray > threshold, 255, 0).astype(np.uint8))
+
+def estimate_skew(binary: Image.Image, max_angle: float = MAX_SKEW_DEGREES, step: float = SKEW_STEP_DEGREES) -> float:
+    """Angle that makes text rows sharpest in the horizontal projection profile"""
+    thumb = binary.copy()
+    thumb.thumbnail((600, 600))
+    ink = Image.fromarray(255 - np.asarray(thumb, dtype=np.uint8))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        profile = np.asarray(ink.rotate(float(angle), resample=Image.BILINEAR, fillcolor=0), dtype=np.float32).sum(axis=1)
+        score = float(np.var(profile))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def deskew(img: Image.Image, angle: float) -> Image.Image:
+    if abs(angle) < SKEW_STEP_DEGREES / 2:
+        return img
+    return img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+def preprocess(img: Image.Image) -> Image.Image:
+    """Downscale, binarize and deskew a grayscale page for OCR"""
+    binary = binarize(downscale(img))
+    return deskew(binary, estimate_skew(binary))
+
+def crop_box(img: Image.Image, box: Box, padding: float = 0.15) -> Image.Image:
+    """Crop box (left, top, right, bottom) with padding relative to its height"""
+    left, top, right, bottom = box
+    pad = int((bottom - top) * padding) + 2
+    return img.crop((max(0, left - pad), max(0, top - pad), min(img.width, right + pad), min(img.height, bottom + pad)))
+
+def crop_fraction(img: Image.Image, fractions: Tuple[float, float, float, float]) -> Image.Image:
+    """Crop a region given as fractions (left, top, right, bottom) of the image size"""
+    left, top, right, bottom = fractions
+    return img.crop((int(left * img.width), int(top * img.height), int(right * img.width), int(bottom * img.height)))
+
+def crop_bottom_rows(binary: Image.Image, count: int, min_ink: float = 0.02, min_height: int = 4) -> Optional[Image.Image]:
+    """Crop a binarized image to its last `count` text rows, found from the horizontal ink profile"""
+    ink_per_row = (np.asarray(binary, dtype=np.uint8) < 128).mean(axis=1)
+    rows, start = [], None
+    for y, is_text in enumerate(list(ink_per_row > min_ink) + [False]):
+        if is_text and start is None:
+            start = y
+        elif not is_text and start is not None:
+            if y - start >= min_height:
+                rows.append((start, y))
+            start = None
+    if len(rows) < count:
+        return None
+    top, bottom = rows[-count][0], rows[-1][1]
+    return crop_box(binary, (0, top, binary.width, bottom))
+
+def find_token_box(ocr_data: dict, pattern) -> Optional[Box]:
+    """Box of the most confident word in pytesseract image_to_data output matching pattern"""
+    best_box, best_conf = None, -1.0
+    for i, word in enumerate(ocr_data.get("text", [])):
+        if not word or not pattern.fullmatch(word.strip()):
+            continue
+        conf = float(ocr_data["conf"][i])
+        if conf > best_conf:
+            left, top = ocr_data["left"][i], ocr_data["top"][i]
+            best_box = (left, top, left + ocr_data["width"][i], top + ocr_data["height"][i])
+            best_conf = conf
+    return best_box
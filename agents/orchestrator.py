@@ -1,78 +1,191 @@
-from agents.retrieval import RetrievalAgent
-from agents.assistant import AIAssistantAgent
-from services.transcription import TranscriptionService
-from services.tts import TTSService
-from models.schemas import UserQuery, AgentResponse, ProcedureSchema 
-from typing import List, Optional, Tuple
+from models.schemas import UserQuery
+from models.responses import AgentReply
+from services.components import ComponentRegistry
+from services.metrics import stage
+from services import deadline
+from services.log import get_logger
+from typing import List, Optional, Tuple, TYPE_CHECKING
 import os
-import uuid
+import base64
 from pathlib import Path
 
+if TYPE_CHECKING:
+    from agents.retrieval import RetrievalAgent
+    from models.catalog import CompiledProcedure
+    from agents.assistant import AIAssistantAgent
+    from services.transcription import TranscriptionService
+    from services.tts import TTSService
+
 PROCEDURES_DEFAULT_PATH = str(Path(__file__).resolve().parent.parent.parent / "data" / "procedures.json")
+# Languages the response text can be voiced in; a caller speaking one of these hears it back in that language.
+TTS_LANGUAGES = [lang.strip() for lang in os.getenv("TTS_LANGUAGES", "fr").split(",") if lang.strip()]
+DEFAULT_TTS_LANGUAGE = "fr"
+# Audio that has to be waited for (inline or by URL) is skipped when less than this is left of the request's budget;
+# streamed audio never holds up the response, so it is always queued.
+TTS_MIN_BUDGET_S = float(os.getenv("TTS_MIN_BUDGET_S", "2"))
+# Larger clips are returned by URL instead, to keep JSON responses small.
+TTS_INLINE_MAX_BYTES = int(os.getenv("TTS_INLINE_MAX_KB", "256")) * 1024
+# Components loaded in the background at startup; anything else loads on first use.
+PRELOAD_COMPONENTS = [name.strip() for name in os.getenv("PRELOAD_COMPONENTS", "retrieval,assistant,tts,transcription").split(",") if name.strip()]
+# What a text query needs; audio queries also need "transcription".
+TEXT_PATH_COMPONENTS = ("retrieval", "assistant")
+# Read-only models a preforking server loads once in its master and shares with every worker.
+# TTS is left out: its audio store owns a SQLite connection and a GC thread that must be per process.
+SHARED_COMPONENTS = ("retrieval", "transcription")
+
+log = get_logger(__name__)
+
+def _load_retrieval(procedures_path: str) -> "RetrievalAgent":
+    from agents.retrieval import RetrievalAgent
+    agent = RetrievalAgent(procedures_path)
+    log.info("retrieval.loaded", procedures_path=procedures_path, procedures=len(agent.procedure_objects))
+    return agent
+
+def _load_assistant() -> "AIAssistantAgent":
+    from agents.assistant import AIAssistantAgent
+    agent = AIAssistantAgent()
+    log.info("assistant.loaded", ollama_url=agent.ollama_url, model=agent.model_name)
+    return agent
+
+def _load_transcription() -> "TranscriptionService":
+    from services.transcription import TranscriptionService
+    return TranscriptionService(model_name="base")
+
+def _load_tts() -> "TTSService":
+    from services.tts import TTSService
+    return TTSService()
 
 class MainOrchestrator:
     def __init__(self, procedures_path: str = PROCEDURES_DEFAULT_PATH):
-        self.retrieval_agent = RetrievalAgent(procedures_path)
-        self.assistant_agent = AIAssistantAgent()
-        self.transcription_service = TranscriptionService(model_name="base")
-        self.tts_service = TTSService()
-        print("🚀 INNOVISION Orchestrator initialized!")
-        print(f"Procedures loaded from: {procedures_path}")
-        print(f"Ollama URL: {self.assistant_agent.ollama_url}, Model: {self.assistant_agent.model_name}")
-
-    def process_user_input(self, text_input: str, user_id: str) -> AgentResponse:
+        # Nothing heavy is built here: each component loads on first use, or earlier through preload().
+        self.components = ComponentRegistry()
+        self.components.register("retrieval", lambda: _load_retrieval(procedures_path))
+        self.components.register("assistant", _load_assistant)
+        self.components.register("transcription", _load_transcription)
+        self.components.register("tts", _load_tts)
+        log.info("orchestrator.initialized", preload=PRELOAD_COMPONENTS)
+
+    @property
+    def retrieval_agent(self) -> "RetrievalAgent":
+        return self.components.get("retrieval")
+
+    @property
+    def assistant_agent(self) -> "AIAssistantAgent":
+        return self.components.get("assistant")
+
+    @property
+    def transcription_service(self) -> "TranscriptionService":
+        return self.components.get("transcription")
+
+    @property
+    def tts_service(self) -> "TTSService":
+        return self.components.get("tts")
+
+    def preload(self, names: Optional[List[str]] = None):
+        """Load components in parallel in the background so the first requests don't pay for it"""
+        self.components.preload(PRELOAD_COMPONENTS if names is None else names)
+
+    def load_shared(self):
+        """Load the shareable models synchronously, before a preforking server forks its workers"""
+        self.components.load(SHARED_COMPONENTS)
+
+    def readiness(self) -> dict:
+        return self.components.status()
+
+    def process_user_input(self, text_input: str, user_id: str, source_lang: Optional[str] = None) -> AgentReply:
         if not text_input:
-            return AgentResponse(
+            return AgentReply(
                 response_text="Je n'ai reçu aucun message. Comment puis-je vous aider ?",
                 todo_list=[], missing_context=[], is_complete=False,
                 next_question="Que souhaitez-vous faire ?"
             )
-        print(f"📝 Processing text for user {user_id}: \"{text_input}\"")
-        relevant_procedures: List[ProcedureSchema] = self.retrieval_agent.search_procedures(text_input)
-        print(f"🔍 Found {len(relevant_procedures)} relevant procedures for query: '{text_input}'")
+        log.info("query.received", user_id=user_id, text=text_input, source_lang=source_lang)
+        relevant_procedures: List["CompiledProcedure"] = self.retrieval_agent.search_procedures(text_input, source_lang=source_lang)
+        log.debug("retrieval.results", procedures=[proc.procedure for proc in relevant_procedures])
         response = self.assistant_agent.generate_response(
             text_input, 
             relevant_procedures, 
             user_id
         )
-        print(f"🤖 Generated response for user {user_id}: \"{response.response_text[:100]}...\"")
+        log.info("query.answered", user_id=user_id, procedures=len(relevant_procedures), is_complete=response.is_complete, response_text=response.response_text)
         return response
 
-    def process_user_query_object(self, query: UserQuery, audio_file_path: Optional[str] = None) -> AgentResponse:
+    def process_user_query_object(self, query: UserQuery, audio_file_path: Optional[str] = None) -> AgentReply:
         text_to_process = query.text
+        detected_language = None
         if audio_file_path:
-            print(f"🎤 Transcribing audio for user {query.user_id} from: {audio_file_path}")
-            transcribed_text = self.transcription_service.transcribe_audio(audio_file_path)
+            with stage("transcribe"):
+                transcribed_text, detected_language = self.transcription_service.transcribe_with_language(audio_file_path)
             if not transcribed_text:
-                return AgentResponse(
+                return AgentReply(
                     response_text="Désolé, je n'ai pas pu comprendre l'audio. Pouvez-vous répéter ou taper votre demande ?",
                     todo_list=[], missing_context=[], is_complete=False,
                     next_question="Pouvez-vous répéter votre demande ?"
                 )
             text_to_process = transcribed_text
-            print(f"🗣️ Transcription result for user {query.user_id}: \"{text_to_process}\"")
+            log.info("query.transcribed", user_id=query.user_id, language=detected_language, transcript=text_to_process)
+            if detected_language == "unknown":
+                detected_language = None
         if not text_to_process:
-             return AgentResponse(
+             return AgentReply(
                 response_text="Je n'ai pas pu obtenir de texte à traiter. Comment puis-je vous aider ?",
                 todo_list=[], missing_context=[], is_complete=False,
                 next_question="Que souhaitez-vous faire ?"
             )
-        return self.process_user_input(text_input=text_to_process, user_id=query.user_id)
+        agent_response = self.process_user_input(text_input=text_to_process, user_id=query.user_id, source_lang=detected_language)
+        agent_response.detected_language = detected_language
+        return agent_response
 
-    def process_with_optional_voice_output(self, query: UserQuery, audio_file_path: Optional[str] = None, generate_tts: bool = False) -> AgentResponse:
+    def warm_up_tts_cache(self):
+        texts = self.assistant_agent.fixed_response_texts(self.retrieval_agent.procedure_objects)
+        return self.tts_service.warm_up(texts, TTS_LANGUAGES)
+
+    def _select_tts_language(self, detected_language: Optional[str]) -> str:
+        if detected_language in TTS_LANGUAGES:
+            return detected_language
+        return DEFAULT_TTS_LANGUAGE
+
+    def process_with_optional_voice_output(self, query: UserQuery, audio_file_path: Optional[str] = None, generate_tts: bool = False, stream_tts: bool = False, inline_tts: bool = False) -> AgentReply:
         agent_response = self.process_user_query_object(query, audio_file_path)
-        if generate_tts and agent_response.response_text:
-            unique_id = str(uuid.uuid4()).split('-')[0] 
-            filename_prefix = f"response_{query.user_id}_{unique_id}"
-            response_lang = "fr" 
-            relative_audio_path = self.tts_service.generate_audio_file(
-                agent_response.response_text, 
-                filename_prefix,
-                lang=response_lang 
+        if not agent_response.response_text:
+            agent_response.degradations = deadline.degradations()
+            return agent_response
+        response_lang = self._select_tts_language(agent_response.detected_language)
+        if (inline_tts or generate_tts) and not stream_tts and not deadline.can_afford(TTS_MIN_BUDGET_S):
+            # Answer with text only rather than past the deadline.
+            deadline.degrade("tts_skipped", lang=response_lang)
+        elif stream_tts:
+            # Segments synthesize in the background; the client starts playing as soon as the first is ready.
+            playlist_id = self.tts_service.create_playlist(agent_response.response_text, lang=response_lang)
+            if playlist_id:
+                agent_response.audio_stream_url = self.tts_service.stream_url(playlist_id)
+                agent_response.audio_playlist_url = self.tts_service.playlist_url(playlist_id)
+                agent_response.audio_mime_type = self.tts_service.media_type
+                log.debug("tts.stream_queued", playlist_id=playlist_id, lang=response_lang)
+            else:
+                log.warning("tts.nothing_to_stream", user_id=query.user_id)
+        elif inline_tts:
+            audio_bytes = self.tts_service.synthesize_bytes(agent_response.response_text, lang=response_lang)
+            if audio_bytes and len(audio_bytes) <= TTS_INLINE_MAX_BYTES:
+                agent_response.audio_base64 = base64.b64encode(audio_bytes).decode("ascii")
+                agent_response.audio_mime_type = self.tts_service.media_type
+                log.debug("tts.inlined", bytes=len(audio_bytes), lang=response_lang)
+            elif audio_bytes:
+                # Already in the store: synthesize_bytes reads it back from there.
+                audio_key = self.tts_service.audio_key(agent_response.response_text, response_lang)
+                agent_response.audio_response_url = self.tts_service.audio_url(audio_key)
+                log.debug("tts.too_large_to_inline", bytes=len(audio_bytes), audio_key=audio_key)
+            else:
+                log.warning("tts.failed", user_id=query.user_id, lang=response_lang)
+        elif generate_tts:
+            audio_key = self.tts_service.synthesize_to_cache(
+                agent_response.response_text,
+                lang=response_lang
             )
-            if relative_audio_path:
-                agent_response.audio_response_url = os.path.join("/static", relative_audio_path).replace("\\", "/")
-                print(f"🔊 TTS audio generated for user {query.user_id}: {agent_response.audio_response_url}")
+            if audio_key:
+                agent_response.audio_response_url = self.tts_service.audio_url(audio_key)
+                log.debug("tts.generated", audio_key=audio_key, lang=response_lang)
             else:
-                print(f"⚠️ TTS audio generation failed for user {query.user_id}.")
-        return agent_response
\ No newline at end of file
+                log.warning("tts.failed", user_id=query.user_id, lang=response_lang)
+        agent_response.degradations = deadline.degradations()
+        return agent_response
@@ -1,92 +1,149 @@
-import json
+import os
+import hashlib
+import requests
 import faiss # type: ignore
 import numpy as np
 from sentence_transformers import SentenceTransformer # type: ignore
-from typing import List, Dict
-from models.schemas import ProceduresDataSchema, ProcedureSchema 
+from typing import Callable, List, Dict, Optional
+from models.catalog import INDEX_TEXT_VERSION, CompiledProcedure, ProcedureCatalog, load_or_build_catalog
+from services.metrics import stage
+from services import deadline
+from services.log import get_logger
 from pathlib import Path
 from langdetect import detect, DetectorFactory # type: ignore
-from translate import Translator as SyncTranslator # type: ignore
 
 # Ensure consistent language detection results
 DetectorFactory.seed = 0
 
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Built indexes are saved here and memory-mapped, so workers share one copy and skip re-encoding the catalog.
+INDEX_CACHE_DIR = Path(os.getenv("RETRIEVAL_INDEX_DIR", str(Path(__file__).resolve().parent.parent / "cache" / "retrieval")))
+# IO_FLAG_MMAP maps inverted lists; faiss >= 1.8 also maps the codes of flat indexes with IO_FLAG_MMAP_IFC.
+INDEX_MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+# A MyMemory-compatible endpoint (GET ?q=&langpair=src|fr); defaults to the public MyMemory API. Always called through
+# requests, so every translation is bounded by the request's deadline.
+TRANSLATION_API_URL = os.getenv("TRANSLATION_API_URL", "") or "https://api.mymemory.translated.net/get"
+TRANSLATION_TIMEOUT_S = float(os.getenv("TRANSLATION_TIMEOUT_S", "10"))
+# Translation is skipped (the query is searched as is) when less than this is left of the request's budget,
+# and takes at most this share of what is left.
+TRANSLATION_MIN_BUDGET_S = float(os.getenv("TRANSLATION_MIN_BUDGET_S", "2"))
+TRANSLATION_BUDGET_SHARE = 0.25
+
+log = get_logger(__name__)
+
 class RetrievalAgent:
-    def __init__(self, procedures_path: str):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.translator = SyncTranslator(to_lang="fr")
+    def __init__(self, procedures_path: str, translate_fn: Optional[Callable[[str, str], str]] = None):
+        self.model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        # (query, source_lang) -> French text; replaces the translation service, e.g. with recorded translations.
+        self.translate_fn = translate_fn
         self.procedures_file_path = Path(procedures_path)
         if not self.procedures_file_path.is_absolute():
             self.procedures_file_path = Path(__file__).resolve().parent.parent.parent / "data" / self.procedures_file_path.name
         if not self.procedures_file_path.exists():
             raise FileNotFoundError(f"Procedures JSON file not found at: {self.procedures_file_path}")
-        self.procedures_data = self._load_procedures(str(self.procedures_file_path))
+        # Validated, tokenized and embedded at build time; rebuilt here only when procedures.json or the model changed.
+        self.catalog: ProcedureCatalog = load_or_build_catalog(
+            self.procedures_file_path, lambda texts: self.model.encode(list(texts), show_progress_bar=True), EMBEDDING_MODEL_NAME)
         self.index = None
-        self.procedure_objects = []
+        self.procedure_objects: List[CompiledProcedure] = self.catalog.procedures
         self._build_index()
 
-    def _load_procedures(self, path: str) -> ProceduresDataSchema:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return ProceduresDataSchema(**data)
+    def _index_cache_path(self) -> Path:
+        digest = hashlib.sha256(self.catalog.source_sha256.encode("utf-8"))
+        digest.update(f"{EMBEDDING_MODEL_NAME}:{INDEX_TEXT_VERSION}".encode("utf-8"))
+        return INDEX_CACHE_DIR / f"procedures_{digest.hexdigest()[:16]}.faiss"
+
+    def _load_cached_index(self, path: Path) -> bool:
+        if not path.exists():
+            return False
+        try:
+            index = faiss.read_index(str(path), INDEX_MMAP_FLAGS)
+        except RuntimeError as e:
+            log.warning("retrieval.index_cache_unreadable", path=str(path), error=str(e))
+            return False
+        if index.ntotal != len(self.procedure_objects):
+            return False
+        self.index = index
+        log.info("retrieval.index_loaded", procedures=index.ntotal, path=str(path))
+        return True
+
+    def _save_index(self, path: Path):
+        try:
+            os.makedirs(path.parent, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            faiss.write_index(self.index, str(tmp_path))
+            os.replace(tmp_path, path)
+        except (OSError, RuntimeError) as e:
+            log.warning("retrieval.index_cache_write_failed", path=str(path), error=str(e))
 
     def _build_index(self):
-        texts = []
-        self.procedure_objects = []
-        for proc in self.procedures_data.procedures:
-            text = f"Procedure: {proc.procedure}. Remarks: {' '.join(proc.remarks)}. Required documents: {str(proc.documents_required)}"
-            texts.append(text)
-            self.procedure_objects.append(proc)
-        if not texts:
-            print("No procedures found to build index.")
+        if not self.procedure_objects:
+            log.warning("retrieval.no_procedures", path=str(self.procedures_file_path))
             self.index = None
             return
-        embeddings = self.model.encode(texts, show_progress_bar=True)
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)
-        normalized_embeddings = embeddings.astype('float32').copy()
-        faiss.normalize_L2(normalized_embeddings)
-        self.index.add(normalized_embeddings)
-        print(f"Built FAISS index with {len(texts)} procedures.")
+        cache_path = self._index_cache_path()
+        if self._load_cached_index(cache_path):
+            return
+        # The catalog's embeddings are already L2-normalized; the index takes its own copy of them.
+        self.index = faiss.IndexFlatIP(self.catalog.dimension)
+        self.index.add(np.array(self.catalog.embeddings))
+        log.info("retrieval.index_built", procedures=len(self.procedure_objects))
+        self._save_index(cache_path)
+        # Swap in the mapped copy so even the first process doesn't keep a private one.
+        self._load_cached_index(cache_path)
 
-    def _translate_to_french(self, query: str) -> str:
+    def _translate_to_french(self, query: str, source_lang: Optional[str] = None) -> str:
         """
         Translate the input query to French using synchronous libraries.
+        source_lang, when already known (e.g. from Whisper), skips detection.
         If translation fails, return the original query.
         """
         try:
-            # Detect language using langdetect
-            source_lang = detect(query)
-            print(f"Detected language: {source_lang}")
+            if not source_lang:
+                # Detect language using langdetect
+                with stage("detect"):
+                    source_lang = detect(query)
+                log.debug("retrieval.language_detected", language=source_lang)
             
             if source_lang == 'fr':
-                print("Query is already in French.")
+                return query
+            if not deadline.can_afford(TRANSLATION_MIN_BUDGET_S):
+                deadline.degrade("translation_skipped", source_lang=source_lang)
                 return query
             
-            # Translate using synchronous translator
-            translator = SyncTranslator(from_lang=source_lang, to_lang="fr")
-            translated_text = translator.translate(query)
-            print(f"Original query: {query}")
-            print(f"Translated query: {translated_text}")
+            with stage("translate"):
+                translated_text = self._translate(query, source_lang)
+            log.debug("retrieval.translated", source_lang=source_lang, query=query, translated_query=translated_text)
             return translated_text
             
         except Exception as e:
-            print(f"Translation failed: {e}")
-            print("Using original query for search.")
+            log.warning("retrieval.translation_failed", source_lang=source_lang, error=str(e))
+            if isinstance(e, requests.exceptions.Timeout):
+                deadline.degrade("translation_timed_out", source_lang=source_lang)
             return query
 
-    def search_procedures(self, query: str, top_k: int = 3) -> List[ProcedureSchema]:
+    def _translate(self, query: str, source_lang: str) -> str:
+        if self.translate_fn:
+            return self.translate_fn(query, source_lang)
+        response = requests.get(TRANSLATION_API_URL, params={"q": query, "langpair": f"{source_lang}|fr"},
+                                timeout=deadline.timeout(TRANSLATION_TIMEOUT_S, TRANSLATION_BUDGET_SHARE))
+        response.raise_for_status()
+        return response.json()["responseData"]["translatedText"]
+
+    def search_procedures(self, query: str, top_k: int = 3, source_lang: Optional[str] = None) -> List[CompiledProcedure]:
         if not self.index or self.index.ntotal == 0:
-            print("FAISS index is not built or is empty.")
+            log.warning("retrieval.index_empty")
             return []
         
         # Translate query to French before semantic search
-        french_query = self._translate_to_french(query)
+        french_query = self._translate_to_french(query, source_lang)
         
-        query_embedding = self.model.encode([french_query])
+        with stage("embed"):
+            query_embedding = self.model.encode([french_query])
         normalized_query_embedding = query_embedding.astype('float32').copy()
         faiss.normalize_L2(normalized_query_embedding)
-        scores, indices = self.index.search(normalized_query_embedding, top_k)
+        with stage("search"):
+            scores, indices = self.index.search(normalized_query_embedding, top_k)
         results = []
         if indices.size > 0:
             for i, idx in enumerate(indices[0]):
@@ -1,71 +1,203 @@
-from typing import Dict, Optional
-import pytesseract # type: ignore
+from typing import Callable, Dict, List, Optional, Tuple
 from PIL import Image
 import re
 import os
+from agents.ocr_preprocessing import load_grayscale, preprocess, crop_box, crop_fraction, crop_bottom_rows, find_token_box
+from agents.mrz import find_td3_lines, parse_td3
+from agents.ocr_engine import OCREngine, OCRTimeout, create_ocr_engine
+from services.ocr_cache import OCRCache
+from services.log import get_logger
+
+# No character whitelist on full pages: it would strip every Arabic character from 'ara' output.
+FULL_PAGE_CONFIG = r'--oem 3 --psm 6'
+# Sparse digit-only pass used to locate the CIN number, then a single-line read of just that field.
+DIGIT_SEARCH_CONFIG = r'--oem 3 --psm 11 -c tessedit_char_whitelist=0123456789'
+DIGIT_LINE_CONFIG = r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789'
+CIN_NUMBER_RE = re.compile(r"\d{8}")
+# Passport MRZ: the two machine-readable lines sit in the bottom of the data page.
+MRZ_ZONE = (0.0, 0.7, 1.0, 1.0)
+# MRZ is printed in OCR-B; use an OCR-B traineddata when installed, else fall back to eng.
+MRZ_LANG = os.getenv("MRZ_OCR_LANG", "ocrb")
+MRZ_FALLBACK_LANG = "eng"
+MRZ_CONFIG = r'--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<'
+
+CIN_PATTERNS = [
+    r'\b(\d{8})\b',  # Standard 8-digit CIN
+    r'CIN[:\s]*(\d{8})',  # CIN: 12345678
+    r'N°[:\s]*(\d{8})',   # N°: 12345678
+    r'رقم[:\s]*(\d{8})',   # Arabic equivalent
+]
+
+# Bump when pass logic changes so cached results from the old cascade are not reused.
+OCR_CACHE_VERSION = "1"
+
+log = get_logger(__name__)
+
+OCRPass = Tuple[str, Callable[[Image.Image], Optional[Dict]]]
+
+def infer_document_type(name: str) -> str:
+    """Map a requested document name (e.g. an item of the todo_list) to a validator"""
+    name_lower = name.lower()
+    if "passeport" in name_lower or "passport" in name_lower:
+        return "passport"
+    if "cin" in re.findall(r"[a-z]+", name_lower) or "identité" in name_lower or "identite" in name_lower:
+        return "cin"
+    return "document"
 
 class ValidationAgent:
-    def __init__(self):
+    def __init__(self, ocr_engine: Optional[OCREngine] = None):
+        self.ocr_engine = ocr_engine or create_ocr_engine()
         self.tesseract_available = self._check_tesseract()
+        self.mrz_lang = self._resolve_mrz_lang() if self.tesseract_available else MRZ_FALLBACK_LANG
+        self.ocr_cache = OCRCache()
+        self._ocr_settings = "|".join([OCR_CACHE_VERSION, self.ocr_engine.name, FULL_PAGE_CONFIG, DIGIT_SEARCH_CONFIG, DIGIT_LINE_CONFIG, MRZ_CONFIG, self.mrz_lang])
         
     def _check_tesseract(self) -> bool:
         """Check if Tesseract is available and properly configured"""
         try:
-            pytesseract.get_tesseract_version()
-            print("✅ Tesseract is available and configured.")
+            version = self.ocr_engine.version()
+            log.info("ocr.engine_ready", tesseract_version=str(version), engine=self.ocr_engine.name)
             return True
         except Exception as e:
-            print(f"❌ Tesseract not found or not configured: {e}")
-            print("📝 To fix this:")
-            print("   1. Install Tesseract OCR: https://github.com/tesseract-ocr/tesseract")
-            print("   2. Add Tesseract to your system PATH")
-            print("   3. Or set TESSDATA_PREFIX environment variable")
-            print("   4. Install language packs for French and Arabic if needed")
+            log.error("ocr.tesseract_unavailable", error=str(e),
+                      hint="install Tesseract (https://github.com/tesseract-ocr/tesseract) with the fra and ara packs, and put it on PATH or set TESSDATA_PREFIX")
             return False
 
-    def _ocr_image(self, image_path: str, lang: str = 'fra+ara') -> Optional[str]:
-        """Extract text from image using OCR with better error handling"""
+    def _resolve_mrz_lang(self) -> str:
+        try:
+            installed = self.ocr_engine.languages()
+        except Exception:
+            installed = []
+        if MRZ_LANG in installed:
+            return MRZ_LANG
+        log.warning("ocr.mrz_lang_missing", lang=MRZ_LANG, fallback=MRZ_FALLBACK_LANG)
+        return MRZ_FALLBACK_LANG
+
+    def _load_page(self, image_path: str) -> Optional[Image.Image]:
+        """Open and preprocess an image once, for every OCR pass to share"""
         if not self.tesseract_available:
-            print("❌ Tesseract not available - cannot perform OCR")
+            log.error("ocr.tesseract_unavailable")
+            return None
+        if not os.path.exists(image_path):
+            log.error("ocr.image_missing")
             return None
-            
         try:
-            if not os.path.exists(image_path):
-                print(f"❌ Image file not found: {image_path}")
-                return None
-            
-            # Verify it's a valid image file
-            try:
-                with Image.open(image_path) as img:
-                    # Convert to RGB if necessary
-                    if img.mode not in ('RGB', 'L'):
-                        img = img.convert('RGB')
-                    
-                    # Perform OCR with custom configuration
-                    custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz '
-                    text = pytesseract.image_to_string(img, lang=lang, config=custom_config)
-                    
-                    if text and text.strip():
-                        print(f"✅ OCR successful, extracted {len(text.strip())} characters")
-                        return text.strip()
-                    else:
-                        print("⚠️ OCR completed but no text was extracted")
-                        return None
-                        
-            except Exception as img_error:
-                print(f"❌ Error opening/processing image: {img_error}")
-                return None
-                
+            return preprocess(load_grayscale(image_path))
+        except Exception as img_error:
+            log.error("ocr.image_unreadable", error=str(img_error))
+            return None
+
+    def _ocr_page(self, page: Image.Image, lang: str, config: str = FULL_PAGE_CONFIG) -> Optional[str]:
+        # Engine errors propagate, so the cascade can tell a failed pass from a page without text.
+        text = self.ocr_engine.image_to_string(page, lang, config)
+        if text and text.strip():
+            log.debug("ocr.text_extracted", lang=lang, chars=len(text.strip()))
+            return text.strip()
+        log.debug("ocr.no_text", lang=lang)
+        return None
+
+    def _ocr_image(self, image_path: str, lang: str = 'fra+ara', config: str = FULL_PAGE_CONFIG) -> Optional[str]:
+        """Extract text from image using OCR with better error handling"""
+        page = self._load_page(image_path)
+        if page is None:
+            return None
+        try:
+            return self._ocr_page(page, lang, config)
         except Exception as e:
-            print(f"❌ OCR error on {image_path} with lang {lang}: {e}")
-            # Try with a simpler language setting as fallback
+            log.error("ocr.failed", lang=lang, error=str(e))
+            return None
+
+    def _cached_result(self, page: Image.Image, scope: str) -> Tuple[str, Optional[Dict]]:
+        """Cache key for this normalized page and validator, and the stored result if the same scan was seen"""
+        cache_key = OCRCache.make_key(page.tobytes(), f"{scope}|{page.mode}|{page.size}|{self._ocr_settings}")
+        cached = self.ocr_cache.get(cache_key)
+        if cached is not None:
+            cached["cache_hit"] = True
+            log.debug("ocr.cache_hit", scope=scope)
+        return cache_key, cached
+
+    def _store_result(self, cache_key: str, result: Dict):
+        result["cache_hit"] = False
+        self.ocr_cache.put(cache_key, result)
+
+    def _run_cascade(self, page: Image.Image, passes: List[OCRPass]) -> Tuple[Optional[Dict], List[str], bool]:
+        """Run OCR passes cheapest first and stop at the first one that finds a well-formed match.
+
+        Also returns whether every pass ran without an engine error: a miss is only worth caching then.
+        """
+        tried, clean = [], True
+        for name, ocr_pass in passes:
+            tried.append(name)
             try:
-                print("🔄 Retrying OCR with simplified settings...")
-                text = pytesseract.image_to_string(Image.open(image_path), lang='fra')
-                return text.strip() if text and text.strip() else None
-            except Exception as fallback_error:
-                print(f"❌ Fallback OCR also failed: {fallback_error}")
+                found = ocr_pass(page)
+            except OCRTimeout:
+                # Out of time for this document: later passes would fail the same way.
+                raise
+            except Exception as e:
+                log.warning("ocr.pass_failed", ocr_pass=name, error=str(e))
+                found, clean = None, False
+            if found:
+                log.debug("ocr.pass_succeeded", ocr_pass=name, passes_tried=len(tried))
+                found["ocr_pass"] = name
+                return found, tried, clean
+        return None, tried, clean
+
+    def _cin_number_field_pass(self, page: Image.Image) -> Optional[Dict]:
+        """Locate the 8-digit number field and OCR only that region with a digit-only config"""
+        data = self.ocr_engine.image_to_data(page, 'fra', DIGIT_SEARCH_CONFIG)
+        box = find_token_box(data, CIN_NUMBER_RE)
+        if not box:
+            return None
+        field_text = self.ocr_engine.image_to_string(crop_box(page, box), 'fra', DIGIT_LINE_CONFIG)
+        digits = re.sub(r"\D", "", field_text)
+        if not CIN_NUMBER_RE.fullmatch(digits):
+            # The single-line re-read can clip a digit; the sparse pass already saw a full 8-digit token.
+            digits = next(word.strip() for word in data["text"] if word and CIN_NUMBER_RE.fullmatch(word.strip()))
+        return {"cin_number": digits, "confidence": 0.9, "raw_text": None}
+
+    def _cin_full_page_pass(self, lang: str) -> Callable[[Image.Image], Optional[Dict]]:
+        def ocr_pass(page: Image.Image) -> Optional[Dict]:
+            raw_text = self._ocr_page(page, lang)
+            if not raw_text:
                 return None
+            for pattern in CIN_PATTERNS:
+                for match in re.finditer(pattern, raw_text, re.IGNORECASE):
+                    potential_cin = match.group(1)
+                    # Additional validation: CIN should be exactly 8 digits
+                    if len(potential_cin) == 8 and potential_cin.isdigit():
+                        confidence = 0.9 if 'CIN' in raw_text.upper() else 0.7
+                        return {"cin_number": potential_cin, "confidence": confidence, "raw_text": raw_text}
+            log.debug("ocr.cin_not_found", lang=lang, raw_text=raw_text)
+            return None
+        return ocr_pass
+
+    def _passport_mrz_pass(self, locate_lines: bool, rejected: List[Dict]) -> Callable[[Image.Image], Optional[Dict]]:
+        """OCR the MRZ (just its two bottom lines, or the whole band) and accept it only if the check digits hold"""
+        def ocr_pass(page: Image.Image) -> Optional[Dict]:
+            region = crop_fraction(page, MRZ_ZONE)
+            if locate_lines:
+                region = crop_bottom_rows(region, 2)
+                if region is None:
+                    return None
+            mrz_text = self._ocr_page(region, self.mrz_lang, MRZ_CONFIG)
+            lines = find_td3_lines(mrz_text) if mrz_text else None
+            if not lines:
+                return None
+            mrz = parse_td3(*lines)
+            if not mrz["is_valid"]:
+                rejected.append(mrz)
+                return None
+            return {"passport_number": mrz["document_number"], "confidence": 1.0, "raw_text": "\n".join(lines), "mrz": mrz}
+        return ocr_pass
+
+    def _generic_full_page_pass(self, lang: str) -> Callable[[Image.Image], Optional[Dict]]:
+        def ocr_pass(page: Image.Image) -> Optional[Dict]:
+            raw_text = self._ocr_page(page, lang)
+            # At least 10 characters
+            if raw_text and len(raw_text) > 10:
+                return {"raw_text": raw_text, "text_length": len(raw_text)}
+            return None
+        return ocr_pass
 
     def validate_cin(self, image_path: str) -> Dict:
         """Validate Tunisian CIN (Carte d'Identité Nationale) with improved pattern matching"""
@@ -74,101 +206,74 @@ class ValidationAgent:
             "cin_number": None, 
             "error": None, 
             "raw_text": None,
-            "confidence": 0.0
+            "confidence": 0.0,
+            "ocr_pass": None,
+            "ocr_passes_tried": []
         }
-        
-        # First try OCR
-        raw_text = self._ocr_image(image_path, lang='ara+fra')
-        if not raw_text:
+        page = self._load_page(image_path)
+        if page is None:
             validation_result["error"] = "OCR failed or no text found in image. Please ensure the image is clear and contains text."
             return validation_result
-        
-        validation_result["raw_text"] = raw_text
-        
-        # Multiple CIN patterns for Tunisian CIN
-        cin_patterns = [
-            r'\b(\d{8})\b',  # Standard 8-digit CIN
-            r'CIN[:\s]*(\d{8})',  # CIN: 12345678
-            r'N°[:\s]*(\d{8})',   # N°: 12345678
-            r'رقم[:\s]*(\d{8})',   # Arabic equivalent
-        ]
-        
-        found_cin = None
-        confidence = 0.0
-        
-        for pattern in cin_patterns:
-            matches = re.finditer(pattern, raw_text, re.IGNORECASE)
-            for match in matches:
-                potential_cin = match.group(1)
-                # Additional validation: CIN should be exactly 8 digits
-                if len(potential_cin) == 8 and potential_cin.isdigit():
-                    found_cin = potential_cin
-                    confidence = 0.9 if 'CIN' in raw_text.upper() else 0.7
-                    break
-            if found_cin:
-                break
-        
-        if found_cin:
-            validation_result["cin_number"] = found_cin
+        cache_key, cached = self._cached_result(page, "cin")
+        if cached is not None:
+            return cached
+
+        # Cheapest first: digit-only number field, then single-language and finally multi-language full page.
+        found, tried, clean = self._run_cascade(page, [
+            ("cin_number_roi", self._cin_number_field_pass),
+            ("cin_page_fra", self._cin_full_page_pass('fra')),
+            ("cin_page_ara_fra", self._cin_full_page_pass('ara+fra')),
+        ])
+        validation_result["ocr_passes_tried"] = tried
+        if found:
+            validation_result.update(found)
             validation_result["is_valid"] = True
-            validation_result["confidence"] = confidence
-            print(f"✅ CIN found: {found_cin} (confidence: {confidence})")
+            log.info("validation.cin_found", cin_number=found["cin_number"], confidence=found["confidence"], ocr_pass=found["ocr_pass"])
         else:
             validation_result["error"] = "CIN number pattern (8 digits) not found in the document. Please ensure the image shows a clear Tunisian CIN."
-            print(f"❌ CIN pattern not found in OCR text: {raw_text[:200]}...")
         
+        if found or clean:
+            self._store_result(cache_key, validation_result)
         return validation_result
 
     def validate_passport(self, image_path: str) -> Dict:
-        """Validate passport with improved pattern matching"""
+        """Validate a passport from its TD3 machine-readable zone"""
         validation_result = {
             "is_valid": False, 
             "passport_number": None, 
             "error": None, 
             "raw_text": None,
-            "confidence": 0.0
+            "confidence": 0.0,
+            "ocr_pass": None,
+            "ocr_passes_tried": []
         }
-        
-        raw_text = self._ocr_image(image_path, lang='fra+eng')
-        if not raw_text:
+        page = self._load_page(image_path)
+        if page is None:
             validation_result["error"] = "OCR failed or no text found in image."
             return validation_result
-        
-        validation_result["raw_text"] = raw_text
-        
-        # Multiple passport patterns
-        passport_patterns = [
-            r'PASSPORT[:\s]*([A-Z0-9]{6,12})',  # PASSPORT: ABC123456
-            r'N°[:\s]*([A-Z0-9]{6,12})',       # N°: ABC123456
-            r'NO[:\s]*([A-Z0-9]{6,12})',       # NO: ABC123456
-            r'\b([A-Z]{1,2}\d{6,8})\b',        # Pattern like AB1234567
-            r'\b([A-Z0-9]{7,9})\b',            # General alphanumeric pattern
-        ]
-        
-        found_passport = None
-        confidence = 0.0
-        
-        for pattern in passport_patterns:
-            matches = re.finditer(pattern, raw_text.upper())
-            for match in matches:
-                potential_passport = match.group(1)
-                # Additional validation
-                if 6 <= len(potential_passport) <= 12:
-                    found_passport = potential_passport
-                    confidence = 0.9 if 'PASSPORT' in raw_text.upper() else 0.6
-                    break
-            if found_passport:
-                break
-        
-        if found_passport:
-            validation_result["passport_number"] = found_passport
+        cache_key, cached = self._cached_result(page, "passport")
+        if cached is not None:
+            return cached
+
+        # MRZ check digits make the result deterministic; a full-page scan would only add guesses.
+        rejected: List[Dict] = []
+        found, tried, clean = self._run_cascade(page, [
+            ("passport_mrz_lines", self._passport_mrz_pass(True, rejected)),
+            ("passport_mrz_zone", self._passport_mrz_pass(False, rejected)),
+        ])
+        validation_result["ocr_passes_tried"] = tried
+        if found:
+            validation_result.update(found)
             validation_result["is_valid"] = True
-            validation_result["confidence"] = confidence
-            print(f"✅ Passport found: {found_passport} (confidence: {confidence})")
+            log.info("validation.passport_found", passport_number=found["passport_number"], ocr_pass=found["ocr_pass"])
+        elif rejected:
+            failed = [field for field, ok in rejected[-1]["checks"].items() if not ok]
+            validation_result["error"] = f"Passport MRZ found but its check digits do not match ({', '.join(failed) or 'dates'}). Please upload a sharper photo of the data page."
         else:
-            validation_result["error"] = "Passport number pattern not found in the document."
-            print(f"❌ Passport pattern not found in OCR text: {raw_text[:200]}...")
+            validation_result["error"] = "Passport machine-readable zone (the two lines at the bottom of the data page) not found."
         
+        if found or clean:
+            self._store_result(cache_key, validation_result)
         return validation_result
 
     def validate_document_generic(self, image_path: str, doc_type: str = "document") -> Dict:
@@ -178,21 +283,38 @@ class ValidationAgent:
             "doc_type": doc_type,
             "error": None, 
             "raw_text": None,
-            "text_length": 0
+            "text_length": 0,
+            "ocr_pass": None,
+            "ocr_passes_tried": []
         }
-        
-        raw_text = self._ocr_image(image_path)
-        if not raw_text:
+        page = self._load_page(image_path)
+        if page is None:
             validation_result["error"] = f"Could not extract text from {doc_type} image."
             return validation_result
-        
-        validation_result["raw_text"] = raw_text
-        validation_result["text_length"] = len(raw_text)
-        validation_result["is_valid"] = len(raw_text) > 10  # At least 10 characters
-        
-        if validation_result["is_valid"]:
-            print(f"✅ {doc_type} validation successful - extracted {len(raw_text)} characters")
+        cache_key, cached = self._cached_result(page, f"document:{doc_type}")
+        if cached is not None:
+            return cached
+
+        found, tried, clean = self._run_cascade(page, [
+            ("generic_page_fra", self._generic_full_page_pass('fra')),
+            ("generic_page_fra_ara", self._generic_full_page_pass('fra+ara')),
+        ])
+        validation_result["ocr_passes_tried"] = tried
+        if found:
+            validation_result.update(found)
+            validation_result["is_valid"] = True
+            log.info("validation.document_read", doc_type=doc_type, chars=found["text_length"])
         else:
-            validation_result["error"] = f"Insufficient text extracted from {doc_type} (only {len(raw_text)} characters)"
+            validation_result["error"] = f"Insufficient text extracted from {doc_type}."
         
-        return validation_result
\ No newline at end of file
+        if found or clean:
+            self._store_result(cache_key, validation_result)
+        return validation_result
+
+    def validate(self, image_path: str, doc_type: str) -> Dict:
+        """Dispatch to the validator for doc_type ("cin", "passport" or any generic document)"""
+        if doc_type == "cin":
+            return self.validate_cin(image_path)
+        if doc_type == "passport":
+            return self.validate_passport(image_path)
+        return self.validate_document_generic(image_path, doc_type)
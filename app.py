@@ -1,13 +1,18 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import io
 import uuid
+import hashlib
 from pathlib import Path
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
 from dotenv import load_dotenv
 import base64
 from streamlit_lottie import st_lottie
-import time
+from PIL import Image, ImageOps
 
 # Load environment variables
 load_dotenv()
@@ -103,17 +108,43 @@ if 'current_step' not in st.session_state:
     st.session_state.current_step = None
 if 'validated_documents' not in st.session_state:
     st.session_state.validated_documents = set()
+if 'todo_list' not in st.session_state:
+    st.session_state.todo_list = []
+if 'document_results' not in st.session_state:
+    # document name -> {"digest": sha256 of the uploaded file, "result": server validation result}
+    st.session_state.document_results = {}
 
 # API Configuration
 API_URL = os.getenv('API_URL', 'http://localhost:8000')
+API_TIMEOUT_S = float(os.getenv('API_TIMEOUT_S', '60'))
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_KB', '256')) * 1024
+# The server OCRs grayscale pages capped at this size, so larger uploads are wasted transfer.
+UPLOAD_MAX_SIDE_PX = int(os.getenv('UPLOAD_MAX_SIDE_PX', '1600'))
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '3'))
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One keep-alive connection pool shared by every browser session and rerun"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data
+def load_animation(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
 
 def send_message(text: str, tts: bool = False) -> dict:
     """Send message to API and return response"""
     try:
-        response = requests.post(
+        # Streamed TTS: the text comes back right away and the audio plays while it is still being synthesized.
+        response = get_http_session().post(
             f"{API_URL}/api/v1/query/text",
             json={"text": text, "user_id": st.session_state.user_id},
-            params={"tts": str(tts).lower()}
+            params={"tts_stream": str(tts).lower()},
+            timeout=API_TIMEOUT_S
         )
         response.raise_for_status()
         return response.json()
@@ -121,39 +152,154 @@ def send_message(text: str, tts: bool = False) -> dict:
         st.error(f"Error communicating with the server: {str(e)}")
         return None
 
-def play_audio_response(audio_url: str):
-    """Play audio response from the assistant"""
-    if audio_url:
+def play_audio_response(audio_url: str = None, audio_bytes: bytes = None, mime_type: str = "audio/mp3"):
+    """Play audio response from the assistant, from inline bytes when the API sent them"""
+    if audio_bytes:
+        st.audio(audio_bytes, format=mime_type or "audio/mp3", start_time=0)
+    elif audio_url:
         full_url = f"{API_URL}{audio_url}"
-        st.audio(full_url, format='audio/mp3', start_time=0)
+        st.audio(full_url, format=mime_type or "audio/mp3", start_time=0)
 
-def show_success_animation():
+def fetch_audio(audio_url: str) -> Optional[bytes]:
+    """Audio behind a signed URL, or None once the URL has expired"""
+    try:
+        response = get_http_session().get(f"{API_URL}{audio_url}", timeout=API_TIMEOUT_S)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException:
+        return None
+
+def render_message_audio(message: dict, index: int, latest: bool):
+    """The latest reply keeps its player on every rerun, so audio still streaming is not cut off; older replies play
+    on request, from bytes kept in the session since their signed URL expires"""
+    if not (message.get("audio_url") or message.get("audio_bytes")):
+        return
+    if latest:
+        play_audio_response(message.get("audio_url"), message.get("audio_bytes"), message.get("audio_mime_type"))
+    elif st.button("🔊 Réécouter", key=f"replay_{index}"):
+        if not message.get("audio_bytes"):
+            message["audio_bytes"] = fetch_audio(message["audio_url"])
+        if message.get("audio_bytes"):
+            play_audio_response(audio_bytes=message["audio_bytes"], mime_type=message.get("audio_mime_type"))
+        else:
+            st.info("Cet audio n'est plus disponible.")
+
+def show_success_animation(key: str = "success"):
     """Show success animation using Lottie"""
-    with open('animations/success.json', 'r') as f:
-        animation = json.load(f)
-    st_lottie(animation, height=200, key="success")
-    time.sleep(2)
-
-def handle_file_upload(file_type: str):
-    """Handle file upload and validation"""
-    uploaded_file = st.file_uploader(f"Upload your {file_type}", type=['pdf', 'jpg', 'jpeg', 'png'])
-    if uploaded_file:
-        # Here you would implement the file validation logic
-        # For now, we'll simulate success
-        st.session_state.validated_documents.add(file_type)
-        show_success_animation()
-        return True
-    return False
+    st_lottie(load_animation('animations/success.json'), height=200, key=key)
+
+def prepare_upload(data: bytes) -> bytes:
+    """Downscale a scan to grayscale JPEG before sending it; keeps the original if that is not smaller"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            page = ImageOps.exif_transpose(img).convert("L")
+        page.thumbnail((UPLOAD_MAX_SIDE_PX, UPLOAD_MAX_SIDE_PX))
+        buffer = io.BytesIO()
+        page.save(buffer, format="JPEG", quality=90)
+    except Exception:
+        return data
+    return buffer.getvalue() if buffer.tell() < len(data) else data
+
+def upload_document(session: requests.Session, data: bytes, progress: dict, doc_name: str) -> str:
+    """Send a document in chunks to the upload endpoint and return its upload id"""
+    data = prepare_upload(data)
+    upload_id = uuid.uuid4().hex
+    for offset in range(0, len(data), UPLOAD_CHUNK_BYTES) or [0]:
+        chunk = data[offset:offset + UPLOAD_CHUNK_BYTES]
+        response = session.put(
+            f"{API_URL}/api/v1/uploads/{upload_id}",
+            params={"offset": offset},
+            data=chunk,
+            timeout=API_TIMEOUT_S
+        )
+        response.raise_for_status()
+        progress[doc_name] = (offset + len(chunk)) / max(1, len(data))
+    return upload_id
+
+def validate_documents(files: dict) -> dict:
+    """Upload {document name: bytes} concurrently, then validate them in one batch streamed back as they finish"""
+    bars = {doc_name: st.progress(0.0, text=f"📤 {doc_name}") for doc_name in files}
+    progress = {doc_name: 0.0 for doc_name in files}
+    results, upload_ids = {}, {}
+    session = get_http_session()
+    # Worker threads only record progress; the bars are redrawn from the script thread.
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+        futures = {pool.submit(upload_document, session, data, progress, doc_name): doc_name for doc_name, data in files.items()}
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.2)
+            for doc_name, bar in bars.items():
+                bar.progress(progress[doc_name] * 0.5, text=f"📤 {doc_name}")
+    for future, doc_name in futures.items():
+        try:
+            upload_ids[doc_name] = future.result()
+        except requests.RequestException as e:
+            results[doc_name] = {"is_valid": False, "error": f"Upload failed: {e}"}
+    if upload_ids:
+        for doc_name in upload_ids:
+            bars[doc_name].progress(0.5, text=f"🔎 {doc_name}")
+        try:
+            response = session.post(
+                f"{API_URL}/api/v1/validate/batch",
+                data={"user_id": st.session_state.user_id, "upload_ids": list(upload_ids.values()), "document_names": list(upload_ids)},
+                stream=True,
+                timeout=API_TIMEOUT_S
+            )
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                results[result["document_id"]] = result
+                bars[result["document_id"]].progress(1.0, text=f"{'✅' if result.get('is_valid') else '❌'} {result['document_id']}")
+        except requests.RequestException as e:
+            st.error(f"Error communicating with the server: {str(e)}")
+    for bar in bars.values():
+        bar.empty()
+    return results
+
+def show_validation_result(doc_name: str, result: dict, animate: bool = False):
+    if result.get("is_valid"):
+        st.success(f"{doc_name} validated successfully!")
+        if animate:
+            show_success_animation(key=f"success_{doc_name}")
+    else:
+        st.error(f"{doc_name}: {result.get('error') or 'validation failed'}")
+
+def render_document_uploads(todo_list: list):
+    """Upload widgets for the requested documents; results are kept per file so reruns don't re-upload"""
+    pending = {}
+    for doc in todo_list:
+        st.write(f"📄 Please upload your {doc}")
+        uploaded_file = st.file_uploader(f"Upload your {doc}", type=['jpg', 'jpeg', 'png'], key=f"upload_{doc}")
+        if not uploaded_file:
+            continue
+        data = uploaded_file.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        cached = st.session_state.document_results.get(doc)
+        if cached and cached["digest"] == digest:
+            show_validation_result(doc, cached["result"])
+        else:
+            pending[doc] = (digest, data)
+    if pending and st.button(f"Valider {len(pending)} document(s)"):
+        results = validate_documents({doc: data for doc, (_, data) in pending.items()})
+        for doc, result in results.items():
+            st.session_state.document_results[doc] = {"digest": pending[doc][0], "result": result}
+            if result.get("is_valid"):
+                st.session_state.validated_documents.add(doc)
+            else:
+                st.session_state.validated_documents.discard(doc)
+            show_validation_result(doc, result, animate=True)
 
 # Main chat interface
 st.title("Assistant INNOVISION 🤖")
 
 # Chat messages display
-for message in st.session_state.messages:
+latest_reply = max((index for index, message in enumerate(st.session_state.messages) if message["role"] == "assistant"), default=None)
+for index, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         st.write(message["content"])
-        if "audio_url" in message and message["audio_url"]:
-            play_audio_response(message["audio_url"])
+        render_message_audio(message, index, latest=index == latest_reply)
 
 # User input
 user_input = st.chat_input("Comment puis-je vous aider ?")
@@ -165,30 +311,34 @@ if user_input:
         st.write(user_input)
     
     # Get assistant response
-    response = send_message(user_input, tts=True)
+    with st.spinner("..."):
+        response = send_message(user_input, tts=True)
     
     if response:
-        # Add assistant response to chat
-        st.session_state.messages.append({
+        # Add assistant response to chat; inline audio is decoded once, not on every rerun
+        audio_base64 = response.get("audio_base64")
+        message = {
             "role": "assistant",
             "content": response["response_text"],
-            "audio_url": response.get("audio_response_url")
-        })
+            "audio_url": response.get("audio_stream_url") or response.get("audio_response_url"),
+            "audio_bytes": base64.b64decode(audio_base64) if audio_base64 else None,
+            "audio_mime_type": response.get("audio_mime_type")
+        }
+        st.session_state.messages.append(message)
         
         with st.chat_message("assistant"):
             st.write(response["response_text"])
-            if response.get("audio_response_url"):
-                play_audio_response(response["audio_response_url"])
-            
-            # Handle document requests
-            if response.get("todo_list"):
-                for doc in response["todo_list"]:
-                    if doc not in st.session_state.validated_documents:
-                        st.write(f"📄 Please upload your {doc}")
-                        if handle_file_upload(doc):
-                            st.success(f"{doc} validated successfully!")
+            render_message_audio(message, len(st.session_state.messages) - 1, latest=True)
+        
+        # Kept across reruns: uploading a file reruns the script without a new response.
+        if response.get("todo_list"):
+            st.session_state.todo_list = response["todo_list"]
+
+# Handle document requests
+if st.session_state.todo_list:
+    render_document_uploads(st.session_state.todo_list)
 
 # Reset button
 if st.button("Recommencer"):
     st.session_state.clear()
-    st.experimental_rerun()
\ No newline at end of file
+    st.rerun()
\ No newline at end of file
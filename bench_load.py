@@ -0,0 +1,345 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import io
+import os
+import json
+import math
+import time
+import uuid
+import wave
+import random
+import signal
+import hashlib
+import platform
+import threading
+import subprocess
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import requests
+from loadtest.fakes import start_fakes
+from loadtest.readiness import wait_until_ready
+
+# End-to-end load test: starts main.py (uvicorn) against local stand-ins for Ollama, TTS and translation,
+# replays conversation scripts with LOADTEST_CONCURRENCY virtual users and writes a JSON report.
+#   python bench_load.py [script.json]           run a script (default loadtest/scripts/mixed.json)
+#   python bench_load.py compare base.json new.json
+# Runs offline once the sentence-transformers model (and, for audio turns, the Whisper model) is in the local cache.
+APP_DIR = Path(__file__).resolve().parent
+DEFAULT_SCRIPT = APP_DIR / "loadtest" / "scripts" / "mixed.json"
+FIXTURE_PROCEDURES = APP_DIR / "loadtest" / "fixtures" / "procedures.json"
+REPORT_DIR = APP_DIR / "cache" / "loadtest"
+REPORT_SCHEMA_VERSION = 1
+
+LOADTEST_CONCURRENCY = int(os.getenv("LOADTEST_CONCURRENCY", "8"))
+LOADTEST_DURATION_S = float(os.getenv("LOADTEST_DURATION_S", "60"))
+# Requests finishing during warm-up are not counted.
+LOADTEST_WARMUP_S = float(os.getenv("LOADTEST_WARMUP_S", "10"))
+LOADTEST_SEED = int(os.getenv("LOADTEST_SEED", "1"))
+LOADTEST_REQUEST_TIMEOUT_S = float(os.getenv("LOADTEST_REQUEST_TIMEOUT_S", "60"))
+LOADTEST_WORKERS = int(os.getenv("LOADTEST_WORKERS", "1"))
+LOADTEST_PORT = int(os.getenv("LOADTEST_PORT", "8766"))
+LOADTEST_READY_TIMEOUT_S = float(os.getenv("LOADTEST_READY_TIMEOUT_S", "600"))
+# Fault profiles of the stand-ins: a name from loadtest.fakes.PROFILES or "latency_ms=..,error_rate=..".
+LOADTEST_OLLAMA_PROFILE = os.getenv("LOADTEST_OLLAMA_PROFILE", "typical")
+LOADTEST_TTS_PROFILE = os.getenv("LOADTEST_TTS_PROFILE", "fast")
+LOADTEST_TRANSLATION_PROFILE = os.getenv("LOADTEST_TRANSLATION_PROFILE", "fast")
+# Target an already running server instead; the stand-ins are then not started.
+LOADTEST_BASE_URL = os.getenv("LOADTEST_BASE_URL", "")
+LOADTEST_REPORT = os.getenv("LOADTEST_REPORT", "")
+
+TTS_QUERY_PARAMS = {"url": {"tts": "true"}, "inline": {"tts_inline": "true"}, "stream": {"tts_stream": "true"}}
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+CLIP_SAMPLE_RATE = 16000
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def synthetic_clip(seconds: float, seed: int) -> bytes:
+    """A speech-like WAV (voiced harmonics in syllable bursts, plus noise) so Whisper does real decoding work"""
+    rng = random.Random(seed)
+    pitch = rng.uniform(110, 220)
+    samples = array("h")
+    for n in range(int(seconds * CLIP_SAMPLE_RATE)):
+        t = n / CLIP_SAMPLE_RATE
+        envelope = max(0.0, math.sin(math.pi * 4 * t)) ** 2
+        voiced = sum(math.sin(2 * math.pi * pitch * k * t) / k for k in (1, 2, 3))
+        samples.append(int(max(-1.0, min(1.0, 0.3 * envelope * voiced + 0.02 * rng.uniform(-1, 1))) * 32767))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(CLIP_SAMPLE_RATE)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+class Recorder:
+    """Latency and outcome of every request, kept only once the warm-up window is over"""
+
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        # Steps the server skipped to meet a request's deadline, as listed in its responses.
+        self.degradations: Dict[str, int] = {}
+        self.conversations = 0
+        self.turns = 0
+
+    def record(self, endpoint: str, latency: float, error: Optional[str]):
+        if time.monotonic() < self.measure_from:
+            return
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if error:
+                kinds = self.errors.setdefault(endpoint, {})
+                kinds[error] = kinds.get(error, 0) + 1
+
+    def degraded(self, steps: List[str]):
+        if not steps or time.monotonic() < self.measure_from:
+            return
+        with self._lock:
+            for step in steps:
+                self.degradations[step] = self.degradations.get(step, 0) + 1
+
+    def count(self, conversations: int = 0, turns: int = 0):
+        if time.monotonic() < self.measure_from:
+            return
+        with self._lock:
+            self.conversations += conversations
+            self.turns += turns
+
+class VirtualUser(threading.Thread):
+    """Plays weighted-random conversations back to back, each as a new user, until stopped"""
+
+    def __init__(self, index: int, base_url: str, script: Dict, recorder: Recorder, stop: threading.Event, clips: Dict[float, bytes]):
+        super().__init__(name=f"vu-{index}", daemon=True)
+        self.base_url = base_url
+        self.script = script
+        self.recorder = recorder
+        self.stop = stop
+        self.clips = clips
+        self.rng = random.Random(LOADTEST_SEED * 1000 + index)
+        self.session = requests.Session()
+
+    def run(self):
+        conversations = self.script["conversations"]
+        weights = [conversation.get("weight", 1) for conversation in conversations]
+        while not self.stop.is_set():
+            conversation = self.rng.choices(conversations, weights)[0]
+            user_id = f"loadtest-{uuid.uuid4().hex[:12]}"
+            for turn in conversation["turns"]:
+                if self.stop.is_set():
+                    return
+                self._play_turn(turn, user_id)
+                self.recorder.count(turns=1)
+                if turn.get("think_ms"):
+                    self.stop.wait(turn["think_ms"] / 1000.0)
+            self.recorder.count(conversations=1)
+
+    def _timed(self, endpoint: str, send) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        response, error = None, None
+        try:
+            response = send()
+            if response.status_code >= 400:
+                error = f"http_{response.status_code}"
+        except requests.Timeout:
+            error = "timeout"
+        except requests.RequestException as e:
+            error = type(e).__name__
+        self.recorder.record(endpoint, time.perf_counter() - start, error)
+        return response if error is None else None
+
+    def _play_turn(self, turn: Dict, user_id: str):
+        params = TTS_QUERY_PARAMS.get(turn.get("tts", ""), {})
+        if turn["type"] == "audio":
+            files = {"audio_file": ("clip.wav", self.clips[float(turn["seconds"])], "audio/wav")}
+            response = self._timed("query_audio", lambda: self.session.post(
+                f"{self.base_url}/api/v1/query/audio", params=params, data={"user_id": user_id}, files=files, timeout=LOADTEST_REQUEST_TIMEOUT_S))
+        else:
+            response = self._timed("query_text", lambda: self.session.post(
+                f"{self.base_url}/api/v1/query/text", params=params, json={"text": turn["text"], "user_id": user_id}, timeout=LOADTEST_REQUEST_TIMEOUT_S))
+        if response is None:
+            return
+        body = response.json()
+        self.recorder.degraded(body.get("degradations"))
+        # Fetch the audio the way a client would, so TTS cost is part of the conversation.
+        if body.get("audio_stream_url"):
+            self._fetch_stream(body["audio_stream_url"])
+        elif body.get("audio_response_url"):
+            self._timed("audio_file", lambda: self.session.get(f"{self.base_url}{body['audio_response_url']}", timeout=LOADTEST_REQUEST_TIMEOUT_S))
+
+    def _fetch_stream(self, path: str):
+        start = time.perf_counter()
+        first_byte: List[float] = []
+
+        def send():
+            response = self.session.get(f"{self.base_url}{path}", stream=True, timeout=LOADTEST_REQUEST_TIMEOUT_S)
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk and not first_byte:
+                    first_byte.append(time.perf_counter() - start)
+            return response
+
+        if self._timed("audio_stream", send) is not None and first_byte:
+            self.recorder.record("audio_stream_first_byte", first_byte[0], None)
+
+def run_load(base_url: str, script: Dict) -> Dict:
+    clip_lengths = {float(turn["seconds"]) for conversation in script["conversations"] for turn in conversation["turns"] if turn["type"] == "audio"}
+    clips = {seconds: synthetic_clip(seconds, LOADTEST_SEED) for seconds in clip_lengths}
+    recorder = Recorder(time.monotonic() + LOADTEST_WARMUP_S)
+    stop = threading.Event()
+    users = [VirtualUser(i, base_url, script, recorder, stop, clips) for i in range(LOADTEST_CONCURRENCY)]
+    for user in users:
+        user.start()
+    time.sleep(LOADTEST_WARMUP_S + LOADTEST_DURATION_S)
+    stop.set()
+    # Requests still in flight at the end are abandoned, not waited for.
+    for user in users:
+        user.join(timeout=1.0)
+    return summarize(recorder, LOADTEST_DURATION_S)
+
+def summarize(recorder: Recorder, seconds: float) -> Dict:
+    endpoints = {}
+    total_requests, total_errors = 0, 0
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        errors = sum(recorder.errors.get(endpoint, {}).values())
+        total_requests += len(latencies)
+        total_errors += errors
+        latency_ms = {"mean": round(sum(latencies) / len(latencies) * 1000, 1), "max": round(max(latencies) * 1000, 1)}
+        for pct in LATENCY_PERCENTILES:
+            latency_ms[f"p{pct}"] = round(_percentile(latencies, pct) * 1000, 1)
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": round(errors / len(latencies), 4),
+            "throughput_rps": round(len(latencies) / seconds, 3),
+            "latency_ms": latency_ms,
+            "error_kinds": recorder.errors.get(endpoint, {}),
+        }
+    return {
+        "overall": {
+            "requests": total_requests,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+            "throughput_rps": round(total_requests / seconds, 3),
+            "conversations": recorder.conversations,
+            "conversations_per_minute": round(recorder.conversations / seconds * 60, 2),
+            "turns": recorder.turns,
+            "degradations": dict(recorder.degradations),
+        },
+        "endpoints": endpoints,
+    }
+
+def start_server(fakes: Dict, needs_audio: bool, log_path: Path) -> subprocess.Popen:
+    env = dict(os.environ,
+               OLLAMA_BASE_URL=fakes["ollama"].url,
+               MODEL_NAME="loadtest",
+               TTS_BACKEND="http",
+               TTS_HTTP_URL=f"{fakes['tts'].url}/api/tts",
+               # A fresh voice id per run keeps earlier runs' audio out of the cache.
+               TTS_HTTP_VOICE=f"loadtest-{uuid.uuid4().hex[:8]}",
+               TRANSLATION_API_URL=f"{fakes['translation'].url}/get",
+               TTS_WARMUP="false",
+               PRELOAD_COMPONENTS="retrieval,assistant,tts" + (",transcription" if needs_audio else ""))
+    env.setdefault("PROCEDURES_PATH", str(FIXTURE_PROCEDURES))
+    env.setdefault("LOG_LEVEL", "WARNING")
+    # Fail fast instead of hanging on a model download.
+    env.setdefault("HF_HUB_OFFLINE", "1")
+    env.setdefault("TRANSFORMERS_OFFLINE", "1")
+    os.makedirs(log_path.parent, exist_ok=True)
+    with open(log_path, "wb") as log_file:
+        return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(LOADTEST_PORT),
+                                 "--workers", str(LOADTEST_WORKERS), "--no-access-log"],
+                                cwd=APP_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(script_path: Path) -> Dict:
+    script_bytes = script_path.read_bytes()
+    script = json.loads(script_bytes)
+    needs_audio = any(turn["type"] == "audio" for conversation in script["conversations"] for turn in conversation["turns"])
+    started_at = datetime.now(timezone.utc)
+    fakes, server = {}, None
+    base_url = LOADTEST_BASE_URL.rstrip("/")
+    log_path = REPORT_DIR / f"server-{started_at:%Y%m%dT%H%M%S}.log"
+    try:
+        if not base_url:
+            fakes = start_fakes(LOADTEST_OLLAMA_PROFILE, LOADTEST_TTS_PROFILE, LOADTEST_TRANSLATION_PROFILE, LOADTEST_SEED)
+            base_url = f"http://127.0.0.1:{LOADTEST_PORT}"
+            server = start_server(fakes, needs_audio, log_path)
+            wait_until_ready(base_url, ["/health/ready"] + (["/health/ready/transcription"] if needs_audio else []),
+                             LOADTEST_WORKERS, LOADTEST_READY_TIMEOUT_S, server, log_path)
+        results = run_load(base_url, script)
+        try:
+            server_stats = requests.get(f"{base_url}/api/v1/stats", timeout=10).json().get("pipeline")
+        except (requests.RequestException, ValueError):
+            server_stats = None
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+        for fake in fakes.values():
+            fake.stop()
+    return {
+        "schema_version": REPORT_SCHEMA_VERSION,
+        "started_at": started_at.isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "config": {
+            "script": script.get("name", script_path.stem),
+            "script_sha256": hashlib.sha256(script_bytes).hexdigest()[:16],
+            "concurrency": LOADTEST_CONCURRENCY,
+            "duration_s": LOADTEST_DURATION_S,
+            "warmup_s": LOADTEST_WARMUP_S,
+            "seed": LOADTEST_SEED,
+            "workers": LOADTEST_WORKERS,
+            "request_timeout_s": LOADTEST_REQUEST_TIMEOUT_S,
+            "external_server": bool(LOADTEST_BASE_URL),
+        },
+        "fakes": {name: fake.stats() for name, fake in fakes.items()},
+        **results,
+        # Pipeline stage percentiles as seen by the worker that answered the stats call.
+        "server_pipeline": server_stats,
+    }
+
+def compare(base: Dict, new: Dict) -> Dict:
+    """Per-endpoint change in throughput, tail latency and error rate between two reports"""
+    differing = {key: [base["config"].get(key), new["config"].get(key)] for key in set(base["config"]) | set(new["config"])
+                 if key not in ("seed",) and base["config"].get(key) != new["config"].get(key)}
+    if base["host"].get("cpu_count") != new["host"].get("cpu_count"):
+        differing["cpu_count"] = [base["host"].get("cpu_count"), new["host"].get("cpu_count")]
+    endpoints = {}
+    for endpoint in sorted(set(base["endpoints"]) | set(new["endpoints"])):
+        before, after = base["endpoints"].get(endpoint), new["endpoints"].get(endpoint)
+        if not before or not after:
+            endpoints[endpoint] = {"only_in": "new" if after else "base"}
+            continue
+        change = {"throughput_rps": [before["throughput_rps"], after["throughput_rps"]],
+                  "error_rate": [before["error_rate"], after["error_rate"]]}
+        for pct in ("p50", "p95", "p99"):
+            change[f"{pct}_ms"] = [before["latency_ms"][pct], after["latency_ms"][pct]]
+        for values in change.values():
+            values.append(f"{(values[1] - values[0]) / values[0] * 100:+.1f}%" if values[0] else None)
+        endpoints[endpoint] = change
+    return {"base": base.get("git_commit"), "new": new.get("git_commit"), "config_differs": differing, "endpoints": endpoints}
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "compare":
+        reports = [json.loads(Path(path).read_text(encoding="utf-8")) for path in sys.argv[2:]]
+        print(json.dumps(compare(*reports), indent=2))
+        sys.exit(0)
+    script_path = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SCRIPT
+    print(f"--- Load test: {script_path.name}, {LOADTEST_CONCURRENCY} users, {LOADTEST_DURATION_S:.0f}s after {LOADTEST_WARMUP_S:.0f}s warm-up ---")
+    report = run(script_path)
+    report_path = Path(LOADTEST_REPORT) if LOADTEST_REPORT else REPORT_DIR / f"{report['config']['script']}-{report['started_at'].replace(':', '')}.json"
+    os.makedirs(report_path.parent, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(json.dumps({"overall": report["overall"], "endpoints": report["endpoints"]}, indent=2))
+    print(f"Report written to {report_path}")
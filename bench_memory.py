@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import os
+import json
+import time
+import signal
+import subprocess
+from loadtest.readiness import wait_until_ready
+
+# Starts gunicorn with and without SHARE_MODELS and reports per-worker memory once every model is loaded.
+# PSS splits each shared page between the processes mapping it, so it is the number that shows the saving.
+BENCH_WORKERS = int(os.getenv("BENCH_MEMORY_WORKERS", "4"))
+BENCH_PORT = int(os.getenv("BENCH_MEMORY_PORT", "8765"))
+READY_TIMEOUT_S = float(os.getenv("BENCH_MEMORY_READY_TIMEOUT_S", "600"))
+APP_DIR = Path(__file__).resolve().parent
+
+def _memory_kb(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[0].rstrip(":") in ("Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean", "Shared_Dirty"):
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "private_mb": round((fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024, 1),
+        "shared_mb": round((fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)) / 1024, 1),
+    }
+
+def _children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+        return [int(child) for child in f.read().split()]
+
+def measure(share_models: bool) -> dict:
+    env = dict(os.environ, SHARE_MODELS=str(share_models).lower(), WEB_CONCURRENCY=str(BENCH_WORKERS),
+               BIND=f"127.0.0.1:{BENCH_PORT}", TTS_WARMUP="false")
+    master = subprocess.Popen(["gunicorn", "-c", "gunicorn.conf.py", "main:app"], cwd=APP_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(f"http://127.0.0.1:{BENCH_PORT}", ["/health/ready/transcription"], BENCH_WORKERS, READY_TIMEOUT_S, master)
+        time.sleep(2)
+        workers = [_memory_kb(pid) for pid in _children(master.pid)]
+        total_pss = _memory_kb(master.pid)["pss_mb"] + sum(worker["pss_mb"] for worker in workers)
+        return {
+            "share_models": share_models,
+            "workers": len(workers),
+            "master": _memory_kb(master.pid),
+            "mean_worker_pss_mb": round(sum(worker["pss_mb"] for worker in workers) / max(1, len(workers)), 1),
+            "mean_worker_private_mb": round(sum(worker["private_mb"] for worker in workers) / max(1, len(workers)), 1),
+            "total_pss_mb": round(total_pss, 1),
+            "per_worker": workers,
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+
+if __name__ == "__main__":
+    if not Path("/proc/self/smaps_rollup").exists():
+        print("Error: this benchmark reads /proc/<pid>/smaps_rollup and needs Linux 4.14+.")
+        sys.exit(1)
+    print(f"--- Memory per worker, {BENCH_WORKERS} gunicorn workers ---")
+    results = [measure(share_models=False), measure(share_models=True)]
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import os
+import re
+import json
+import time
+import statistics
+import pytesseract # type: ignore
+from PIL import Image
+from agents.validation import ValidationAgent
+from agents.ocr_engine import create_ocr_engine
+from services.ocr_cache import OCRCache
+
+# Directory of sample CIN scans plus a labels.json mapping file name -> expected 8-digit number.
+SAMPLES_DIR = Path(os.getenv("OCR_BENCH_SAMPLES", str(Path(__file__).resolve().parent / "samples" / "cin")))
+LEGACY_CONFIG = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz '
+
+def legacy_read_cin(image_path: str):
+    """The original pipeline: full-resolution, full-page OCR, then an 8-digit regex"""
+    with Image.open(image_path) as img:
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        text = pytesseract.image_to_string(img, lang='ara+fra', config=LEGACY_CONFIG)
+    match = re.search(r'\b(\d{8})\b', text)
+    return match.group(1) if match else None
+
+def run(name: str, read_cin, samples: dict) -> dict:
+    timings, correct = [], 0
+    for filename, expected in samples.items():
+        start = time.perf_counter()
+        found = read_cin(str(SAMPLES_DIR / filename))
+        timings.append(time.perf_counter() - start)
+        correct += int(found == expected)
+    return {
+        "pipeline": name,
+        "documents": len(samples),
+        "mean_ms": round(statistics.mean(timings) * 1000, 1),
+        "p50_ms": round(statistics.median(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+        "accuracy": round(correct / len(samples), 3),
+    }
+
+if __name__ == "__main__":
+    labels_path = SAMPLES_DIR / "labels.json"
+    if not labels_path.exists():
+        print(f"Error: {labels_path} not found. Put sample scans and a labels.json in {SAMPLES_DIR}.")
+        sys.exit(1)
+    with open(labels_path, "r", encoding="utf-8") as f:
+        samples = json.load(f)
+    print(f"--- OCR benchmark on {len(samples)} CIN samples from {SAMPLES_DIR} ---")
+    results = [run("before: full-page OCR", legacy_read_cin, samples)]
+    # Same cascade on each engine: a tesseract process per call vs. warm in-process instances.
+    for engine_name in ("pytesseract", "tesserocr"):
+        try:
+            agent = ValidationAgent(ocr_engine=create_ocr_engine(engine_name))
+        except RuntimeError as e:
+            print(f"Skipping {engine_name}: {e}")
+            continue
+        # Every document must really be OCR'd, not served from the result cache.
+        agent.ocr_cache = OCRCache(enabled=False)
+        results.append(run(f"after: preprocessing + number-field ROI ({engine_name})", lambda path: agent.validate_cin(path)["cin_number"], samples))
+    print(json.dumps(results, indent=2))
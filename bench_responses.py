@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import os
+import json
+import time
+import statistics
+from models.schemas import AgentResponse
+from models.responses import AgentReply, dumps, orjson
+
+# Per-turn cost of building and serializing the agent's answer: the validated AgentResponse serialized the way
+# FastAPI does for response_model routes, against the slotted AgentReply serialized straight to JSON.
+BENCH_TURNS = int(os.getenv("BENCH_RESPONSES_TURNS", "20000"))
+BENCH_ROUNDS = int(os.getenv("BENCH_RESPONSES_ROUNDS", "5"))
+
+TURN_FIELDS = {
+    "response_text": "Parfait ! Pour votre demande de 'Souscription à une offre internet', voici ce dont vous avez besoin :\n"
+                     "• Type d'offre souhaitée : Fibre\n\n📄 Documents requis :\n• Copie de la CIN\n• Justificatif de domicile",
+    "todo_list": ["Copie de la CIN", "Justificatif de domicile", "RIB"],
+    "missing_context": [],
+    "is_complete": True,
+    "next_question": None,
+}
+
+def _fastapi_serialize(response: AgentResponse) -> bytes:
+    try:
+        from fastapi.encoders import jsonable_encoder # type: ignore
+        payload = jsonable_encoder(response)
+    except ImportError:
+        payload = response.model_dump() if hasattr(response, "model_dump") else response.dict()
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def pydantic_turn() -> bytes:
+    # The assistant's answer, then the orchestrator's annotations, then the route's validation and encoding.
+    response = AgentResponse(**TURN_FIELDS)
+    response.detected_language = "fr"
+    response.audio_response_url = "/api/v1/audio/ab12cd34"
+    validated = AgentResponse(**(response.model_dump() if hasattr(response, "model_dump") else response.dict()))
+    return _fastapi_serialize(validated)
+
+def slotted_turn() -> bytes:
+    reply = AgentReply(**TURN_FIELDS)
+    reply.detected_language = "fr"
+    reply.audio_response_url = "/api/v1/audio/ab12cd34"
+    return dumps(reply.to_dict())
+
+def bench(turn) -> dict:
+    per_turn_us = []
+    for _ in range(BENCH_ROUNDS):
+        start = time.perf_counter()
+        for _ in range(BENCH_TURNS):
+            turn()
+        per_turn_us.append((time.perf_counter() - start) / BENCH_TURNS * 1e6)
+    return {"per_turn_us_median": round(statistics.median(per_turn_us), 2), "per_turn_us_min": round(min(per_turn_us), 2)}
+
+if __name__ == "__main__":
+    assert json.loads(pydantic_turn()) == json.loads(slotted_turn())
+    print(f"--- Response model benchmark ({BENCH_TURNS} turns x {BENCH_ROUNDS} rounds, encoder={'orjson' if orjson else 'json'}) ---")
+    results = {"pydantic": bench(pydantic_turn), "slotted": bench(slotted_turn)}
+    results["saving_us_per_turn"] = round(results["pydantic"]["per_turn_us_median"] - results["slotted"]["per_turn_us_median"], 2)
+    results["speedup"] = round(results["pydantic"]["per_turn_us_median"] / results["slotted"]["per_turn_us_median"], 2)
+    print(json.dumps(results, indent=2))
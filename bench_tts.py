@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import os
+import json
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from services.tts_backends import create_tts_backend
+from agents.assistant import CONTEXT_QUESTIONS, NO_PROCEDURE_FOUND_TEXT
+
+BENCH_TEXTS = [NO_PROCEDURE_FOUND_TEXT] + list(CONTEXT_QUESTIONS.values())
+BENCH_LANG = os.getenv("BENCH_TTS_LANG", "fr")
+BENCH_ROUNDS = int(os.getenv("BENCH_TTS_ROUNDS", "3"))
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def bench_backend(name: str) -> dict:
+    load_start = time.perf_counter()
+    backend = create_tts_backend(name)
+    load_seconds = time.perf_counter() - load_start
+    texts = BENCH_TEXTS * BENCH_ROUNDS
+    latencies = []
+    for text in texts:
+        start = time.perf_counter()
+        backend.synthesize(text, BENCH_LANG)
+        latencies.append(time.perf_counter() - start)
+    cores = os.cpu_count() or 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cores) as pool:
+        list(pool.map(lambda text: backend.synthesize(text, BENCH_LANG), texts))
+    parallel_seconds = time.perf_counter() - start
+    return {
+        "backend": name,
+        "load_seconds": round(load_seconds, 3),
+        "utterances": len(texts),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "latency_p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "sequential_utterances_per_second": round(len(texts) / sum(latencies), 2),
+        "parallel_utterances_per_second": round(len(texts) / parallel_seconds, 2),
+        "utterances_per_second_per_core": round(len(texts) / parallel_seconds / cores, 2),
+        "cores": cores,
+    }
+
+if __name__ == "__main__":
+    backends = sys.argv[1:] or ["gtts", "piper"]
+    print(f"--- TTS backend benchmark ({len(BENCH_TEXTS)} texts x {BENCH_ROUNDS} rounds, lang={BENCH_LANG}) ---")
+    results = []
+    for name in backends:
+        try:
+            results.append(bench_backend(name))
+        except Exception as e:
+            print(f"Skipping backend '{name}': {e}")
+    print(json.dumps(results, indent=2))
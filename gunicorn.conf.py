@@ -0,0 +1,30 @@
+import os
+import gc
+
+# Preforking deployment: gunicorn -c gunicorn.conf.py main:app
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# Import main.py once in the master; with SHARE_MODELS the read-only models are loaded there too,
+# and every worker forked afterwards shares their pages copy-on-write instead of loading its own.
+preload_app = True
+SHARE_MODELS = os.getenv("SHARE_MODELS", "true").lower() == "true"
+# Each worker counts its own requests; they share their series through this directory so /metrics, served by any one
+# of them, reports the whole server. Set before main.py is preloaded, which reads it.
+os.environ.setdefault("METRICS_MULTIPROC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "metrics"))
+
+def on_starting(server):
+    from services.metrics import clear_multiprocess_dir
+    clear_multiprocess_dir(os.environ["METRICS_MULTIPROC_DIR"])
+
+def when_ready(server):
+    if not SHARE_MODELS:
+        return
+    import main
+    if not main.orchestrator:
+        return
+    main.orchestrator.load_shared()
+    # Keep the collector from writing to (and so un-sharing) every object loaded so far.
+    gc.freeze()
+    server.log.info("Shared models loaded in master: %s", main.orchestrator.readiness())
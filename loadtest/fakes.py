@@ -0,0 +1,179 @@
+import json
+import time
+import random
+import threading
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Named fault profiles; anything else is parsed as "latency_ms=..,jitter_ms=..,error_rate=..,error_status=..,hang_rate=..,hang_s=..".
+PROFILES = {
+    "instant": "latency_ms=0",
+    "fast": "latency_ms=20,jitter_ms=5",
+    "typical": "latency_ms=150,jitter_ms=50",
+    "slow": "latency_ms=1500,jitter_ms=500",
+    "flaky": "latency_ms=150,jitter_ms=50,error_rate=0.05,error_status=503,hang_rate=0.01",
+}
+
+Reply = Tuple[int, str, bytes]
+
+class FaultProfile:
+    """Latency and failures a fake server injects: a normal-ish delay, then maybe an error status or a hang."""
+    __slots__ = ("latency_ms", "jitter_ms", "error_rate", "error_status", "hang_rate", "hang_s")
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0, error_status: int = 500, hang_rate: float = 0.0, hang_s: float = 120.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+
+    @classmethod
+    def parse(cls, spec: str) -> "FaultProfile":
+        spec = PROFILES.get(spec, spec)
+        values = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            key, _, value = item.partition("=")
+            if key not in cls.__slots__:
+                raise ValueError(f"Unknown fault profile setting '{key}' in '{spec}'.")
+            values[key] = int(value) if key == "error_status" else float(value)
+        return cls(**values)
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class FakeService(ABC):
+    """Answers one upstream API; FakeServer wraps it with the fault profile and request accounting."""
+    name = "fake"
+
+    @abstractmethod
+    def handle(self, method: str, path: str, query: Dict, body: bytes) -> Reply:
+        """Status, content type and body for one request."""
+
+def _json_reply(payload: Dict, status: int = 200) -> Reply:
+    return status, "application/json", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def first_listed_procedure(prompt: str) -> str:
+    """What a well-behaved model answers to the intent prompt: the first "- " procedure it lists, else "unknown"."""
+    listed = [line.strip()[2:] for line in prompt.splitlines() if line.strip().startswith("- ")]
+    return listed[0] if listed else "unknown"
+
+class FakeOllama(FakeService):
+    """/api/generate: answers with first_listed_procedure() of the prompt."""
+    name = "ollama"
+
+    def handle(self, method: str, path: str, query: Dict, body: bytes) -> Reply:
+        if path == "/api/tags":
+            return _json_reply({"models": [{"name": "loadtest"}]})
+        if method != "POST" or path != "/api/generate":
+            return _json_reply({"error": "not found"}, 404)
+        prompt = json.loads(body or b"{}").get("prompt", "")
+        return _json_reply({"model": "loadtest", "response": first_listed_procedure(prompt), "done": True})
+
+class FakeTTS(FakeService):
+    """POST {"text", "lang"}: MP3-sized silence, about as many bytes as gTTS returns for the text."""
+    name = "tts"
+    # MPEG-1 layer III, 32 kbps, 44.1 kHz frame header; the body after it is zero padding.
+    _FRAME = b"\xff\xfb\x10\xc4" + b"\x00" * 100
+
+    def handle(self, method: str, path: str, query: Dict, body: bytes) -> Reply:
+        text = json.loads(body or b"{}").get("text", "")
+        # Roughly 15 characters of speech per second at 4000 bytes per second.
+        frames = max(1, int(len(text) / 15 * 4000) // len(self._FRAME))
+        return 200, "audio/mpeg", self._FRAME * frames
+
+class FakeTranslation(FakeService):
+    """MyMemory-compatible GET ?q=&langpair=: echoes the query back as its own translation."""
+    name = "translation"
+
+    def handle(self, method: str, path: str, query: Dict, body: bytes) -> Reply:
+        text = query.get("q", [""])[0]
+        return _json_reply({"responseData": {"translatedText": text, "match": 1}, "responseStatus": 200})
+
+class FakeServer:
+    """Serves a FakeService on 127.0.0.1 from a background thread, injecting its fault profile."""
+
+    def __init__(self, service: FakeService, profile: FaultProfile, seed: int = 0):
+        self.service = service
+        self.profile = profile
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "injected_errors": 0, "injected_hangs": 0}
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=f"fake-{self.service.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return dict(self._stats, profile=self.profile.as_dict())
+
+    def _draw(self) -> Tuple[float, float]:
+        with self._rng_lock:
+            delay = max(0.0, self._rng.gauss(self.profile.latency_ms, self.profile.jitter_ms)) / 1000.0
+            return delay, self._rng.random()
+
+    def _respond(self, method: str, path: str, query: Dict, body: bytes) -> Reply:
+        delay, roll = self._draw()
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            if roll < self.profile.hang_rate:
+                self._stats["injected_hangs"] += 1
+            elif roll < self.profile.hang_rate + self.profile.error_rate:
+                self._stats["injected_errors"] += 1
+        if roll < self.profile.hang_rate:
+            time.sleep(self.profile.hang_s)
+            return _json_reply({"error": "injected hang"}, 504)
+        time.sleep(delay)
+        if roll < self.profile.hang_rate + self.profile.error_rate:
+            return _json_reply({"error": "injected failure"}, self.profile.error_status)
+        return self.service.handle(method, path, query, body)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, content_type, payload = server._respond(self.command, parts.path, parse_qs(parts.query), body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _serve
+            do_POST = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def start_fakes(ollama: str = "fast", tts: str = "fast", translation: str = "fast", seed: int = 0) -> Dict[str, FakeServer]:
+    """Start the three upstream stand-ins with the given fault profiles"""
+    return {
+        "ollama": FakeServer(FakeOllama(), FaultProfile.parse(ollama), seed).start(),
+        "tts": FakeServer(FakeTTS(), FaultProfile.parse(tts), seed + 1).start(),
+        "translation": FakeServer(FakeTranslation(), FaultProfile.parse(translation), seed + 2).start(),
+    }
@@ -0,0 +1,128 @@
+import os
+import sys
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+from services.metrics import add_stage_listener, remove_stage_listener
+
+# Time spent outside any pipeline stage (orchestration, schema building) is attributed to this bucket.
+UNSTAGED = "unstaged"
+
+class StageProfiler:
+    """One cProfile per pipeline stage on the profiled thread; nested stages pause their parent's profile."""
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self._stack: List[str] = []
+
+    def _profile(self, name: str) -> cProfile.Profile:
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        return profile
+
+    def _on_stage(self, name: str, entering: bool):
+        if threading.get_ident() != self.thread_id:
+            return
+        self._profile(self._stack[-1] if self._stack else UNSTAGED).disable()
+        if entering:
+            self._stack.append(name)
+        elif self._stack:
+            self._stack.pop()
+        self._profile(self._stack[-1] if self._stack else UNSTAGED).enable()
+
+    def __enter__(self):
+        add_stage_listener(self._on_stage)
+        self._profile(UNSTAGED).enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        for profile in self.profiles.values():
+            profile.disable()
+        remove_stage_listener(self._on_stage)
+        return False
+
+    def write(self, directory: Path, top: int = 10) -> Dict:
+        """Dump stage-<name>.prof per stage and all.prof, and return each stage's own time and hottest functions"""
+        os.makedirs(directory, exist_ok=True)
+        summary = {}
+        for name, profile in sorted(self.profiles.items()):
+            stats = pstats.Stats(profile)
+            stats.dump_stats(str(directory / f"stage-{name}.prof"))
+            hottest = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            summary[name] = {
+                "seconds": round(stats.total_tt, 4),
+                "top_cumulative": [
+                    {"function": f"{func[2]} ({Path(func[0]).name}:{func[1]})", "calls": calls, "cumulative_ms": round(cumulative * 1000, 2)}
+                    for func, (_, calls, _, cumulative, _) in hottest
+                ],
+            }
+        if self.profiles:
+            pstats.Stats(*self.profiles.values()).dump_stats(str(directory / "all.prof"))
+        return summary
+
+class StackSampler:
+    """py-spy-style sampling of one thread into folded stacks ("stage:a;func;func count"), for flame graph tools."""
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self.thread_id = threading.get_ident()
+        self.folded: Counter = Counter()
+        self.samples_by_stage: Counter = Counter()
+        self._stack: List[str] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._switch_interval = sys.getswitchinterval()
+
+    def _on_stage(self, name: str, entering: bool):
+        if threading.get_ident() != self.thread_id:
+            return
+        if entering:
+            self._stack.append(name)
+        elif self._stack:
+            self._stack.pop()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stages = list(self._stack)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.folded[";".join([f"stage:{name}" for name in stages or [UNSTAGED]] + frames[::-1])] += 1
+            self.samples_by_stage[stages[-1] if stages else UNSTAGED] += 1
+
+    def __enter__(self):
+        add_stage_listener(self._on_stage)
+        # The sampler only runs when the profiled thread yields the GIL; make that happen at least once per interval.
+        sys.setswitchinterval(min(self._switch_interval, self.interval_s / 2))
+        self._thread = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+        remove_stage_listener(self._on_stage)
+        return False
+
+    def write(self, directory: Path) -> Dict:
+        """Write replay.folded (flamegraph.pl, speedscope, inferno) and return the share of samples per stage"""
+        os.makedirs(directory, exist_ok=True)
+        with open(directory / "replay.folded", "w", encoding="utf-8") as f:
+            for stack, count in self.folded.most_common():
+                f.write(f"{stack} {count}\n")
+        total = sum(self.samples_by_stage.values())
+        return {
+            name: {"samples": count, "share": round(count / total, 4), "approx_seconds": round(count * self.interval_s, 3)}
+            for name, count in self.samples_by_stage.most_common()
+        }
@@ -0,0 +1,27 @@
+import time
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+import requests
+
+def wait_until_ready(base_url: str, paths: List[str], workers: int, timeout_s: float,
+                     server: Optional[subprocess.Popen] = None, log_path: Optional[Path] = None):
+    """Block until every path of a freshly started server answers 200 on all of its workers.
+
+    Requests land on arbitrary workers; several ready answers in a row means every worker has its models.
+    Raises RuntimeError if server exits first and TimeoutError after timeout_s.
+    """
+    see_log = f"; see {log_path}" if log_path else ""
+    deadline = time.monotonic() + timeout_s
+    for path in paths:
+        streak = 0
+        while streak < workers * 3:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}{see_log}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{base_url}{path} not ready after {timeout_s:.0f}s{see_log}")
+            try:
+                streak = streak + 1 if requests.get(f"{base_url}{path}", timeout=5).status_code == 200 else 0
+            except requests.RequestException:
+                streak = 0
+            time.sleep(0.5)
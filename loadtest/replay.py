@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import logging
+import time
+import uuid
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from models.responses import AgentReply
+from services.metrics import metrics
+from loadtest.fakes import first_listed_procedure
+from loadtest.profiling import StageProfiler, StackSampler
+
+if TYPE_CHECKING:
+    from agents.orchestrator import MainOrchestrator
+
+# Replays recorded conversations through MainOrchestrator.process_user_input and checks the final responses.
+#   python -m loadtest.replay [transcripts.jsonl ...]     exit status 1 when an expectation fails
+# Each line is one conversation:
+#   {"id": "...", "turns": [{"user": "...", "lang": "ar", "translation": "...", "expect": {...}}], "expect": {...}}
+# "lang" skips language detection, "translation" stands in for the translation service, and "expect" (per turn,
+# and for the final response) takes the keys of EXPECTATION_KEYS.
+# To baseline after a pipeline change, run with REPLAY_UPDATE=true where the models are installed, review the diff of
+# <transcripts>.observed.jsonl against the transcripts, and copy it over them.
+LOADTEST_DIR = Path(__file__).resolve().parent
+DEFAULT_TRANSCRIPTS = LOADTEST_DIR / "transcripts" / "dialogues.jsonl"
+FIXTURE_PROCEDURES = LOADTEST_DIR / "fixtures" / "procedures.json"
+# stub: first procedure listed in the prompt; replay: answers recorded in REPLAY_LLM_CACHE, a miss fails the
+# conversation; record: ask Ollama and add its answers to the cache.
+REPLAY_LLM = os.getenv("REPLAY_LLM", "stub").lower()
+REPLAY_LLM_CACHE = Path(os.getenv("REPLAY_LLM_CACHE", str(LOADTEST_DIR / "transcripts" / "llm_cache.json")))
+# off, cprofile (one .prof per pipeline stage) or sample (folded stacks for a flame graph).
+REPLAY_PROFILE = os.getenv("REPLAY_PROFILE", "off").lower()
+REPLAY_PROFILE_DIR = Path(os.getenv("REPLAY_PROFILE_DIR", str(LOADTEST_DIR.parent / "cache" / "replay")))
+REPLAY_SAMPLE_INTERVAL_MS = float(os.getenv("REPLAY_SAMPLE_INTERVAL_MS", "5"))
+# Also write <transcripts>.observed.jsonl with every expectation replaced by what was observed, to re-baseline.
+REPLAY_UPDATE = os.getenv("REPLAY_UPDATE", "false").lower() == "true"
+
+EXPECTATION_KEYS = ("is_complete", "todo_list", "todo_list_contains", "missing_context", "missing_context_contains",
+                    "next_question", "response_contains", "response_not_contains")
+
+class ReplayLLM:
+    """Deterministic stand-in for the assistant's Ollama call: a stub, or a cache of recorded answers"""
+
+    def __init__(self, mode: str = REPLAY_LLM, cache_path: Path = REPLAY_LLM_CACHE, upstream: Optional[Callable[[str, str], str]] = None):
+        if mode not in ("stub", "replay", "record"):
+            raise ValueError(f"Unknown REPLAY_LLM '{mode}'. Expected 'stub', 'replay' or 'record'.")
+        self.mode = mode
+        self.cache_path = cache_path
+        self.upstream = upstream
+        self.model_name = os.getenv("MODEL_NAME", "llama3")
+        self.cache: Dict[str, str] = json.loads(cache_path.read_text(encoding="utf-8")) if mode != "stub" and cache_path.exists() else {}
+        self.calls = 0
+        self.recorded = 0
+
+    def _key(self, prompt: str, system_prompt: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{system_prompt}\0{prompt}".encode("utf-8")).hexdigest()[:32]
+
+    def __call__(self, prompt: str, system_prompt: str = "") -> str:
+        self.calls += 1
+        if self.mode == "stub":
+            return first_listed_procedure(prompt)
+        key = self._key(prompt, system_prompt)
+        if key in self.cache:
+            return self.cache[key]
+        if self.mode == "replay":
+            raise KeyError(f"No recorded LLM answer for prompt {key}; record it with REPLAY_LLM=record.")
+        answer = self.upstream(prompt, system_prompt)
+        self.cache[key] = answer
+        self.recorded += 1
+        return answer
+
+    def save(self):
+        if self.mode == "record" and self.recorded:
+            os.makedirs(self.cache_path.parent, exist_ok=True)
+            self.cache_path.write_text(json.dumps(self.cache, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+
+class TranscriptTranslator:
+    """Translations recorded in the transcripts; text without one is searched untranslated, as on a service failure"""
+
+    def __init__(self, conversations: List[Dict]):
+        self.translations = {turn["user"]: turn["translation"] for conversation in conversations
+                             for turn in conversation["turns"] if turn.get("translation")}
+        self.misses = 0
+
+    def __call__(self, text: str, source_lang: str) -> str:
+        translation = self.translations.get(text)
+        if translation is None:
+            self.misses += 1
+            return text
+        return translation
+
+def load_transcripts(paths: List[Path]) -> List[Dict]:
+    conversations = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    conversation = json.loads(line)
+                    conversation["_source"] = f"{path.name}:{line_number}"
+                    conversations.append(conversation)
+    return conversations
+
+def check_expectations(response: AgentReply, expect: Dict) -> List[str]:
+    """Failed expectations, as readable messages"""
+    failures = []
+    for key, expected in expect.items():
+        if key in ("is_complete", "todo_list", "missing_context", "next_question"):
+            actual = getattr(response, key)
+            if actual != expected:
+                failures.append(f"{key}: expected {expected!r}, got {actual!r}")
+        elif key in ("todo_list_contains", "missing_context_contains"):
+            actual = getattr(response, key[:-len("_contains")])
+            missing = [item for item in expected if item not in actual]
+            if missing:
+                failures.append(f"{key[:-len('_contains')]} lacks {missing!r} (got {actual!r})")
+        elif key == "response_contains":
+            failures.extend(f"response_text lacks {text!r}" for text in expected if text not in response.response_text)
+        elif key == "response_not_contains":
+            failures.extend(f"response_text contains {text!r}" for text in expected if text in response.response_text)
+        else:
+            failures.append(f"unknown expectation '{key}' (expected one of {', '.join(EXPECTATION_KEYS)})")
+    return failures
+
+def observed_expectations(response: AgentReply) -> Dict:
+    return {"is_complete": response.is_complete, "todo_list": response.todo_list,
+            "missing_context": response.missing_context, "next_question": response.next_question}
+
+def build_orchestrator(procedures_path: str, llm: ReplayLLM, translate_fn: TranscriptTranslator) -> "MainOrchestrator":
+    from agents.orchestrator import MainOrchestrator
+    from agents.assistant import AIAssistantAgent
+    from agents.retrieval import RetrievalAgent
+    orchestrator = MainOrchestrator(procedures_path)
+    orchestrator.components.register("assistant", lambda: AIAssistantAgent(llm=llm))
+    orchestrator.components.register("retrieval", lambda: RetrievalAgent(procedures_path, translate_fn=translate_fn))
+    return orchestrator
+
+def replay_conversation(orchestrator: "MainOrchestrator", conversation: Dict) -> Dict:
+    # A fresh user per replay, so the assistant's per-user history never carries over between conversations.
+    user_id = f"replay-{conversation.get('id', 'conversation')}-{uuid.uuid4().hex[:8]}"
+    result = {"id": conversation.get("id"), "source": conversation["_source"], "turns": [], "failures": []}
+    response = None
+    for index, turn in enumerate(conversation["turns"], start=1):
+        start = time.perf_counter()
+        try:
+            response = orchestrator.process_user_input(turn["user"], user_id, source_lang=turn.get("lang"))
+        except Exception as e:
+            result["failures"].append(f"turn {index}: {type(e).__name__}: {e}")
+            response = None
+            break
+        turn_failures = [f"turn {index}: {failure}" for failure in check_expectations(response, turn.get("expect", {}))]
+        result["failures"].extend(turn_failures)
+        result["turns"].append({"elapsed_ms": round((time.perf_counter() - start) * 1000, 2), "observed": observed_expectations(response)})
+    if response is not None:
+        result["failures"].extend(f"final: {failure}" for failure in check_expectations(response, conversation.get("expect", {})))
+    result["passed"] = not result["failures"]
+    return result
+
+def write_observed(path: Path, conversations: List[Dict], results: List[Dict]):
+    by_source = {result["source"]: result for result in results}
+    with open(path.with_suffix(".observed.jsonl"), "w", encoding="utf-8") as f:
+        for conversation in conversations:
+            result = by_source.get(conversation["_source"])
+            if not result or not conversation["_source"].startswith(f"{path.name}:"):
+                continue
+            updated = {key: value for key, value in conversation.items() if key != "_source"}
+            updated["turns"] = [dict(turn, expect=observed["observed"]) for turn, observed in zip(conversation["turns"], result["turns"])]
+            if result["turns"]:
+                updated["expect"] = result["turns"][-1]["observed"]
+            f.write(json.dumps(updated, ensure_ascii=False) + "\n")
+
+def run(paths: List[Path], procedures_path: str) -> Dict:
+    conversations = load_transcripts(paths)
+    upstream = None
+    if REPLAY_LLM == "record":
+        from agents.assistant import AIAssistantAgent
+        upstream = AIAssistantAgent()._call_ollama
+    llm = ReplayLLM(upstream=upstream)
+    translate_fn = TranscriptTranslator(conversations)
+    orchestrator = build_orchestrator(procedures_path, llm, translate_fn)
+    # Loaded up front so model loading is neither timed nor profiled.
+    orchestrator.components.load(["retrieval", "assistant"])
+    profiler = None
+    if REPLAY_PROFILE == "cprofile":
+        profiler = StageProfiler()
+    elif REPLAY_PROFILE == "sample":
+        profiler = StackSampler(REPLAY_SAMPLE_INTERVAL_MS / 1000.0)
+    elif REPLAY_PROFILE != "off":
+        raise ValueError(f"Unknown REPLAY_PROFILE '{REPLAY_PROFILE}'. Expected 'off', 'cprofile' or 'sample'.")
+    start = time.perf_counter()
+    if profiler is not None:
+        with profiler:
+            results = [replay_conversation(orchestrator, conversation) for conversation in conversations]
+    else:
+        results = [replay_conversation(orchestrator, conversation) for conversation in conversations]
+    elapsed = time.perf_counter() - start
+    llm.save()
+    if REPLAY_UPDATE:
+        for path in paths:
+            write_observed(path, conversations, results)
+    return {
+        "conversations": len(results),
+        "passed": sum(1 for result in results if result["passed"]),
+        "failed": [{"id": result["id"], "source": result["source"], "failures": result["failures"]} for result in results if not result["passed"]],
+        "turns": sum(len(result["turns"]) for result in results),
+        "elapsed_s": round(elapsed, 3),
+        "llm": {"mode": llm.mode, "calls": llm.calls, "recorded": llm.recorded},
+        "untranslated_queries": translate_fn.misses,
+        "stages": metrics.summary()["stages"],
+        "profile": profiler.write(REPLAY_PROFILE_DIR) if profiler is not None else None,
+        "profile_dir": str(REPLAY_PROFILE_DIR) if profiler is not None else None,
+    }
+
+if __name__ == "__main__":
+    # Keep per-turn events out of the report on stdout unless asked for.
+    logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "WARNING").upper())
+    transcript_paths = [Path(arg) for arg in sys.argv[1:]] or [DEFAULT_TRANSCRIPTS]
+    report = run(transcript_paths, os.getenv("PROCEDURES_PATH", str(FIXTURE_PROCEDURES)))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(1 if report["failed"] else 0)
@@ -1,19 +1,55 @@
 import os
+import re
+import json
+import time
 import uuid
 import shutil
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, BackgroundTasks # type: ignore
-from fastapi.staticfiles import StaticFiles # type: ignore
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
+from starlette.concurrency import run_in_threadpool # type: ignore
 from models.schemas import UserQuery, AgentResponse, UserTextQuery
-from agents.orchestrator import MainOrchestrator, PROCEDURES_DEFAULT_PATH
+from models.responses import AgentReply, dumps
+from agents.orchestrator import MainOrchestrator, PROCEDURES_DEFAULT_PATH, TEXT_PATH_COMPONENTS
+from services.components import ComponentUnavailable
+from agents.validation import infer_document_type
+from services.validation_pool import ValidationPool
+from services.scheduler import Scheduler, SchedulerRejected, Ticket, WORK_CLASSES
+from services.deadline import REQUEST_DEADLINE_AUDIO_S, REQUEST_DEADLINE_TEXT_S, budget_from_header, request_deadline
+from services.ocr_cache import ensure_encryption_key
+from services.audio_store import ensure_url_secret
+from services.metrics import metrics, start_request_timing, finish_request_timing, server_timing_header
+from services.log import get_logger, set_request_id, reset_request_id
 from dotenv import load_dotenv
 
+log = get_logger("main")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models load in background threads; the server accepts connections (and /health/live) right away.
+    global validation_pool, scheduler
+    # Created per worker: a process pool built in a preforking master would share its pipes with every worker.
+    validation_pool = ValidationPool()
+    # Per worker as well: its queues live on this worker's event loop.
+    scheduler = Scheduler()
+    metrics.start_multiprocess_export()
+    if orchestrator:
+        orchestrator.preload()
+        if TTS_WARMUP_ENABLED:
+            # gTTS is network-bound; warm the cache in the background so startup isn't delayed.
+            threading.Thread(target=orchestrator.warm_up_tts_cache, name="tts-warmup", daemon=True).start()
+    yield
+    validation_pool.shutdown()
+
 app = FastAPI(
     title="INNOVISION Voice Assistant API",
     description="API for interacting with the INNOVISION voice assistant.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -26,44 +62,117 @@ app.add_middleware(
 
 APP_DIR = Path(__file__).resolve().parent 
 BACKEND_DIR = APP_DIR.parent 
-STATIC_DIR = APP_DIR / "static"
-GENERATED_AUDIO_DIR = STATIC_DIR / "generated_audio"
-os.makedirs(GENERATED_AUDIO_DIR, exist_ok=True)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 TEMP_UPLOADS_DIR = APP_DIR / "temp_uploads"
 os.makedirs(TEMP_UPLOADS_DIR, exist_ok=True)
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "20")) * 1024 * 1024)
+# Chunked uploads that were never validated are removed after this long.
+UPLOAD_TTL_SECONDS = 3600
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
 
-PROCEDURES_JSON_PATH = str(BACKEND_DIR / "data" / "procedures.json")
+PROCEDURES_JSON_PATH = os.getenv("PROCEDURES_PATH", str(BACKEND_DIR / "data" / "procedures.json"))
 if not Path(PROCEDURES_JSON_PATH).exists():
     if Path(PROCEDURES_DEFAULT_PATH).exists():
          PROCEDURES_JSON_PATH = PROCEDURES_DEFAULT_PATH
     else:
-        print(f"FATAL: procedures.json not found at {PROCEDURES_JSON_PATH} or {PROCEDURES_DEFAULT_PATH}")
+        log.error("procedures.not_found", path=PROCEDURES_JSON_PATH, default_path=PROCEDURES_DEFAULT_PATH)
 
 dotenv_path = BACKEND_DIR / '.env'
 if dotenv_path.exists():
     load_dotenv(dotenv_path=dotenv_path)
 else:
-    print(f"Warning: .env file not found at {dotenv_path}. Ollama settings might be missing.")
+    log.warning("dotenv.not_found", path=str(dotenv_path))
 
 try:
     orchestrator = MainOrchestrator(procedures_path=PROCEDURES_JSON_PATH)
 except FileNotFoundError as e:
-    print(f"Failed to initialize orchestrator: {e}")
-    print("Please ensure 'procedures.json' is correctly placed and paths are configured.")
+    log.error("orchestrator.init_failed", error=str(e), hint="check that procedures.json is in place")
     orchestrator = None
 except RuntimeError as e:
-    print(f"Failed to initialize orchestrator due to runtime error: {e}")
+    log.error("orchestrator.init_failed", error=str(e))
     orchestrator = None
 
+validation_pool: Optional[ValidationPool] = None
+scheduler: Optional[Scheduler] = None
+# Under a preloading server this runs once in the master, so all workers share the OCR cache key and verify each
+# other's signed audio URLs.
+ensure_encryption_key()
+ensure_url_secret()
+
+TTS_WARMUP_ENABLED = os.getenv("TTS_WARMUP", "true").lower() == "true"
+
+# Per-request stage breakdown in a Server-Timing header: always, or when the client sends "X-Server-Timing: 1".
+SERVER_TIMING_ALWAYS = os.getenv("SERVER_TIMING", "false").lower() == "true"
+metrics.describe("http_request_duration_seconds", "histogram", "HTTP request duration in seconds by route")
+# Request ids supplied by a proxy or client are kept (so their logs line up with ours) when they look like ids.
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+@app.middleware("http")
+async def record_request_timing(request: Request, call_next):
+    incoming_id = request.headers.get("x-request-id", "")
+    request_id = incoming_id if _REQUEST_ID_RE.match(incoming_id) else uuid.uuid4().hex
+    # Set before the handler runs so every log line of the request, including from run_in_threadpool, carries it.
+    request_id_token = set_request_id(request_id)
+    token = start_request_timing()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        timings = finish_request_timing(token)
+        reset_request_id(request_id_token)
+    elapsed = time.perf_counter() - start
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.observe("http_request_duration_seconds", elapsed, route=route)
+    response.headers["X-Request-ID"] = request_id
+    if SERVER_TIMING_ALWAYS or request.headers.get("x-server-timing") == "1":
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    log.debug("request.completed", route=route, status=response.status_code, duration_ms=round(elapsed * 1000, 1), request_id=request_id)
+    return response
+
+@app.exception_handler(ComponentUnavailable)
+async def component_unavailable_handler(request: Request, exc: ComponentUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(SchedulerRejected)
+async def scheduler_rejected_handler(request: Request, exc: SchedulerRejected):
+    headers = {"Retry-After": str(max(1, round(exc.retry_after_s)))}
+    return JSONResponse(status_code=exc.status_code, headers=headers, content={"detail": str(exc), "reason": exc.reason, "queue": exc.estimate})
+
 def cleanup_temp_file(file_path: str):
     try:
         if os.path.exists(file_path):
             os.remove(file_path)
-            print(f"Cleaned up temp file: {file_path}")
     except Exception as e:
-        print(f"Error cleaning up temp file {file_path}: {e}")
+        log.warning("temp_file.cleanup_failed", error=str(e))
+
+def _upload_path(upload_id: str) -> Path:
+    if not _UPLOAD_ID_RE.match(upload_id):
+        raise HTTPException(status_code=400, detail="Invalid upload id.")
+    return TEMP_UPLOADS_DIR / f"upload_{upload_id}.part"
+
+def _remove_stale_uploads():
+    cutoff = time.time() - UPLOAD_TTL_SECONDS
+    for path in TEMP_UPLOADS_DIR.glob("upload_*.part"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                cleanup_temp_file(str(path))
+        except FileNotFoundError:
+            pass
+
+def _uploaded_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+def _append_chunk(path: Path, data: bytes):
+    with open(path, "ab") as buffer:
+        buffer.write(data)
+
+def _reply_response(reply: AgentReply, ticket: Ticket) -> Response:
+    # Serialized here, once; response_model on the routes still documents the AgentResponse schema.
+    return Response(content=dumps(reply.to_dict()), media_type="application/json", headers=ticket.headers())
 
 @app.get("/", tags=["General"])
 async def read_root():
@@ -73,16 +182,26 @@ async def read_root():
 async def process_text_query(query: UserTextQuery, request: Request):
     if not orchestrator:
         raise HTTPException(status_code=503, detail="Orchestrator not available. Service is down.")
-    print(f"Received text query from {request.client.host} for user {query.user_id}: {query.text}")
+    log.info("api.text_query", client_ip=request.client.host if request.client else None, user_id=query.user_id)
     generate_tts_param = request.query_params.get("tts", "false").lower()
     should_generate_tts = generate_tts_param == "true"
+    should_stream_tts = request.query_params.get("tts_stream", "false").lower() == "true"
+    should_inline_tts = request.query_params.get("tts_inline", "false").lower() == "true"
     user_q = UserQuery(text=query.text, user_id=query.user_id)
-    agent_response = orchestrator.process_with_optional_voice_output(
-        query=user_q,
-        audio_file_path=None,
-        generate_tts=should_generate_tts
-    )
-    return agent_response
+    # The budget covers the queue wait too; run_in_threadpool carries it into the pipeline.
+    with request_deadline(budget_from_header(request.headers.get("x-request-timeout-ms"), REQUEST_DEADLINE_TEXT_S)):
+        ticket = scheduler.admit("text", query.user_id)
+        async with scheduler.slot(ticket):
+            # Off the event loop: a first request may still be waiting for the retrieval model to load.
+            agent_response = await run_in_threadpool(
+                orchestrator.process_with_optional_voice_output,
+                query=user_q,
+                audio_file_path=None,
+                generate_tts=should_generate_tts,
+                stream_tts=should_stream_tts,
+                inline_tts=should_inline_tts
+            )
+    return _reply_response(agent_response, ticket)
 
 @app.post("/api/v1/query/audio", response_model=AgentResponse, tags=["Query"])
 async def process_audio_query(
@@ -93,41 +212,215 @@ async def process_audio_query(
 ):
     if not orchestrator:
         raise HTTPException(status_code=503, detail="Orchestrator not available. Service is down.")
-    print(f"Received audio query from {request.client.host} for user {user_id}, filename: {audio_file.filename}")
-    temp_audio_filename = f"upload_{user_id}_{uuid.uuid4().hex}{Path(audio_file.filename).suffix}"
-    temp_audio_path = TEMP_UPLOADS_DIR / temp_audio_filename
-    try:
-        with open(temp_audio_path, "wb") as buffer:
-            shutil.copyfileobj(audio_file.file, buffer)
-        print(f"Audio file saved temporarily to: {temp_audio_path}")
-    except Exception as e:
-        print(f"Error saving uploaded audio file: {e}")
-        raise HTTPException(status_code=500, detail=f"Could not save uploaded audio file: {e}")
-    finally:
-        audio_file.file.close()
-    background_tasks.add_task(cleanup_temp_file, str(temp_audio_path))
-    generate_tts_param = request.query_params.get("tts", "false").lower()
-    should_generate_tts = generate_tts_param == "true"
-    user_q = UserQuery(user_id=user_id)
-    agent_response = orchestrator.process_with_optional_voice_output(
-        query=user_q,
-        audio_file_path=str(temp_audio_path),
-        generate_tts=should_generate_tts
+    log.info("api.audio_query", client_ip=request.client.host if request.client else None, user_id=user_id)
+    # The budget covers saving the upload, the queue wait and the pipeline; run_in_threadpool carries it into the latter.
+    with request_deadline(budget_from_header(request.headers.get("x-request-timeout-ms"), REQUEST_DEADLINE_AUDIO_S)):
+        # By now FastAPI has already received and spooled the multipart body; admitting here only spares a rejected
+        # request the copy into TEMP_UPLOADS_DIR and the pipeline.
+        ticket = scheduler.admit("audio", user_id)
+        temp_audio_filename = f"upload_{user_id}_{uuid.uuid4().hex}{Path(audio_file.filename).suffix}"
+        temp_audio_path = TEMP_UPLOADS_DIR / temp_audio_filename
+        try:
+            with open(temp_audio_path, "wb") as buffer:
+                shutil.copyfileobj(audio_file.file, buffer)
+        except Exception as e:
+            log.error("api.audio_save_failed", error=str(e))
+            raise HTTPException(status_code=500, detail=f"Could not save uploaded audio file: {e}")
+        finally:
+            audio_file.file.close()
+        background_tasks.add_task(cleanup_temp_file, str(temp_audio_path))
+        generate_tts_param = request.query_params.get("tts", "false").lower()
+        should_generate_tts = generate_tts_param == "true"
+        should_stream_tts = request.query_params.get("tts_stream", "false").lower() == "true"
+        should_inline_tts = request.query_params.get("tts_inline", "false").lower() == "true"
+        user_q = UserQuery(user_id=user_id)
+        async with scheduler.slot(ticket):
+            # Run off the event loop so concurrent uploads reach the Whisper batch queue together.
+            agent_response = await run_in_threadpool(
+                orchestrator.process_with_optional_voice_output,
+                query=user_q,
+                audio_file_path=str(temp_audio_path),
+                generate_tts=should_generate_tts,
+                stream_tts=should_stream_tts,
+                inline_tts=should_inline_tts
+            )
+    return _reply_response(agent_response, ticket)
+
+@app.put("/api/v1/uploads/{upload_id}", tags=["Validation"])
+async def upload_document_chunk(upload_id: str, request: Request, offset: int = 0):
+    """Append one chunk of a document upload; on a 409 the client resumes from the returned size."""
+    path = _upload_path(upload_id)
+    # File system work runs in the threadpool: a slow disk or a large uploads directory must not stall the event loop.
+    if offset == 0:
+        await run_in_threadpool(_remove_stale_uploads)
+    size = await run_in_threadpool(_uploaded_size, path)
+    if offset != size:
+        raise HTTPException(status_code=409, detail={"message": "Chunk offset does not match the uploaded size.", "size": size})
+    # The chunk is received in memory (bounded by UPLOAD_MAX_BYTES) and appended in one write.
+    chunks = []
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > UPLOAD_MAX_BYTES:
+            await run_in_threadpool(cleanup_temp_file, str(path))
+            raise HTTPException(status_code=413, detail=f"Document exceeds {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.")
+        chunks.append(chunk)
+    await run_in_threadpool(_append_chunk, path, b"".join(chunks))
+    return {"upload_id": upload_id, "size": size}
+
+@app.post("/api/v1/validate/batch", tags=["Validation"])
+async def validate_documents_batch(
+    user_id: str = Form(...),
+    files: Optional[List[UploadFile]] = File(None),
+    upload_ids: Optional[List[str]] = Form(None),
+    document_names: Optional[List[str]] = Form(None),
+):
+    """Validate uploaded files and/or finished chunked uploads; document_names cover files first, then upload_ids."""
+    files = files or []
+    upload_ids = upload_ids or []
+    if not files and not upload_ids:
+        raise HTTPException(status_code=400, detail="No documents to validate.")
+    documents = []
+    for upload_id in upload_ids:
+        if not _upload_path(upload_id).exists():
+            raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found or expired.")
+    ticket = scheduler.admit("ocr", user_id)
+    for i, upload in enumerate(files):
+        document_name = document_names[i] if document_names and i < len(document_names) else upload.filename
+        temp_path = TEMP_UPLOADS_DIR / f"validate_{user_id}_{uuid.uuid4().hex}{Path(upload.filename).suffix}"
+        try:
+            with open(temp_path, "wb") as buffer:
+                shutil.copyfileobj(upload.file, buffer)
+        except Exception as e:
+            log.error("api.document_save_failed", error=str(e))
+            # stream_results never runs for a rejected batch, so the files saved so far are removed here.
+            for _, saved_path, _ in documents:
+                cleanup_temp_file(saved_path)
+            cleanup_temp_file(str(temp_path))
+            raise HTTPException(status_code=500, detail=f"Could not save uploaded document: {e}")
+        finally:
+            upload.file.close()
+        documents.append((document_name, str(temp_path), infer_document_type(document_name)))
+    for i, upload_id in enumerate(upload_ids, start=len(files)):
+        document_name = document_names[i] if document_names and i < len(document_names) else upload_id
+        documents.append((document_name, str(_upload_path(upload_id)), infer_document_type(document_name)))
+    log.info("api.validate_batch", user_id=user_id, documents=len(documents))
+
+    async def stream_results():
+        # One NDJSON line per document, in completion order. The batch queues for its slot here, once the response
+        # has started, so a dropped batch reports its documents as failed rather than with a status code.
+        try:
+            async with scheduler.slot(ticket):
+                async for result in validation_pool.validate_many(documents):
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+        except SchedulerRejected as e:
+            for document_name, _, doc_type in documents:
+                yield json.dumps({"document_id": document_name, "doc_type": doc_type, "is_valid": False, "error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            for _, temp_path, _ in documents:
+                cleanup_temp_file(temp_path)
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson", headers=ticket.headers())
+
+@app.get("/api/v1/stats", tags=["General"])
+async def get_stats():
+    if not orchestrator:
+        raise HTTPException(status_code=503, detail="Orchestrator not available. Service is down.")
+    # Stats never force a model to load.
+    transcription = orchestrator.components["transcription"].peek()
+    tts = orchestrator.components["tts"].peek()
+    return {
+        "transcription": transcription.get_metrics() if transcription else None,
+        "audio_store": tts.store.get_stats() if tts else None,
+        "pipeline": metrics.summary(),
+    }
+
+@app.get("/api/v1/queue", tags=["General"])
+async def get_queue(work_class: Optional[str] = None):
+    """Queue position and wait a request would get if sent now, per work class or for one of text, audio, ocr"""
+    if work_class is None:
+        return scheduler.snapshot()
+    if work_class not in WORK_CLASSES:
+        raise HTTPException(status_code=404, detail=f"Unknown work class '{work_class}'.")
+    return scheduler.estimate(work_class)
+
+@app.get("/metrics", tags=["General"])
+async def prometheus_metrics():
+    return Response(content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+def _require_audio_token(name: str, request: Request) -> str:
+    if not orchestrator:
+        raise HTTPException(status_code=503, detail="Orchestrator not available. Service is down.")
+    audio_id = name.split(".", 1)[0]
+    if not orchestrator.tts_service.store.verify(audio_id, request.query_params.get("exp"), request.query_params.get("sig")):
+        raise HTTPException(status_code=403, detail="Audio link is invalid or has expired.")
+    return audio_id
+
+@app.get("/api/v1/audio/playlist/{playlist_name}", tags=["Audio"])
+async def get_audio_playlist(playlist_name: str, request: Request):
+    playlist_id = _require_audio_token(playlist_name, request)
+    playlist = orchestrator.tts_service.render_playlist_m3u8(playlist_id)
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found or expired.")
+    return Response(content=playlist, media_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/v1/audio/stream/{playlist_name}", tags=["Audio"])
+async def stream_audio_playlist(playlist_name: str, request: Request):
+    playlist_id = _require_audio_token(playlist_name, request)
+    if not orchestrator.tts_service.get_playlist(playlist_id):
+        raise HTTPException(status_code=404, detail="Playlist not found or expired.")
+    # Sync iterator: Starlette drives it from the threadpool, so waiting on segments doesn't block the loop.
+    return StreamingResponse(orchestrator.tts_service.iter_playlist_audio(playlist_id), media_type=orchestrator.tts_service.media_type)
+
+@app.get("/api/v1/audio/{audio_name}", tags=["Audio"])
+async def get_audio(audio_name: str, request: Request):
+    key = _require_audio_token(audio_name, request)
+    # Playlist segments may still be synthesizing; wait for them off the event loop.
+    audio_path = await run_in_threadpool(orchestrator.tts_service.get_segment_path, key)
+    if not audio_path:
+        raise HTTPException(status_code=404, detail="Audio not found.")
+    # The key is a hash of the text, language and voice, so the content behind it never changes;
+    # only the signed URL expires, so clients may keep it for the URL's lifetime.
+    cache_control = f"private, max-age={orchestrator.tts_service.store.url_ttl_seconds}, immutable"
+    headers = {"ETag": f'"{key}"', "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(audio_path, media_type=orchestrator.tts_service.media_type, headers=headers)
+
+def _readiness_response(required: List[str]) -> JSONResponse:
+    components = orchestrator.readiness() if orchestrator else {}
+    ready = bool(orchestrator) and all(components.get(name, {}).get("state") == "ready" for name in required)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "required": required, "components": components},
     )
-    return agent_response
+
+@app.get("/health/live", tags=["General"])
+async def liveness_check():
+    """The process is up and serving; says nothing about models"""
+    return {"status": "ok", "message": "INNOVISION API is running."}
+
+@app.get("/health/ready", tags=["General"])
+async def readiness_check():
+    """Ready for text queries (retrieval and assistant loaded), with the state of every component"""
+    return _readiness_response(list(TEXT_PATH_COMPONENTS))
+
+@app.get("/health/ready/{component}", tags=["General"])
+async def component_readiness_check(component: str):
+    """Ready for traffic that needs one component, e.g. /health/ready/transcription for audio queries"""
+    if orchestrator and component not in orchestrator.components:
+        raise HTTPException(status_code=404, detail=f"Unknown component '{component}'.")
+    return _readiness_response([component])
 
 @app.get("/health", tags=["General"])
 async def health_check():
-    if orchestrator and orchestrator.retrieval_agent and orchestrator.assistant_agent:
-        return {"status": "ok", "message": "INNOVISION API is running."}
-    return HTTPException(status_code=503, detail="Service is degraded or not fully initialized.")
+    return _readiness_response(list(TEXT_PATH_COMPONENTS))
 
 if __name__ == "__main__":
     import uvicorn # type: ignore
     print("Starting Uvicorn server for INNOVISION API...")
     print(f"Procedures expected at: {PROCEDURES_JSON_PATH}")
-    print(f"Static files served from: {STATIC_DIR}")
-    print(f"Generated audio will be in: {GENERATED_AUDIO_DIR}")
+    from services.tts import TTSService
+    print(f"Generated audio will be in: {TTSService.AUDIO_DIR}")
     print(f"Temporary uploads will be in: {TEMP_UPLOADS_DIR}")
     ollama_url_env = os.getenv("OLLAMA_BASE_URL")
     model_name_env = os.getenv("MODEL_NAME")
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+import numpy as np
+from models.schemas import ProceduresDataSchema, ProcedureSchema
+from services.log import get_logger
+
+# Compiled form of procedures.json: validated once at build time, then memory-mapped at startup.
+# Layout: magic, u32 header length, JSON header, then (64-byte aligned) the float32 embedding matrix and the
+# procedure records as UTF-8 JSON. Offsets in the header are relative to the aligned data start.
+CATALOG_FORMAT_VERSION = 1
+CATALOG_MAGIC = b"INNOCAT\x00"
+CATALOG_DIR = Path(os.getenv("PROCEDURE_CATALOG_DIR", str(Path(__file__).resolve().parent.parent / "cache" / "catalog")))
+# Part of the catalog's validity; bump when the text that is embedded for a procedure changes.
+INDEX_TEXT_VERSION = "1"
+NO_CONTEXT_REQUIRED = "Aucun context requis"
+_PREAMBLE = struct.Struct("<8sI")
+_ALIGNMENT = 64
+
+log = get_logger(__name__)
+
+class StaleCatalogError(ValueError):
+    """The catalog file is missing pieces, from another format version, or built from other sources."""
+
+class CompiledProcedure:
+    """A procedure with everything the assistant derives from it computed once, at build time."""
+    __slots__ = ("procedure", "documents_required", "remarks", "source", "instructions", "required_context",
+                 "required_slots", "intent_terms", "intent_requires_all", "documents_particulier", "documents_entreprise", "index_text")
+
+    def __init__(self, procedure: str, documents_required: Union[List[str], Dict[str, List[str]]], remarks: List[str], source: str,
+                 instructions: str, required_context: List[str], required_slots: List[str], intent_terms: List[str],
+                 intent_requires_all: bool, documents_particulier: List[str], documents_entreprise: List[str], index_text: str):
+        self.procedure = procedure
+        self.documents_required = documents_required
+        self.remarks = remarks
+        self.source = source
+        self.instructions = instructions
+        self.required_context = required_context
+        # Slots the assistant has to fill: required_context without the "nothing required" marker.
+        self.required_slots = required_slots
+        # Words of the name a request must mention: all of them for compound names, any one otherwise.
+        self.intent_terms = intent_terms
+        self.intent_requires_all = intent_requires_all
+        self.documents_particulier = documents_particulier
+        self.documents_entreprise = documents_entreprise
+        self.index_text = index_text
+
+    @classmethod
+    def from_schema(cls, proc: ProcedureSchema) -> "CompiledProcedure":
+        required_context = list(proc.ai_assistant_agent.required_context) if proc.ai_assistant_agent else []
+        key_terms = proc.procedure.lower().split()
+        if len(key_terms) > 2:
+            intent_terms, intent_requires_all = key_terms[:2], True
+        else:
+            intent_terms, intent_requires_all = [term for term in key_terms if len(term) > 3], False
+        if isinstance(proc.documents_required, dict):
+            documents_particulier = list(proc.documents_required.get("particulier", []))
+            documents_entreprise = list(proc.documents_required.get("entreprise", documents_particulier))
+        else:
+            documents_particulier = documents_entreprise = list(proc.documents_required)
+        return cls(
+            procedure=proc.procedure,
+            documents_required=proc.documents_required,
+            remarks=list(proc.remarks),
+            source=proc.source,
+            instructions=proc.ai_assistant_agent.instructions if proc.ai_assistant_agent else "",
+            required_context=required_context,
+            required_slots=[ctx for ctx in required_context if ctx != NO_CONTEXT_REQUIRED],
+            intent_terms=intent_terms,
+            intent_requires_all=intent_requires_all,
+            documents_particulier=documents_particulier,
+            documents_entreprise=documents_entreprise,
+            index_text=f"Procedure: {proc.procedure}. Remarks: {' '.join(proc.remarks)}. Required documents: {str(proc.documents_required)}",
+        )
+
+    def to_record(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_record(cls, record: Dict) -> "CompiledProcedure":
+        return cls(**record)
+
+def as_compiled(procedure: Union[CompiledProcedure, ProcedureSchema]) -> CompiledProcedure:
+    """Procedures from the catalog pass through; a bare ProcedureSchema (tests, ad-hoc callers) is compiled on the spot"""
+    return procedure if isinstance(procedure, CompiledProcedure) else CompiledProcedure.from_schema(procedure)
+
+class ProcedureCatalog:
+    """Loaded catalog: the procedures, and their L2-normalized embeddings as a read-only view of the mapped file"""
+
+    def __init__(self, procedures: List[CompiledProcedure], embeddings: np.ndarray, header: Dict, mapping: Optional[mmap.mmap] = None):
+        self.procedures = procedures
+        self.embeddings = embeddings
+        self.header = header
+        self.source_sha256: str = header["source_sha256"]
+        self.embedding_model: str = header["embedding_model"]
+        # Keeps the mapping alive as long as the embedding view is.
+        self._mapping = mapping
+
+    @property
+    def dimension(self) -> int:
+        return self.embeddings.shape[1]
+
+def source_digest(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+def catalog_path_for(source_path: Path) -> Path:
+    """One catalog per procedures file, so fixtures and production data never overwrite each other's"""
+    resolved = str(Path(source_path).resolve())
+    return CATALOG_DIR / f"{Path(source_path).stem}-{hashlib.sha256(resolved.encode('utf-8')).hexdigest()[:12]}.cat"
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def compile_catalog(source_path: Path, output_path: Path, encode: Callable[[Sequence[str]], np.ndarray], embedding_model: str) -> ProcedureCatalog:
+    """Validate procedures.json, precompute what requests need, embed every procedure and write the catalog"""
+    source_bytes = Path(source_path).read_bytes()
+    validated = ProceduresDataSchema(**json.loads(source_bytes))
+    procedures = [CompiledProcedure.from_schema(proc) for proc in validated.procedures]
+    if procedures:
+        embeddings = np.ascontiguousarray(encode([proc.index_text for proc in procedures]), dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    else:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    records = json.dumps([proc.to_record() for proc in procedures], ensure_ascii=False).encode("utf-8")
+    embeddings_length = embeddings.nbytes
+    header = {
+        "format_version": CATALOG_FORMAT_VERSION,
+        "index_text_version": INDEX_TEXT_VERSION,
+        "source_sha256": hashlib.sha256(source_bytes).hexdigest(),
+        "embedding_model": embedding_model,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "count": embeddings.shape[0],
+        "dimension": embeddings.shape[1] if embeddings.ndim == 2 else 0,
+        "embeddings_offset": 0,
+        "procedures_offset": _aligned(embeddings_length),
+        "procedures_length": len(records),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+    os.makedirs(Path(output_path).parent, exist_ok=True)
+    tmp_path = Path(output_path).with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(CATALOG_MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        f.write(embeddings.tobytes())
+        f.write(b"\0" * (data_start + header["procedures_offset"] - f.tell()))
+        f.write(records)
+    os.replace(tmp_path, output_path)
+    log.info("catalog.compiled", path=str(output_path), procedures=len(procedures), embedding_model=embedding_model)
+    return load_catalog(output_path, header["source_sha256"], embedding_model)
+
+def load_catalog(path: Path, source_sha256: Optional[str] = None, embedding_model: Optional[str] = None) -> ProcedureCatalog:
+    """Map a compiled catalog; raises StaleCatalogError unless it matches this code and the given sources"""
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mapping) < _PREAMBLE.size:
+        raise StaleCatalogError(f"{path} is truncated.")
+    magic, header_length = _PREAMBLE.unpack_from(mapping, 0)
+    if magic != CATALOG_MAGIC:
+        raise StaleCatalogError(f"{path} is not a procedure catalog.")
+    header = json.loads(mapping[_PREAMBLE.size:_PREAMBLE.size + header_length])
+    if header.get("format_version") != CATALOG_FORMAT_VERSION or header.get("index_text_version") != INDEX_TEXT_VERSION:
+        raise StaleCatalogError(f"{path} has format {header.get('format_version')}/{header.get('index_text_version')}, expected {CATALOG_FORMAT_VERSION}/{INDEX_TEXT_VERSION}.")
+    if source_sha256 and header["source_sha256"] != source_sha256:
+        raise StaleCatalogError(f"{path} was built from a different procedures file.")
+    if embedding_model and header["embedding_model"] != embedding_model:
+        raise StaleCatalogError(f"{path} was embedded with {header['embedding_model']}, expected {embedding_model}.")
+    data_start = _aligned(_PREAMBLE.size + header_length)
+    procedures_start = data_start + header["procedures_offset"]
+    if len(mapping) < procedures_start + header["procedures_length"]:
+        raise StaleCatalogError(f"{path} is truncated.")
+    count, dimension = header["count"], header["dimension"]
+    # No copy: the array reads straight from the page cache, shared by every process mapping the file.
+    embeddings = np.frombuffer(mapping, dtype=np.float32, count=count * dimension, offset=data_start + header["embeddings_offset"]).reshape(count, dimension)
+    records = json.loads(mapping[procedures_start:procedures_start + header["procedures_length"]])
+    return ProcedureCatalog([CompiledProcedure.from_record(record) for record in records], embeddings, header, mapping)
+
+def load_or_build_catalog(source_path: Path, encode: Callable[[Sequence[str]], np.ndarray], embedding_model: str, path: Optional[Path] = None) -> ProcedureCatalog:
+    """The compiled catalog for source_path, rebuilding it when it is missing or stale"""
+    path = path or catalog_path_for(source_path)
+    digest = source_digest(source_path)
+    try:
+        return load_catalog(path, digest, embedding_model)
+    except FileNotFoundError:
+        log.info("catalog.missing", path=str(path))
+    except (StaleCatalogError, ValueError, KeyError) as e:
+        log.warning("catalog.stale", path=str(path), reason=str(e))
+    return compile_catalog(source_path, path, encode, embedding_model)
+
+if __name__ == "__main__":
+    # Build step: python -m models.catalog [procedures.json] [output.cat]
+    from sentence_transformers import SentenceTransformer # type: ignore
+    from agents.retrieval import EMBEDDING_MODEL_NAME
+    from agents.orchestrator import PROCEDURES_DEFAULT_PATH
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(PROCEDURES_DEFAULT_PATH)
+    output = Path(sys.argv[2]) if len(sys.argv) > 2 else catalog_path_for(source)
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    catalog = compile_catalog(source, output, lambda texts: model.encode(list(texts), show_progress_bar=False), EMBEDDING_MODEL_NAME)
+    print(json.dumps(catalog.header, indent=2))
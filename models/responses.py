@@ -0,0 +1,48 @@
+import json
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson # type: ignore
+except ImportError:
+    orjson = None
+
+# Pipeline-internal results. AgentResponse (models.schemas) stays the API contract; these carry the same fields
+# without validating on every construction, and are serialized once, at the HTTP boundary.
+
+class AgentReply:
+    """One turn's answer as it moves through the pipeline; field for field the AgentResponse schema"""
+    __slots__ = ("response_text", "todo_list", "missing_context", "is_complete", "next_question", "audio_response_url",
+                 "audio_stream_url", "audio_playlist_url", "audio_base64", "audio_mime_type", "detected_language", "degradations")
+
+    def __init__(self, response_text: str, todo_list: Optional[List[str]] = None, missing_context: Optional[List[str]] = None,
+                 is_complete: bool = False, next_question: Optional[str] = None, detected_language: Optional[str] = None):
+        self.response_text = response_text
+        self.todo_list = todo_list if todo_list is not None else []
+        self.missing_context = missing_context if missing_context is not None else []
+        self.is_complete = is_complete
+        self.next_question = next_question
+        self.audio_response_url: Optional[str] = None
+        self.audio_stream_url: Optional[str] = None
+        self.audio_playlist_url: Optional[str] = None
+        self.audio_base64: Optional[str] = None
+        self.audio_mime_type: Optional[str] = None
+        self.detected_language = detected_language
+        # Steps skipped or cut short to answer within the request's deadline (services.deadline).
+        self.degradations: List[str] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_schema(self):
+        """The validated API model, for callers that need one; the endpoints serialize with dumps() instead"""
+        from models.schemas import AgentResponse
+        return AgentResponse(**self.to_dict())
+
+    def __repr__(self) -> str:
+        return f"AgentReply(is_complete={self.is_complete!r}, response_text={self.response_text[:40]!r})"
+
+def dumps(payload: Any) -> bytes:
+    """UTF-8 JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -26,6 +26,12 @@ class AgentResponse(BaseModel):
     is_complete: bool
     next_question: Optional[str] = None
     audio_response_url: Optional[str] = None
+    audio_stream_url: Optional[str] = None
+    audio_playlist_url: Optional[str] = None
+    audio_base64: Optional[str] = None
+    audio_mime_type: Optional[str] = None
+    detected_language: Optional[str] = None
+    degradations: List[str] = []
 
 class UserTextQuery(BaseModel):
     text: str
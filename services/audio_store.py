@@ -0,0 +1,268 @@
+import os
+import re
+import hmac
+import time
+import hashlib
+import secrets
+import shutil
+import sqlite3
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+from services.metrics import record_cache_lookup
+from services.log import get_logger
+
+AUDIO_STORE_MAX_BYTES = int(float(os.getenv("AUDIO_STORE_MAX_MB", os.getenv("TTS_CACHE_MAX_MB", "512"))) * 1024 * 1024)
+AUDIO_TTL_SECONDS = float(os.getenv("AUDIO_TTL_HOURS", "168")) * 3600
+AUDIO_URL_TTL_SECONDS = int(os.getenv("AUDIO_URL_TTL_S", "3600"))
+AUDIO_GC_INTERVAL_SECONDS = float(os.getenv("AUDIO_GC_INTERVAL_S", "60"))
+
+_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+EVICTION_RATE_WINDOW_SECONDS = 600
+
+log = get_logger(__name__)
+
+def ensure_url_secret() -> str:
+    """Key signing audio URLs, generated once per process tree when AUDIO_URL_SECRET is unset.
+
+    Every worker must verify what any other worker signed, so the generated key is exported to the
+    environment; call this in the preforking master (main.py does at import) before workers fork.
+    """
+    secret = os.getenv("AUDIO_URL_SECRET")
+    if not secret:
+        secret = secrets.token_hex(32)
+        os.environ["AUDIO_URL_SECRET"] = secret
+    return secret
+
+class AudioStore:
+    """Sharded, content-addressed audio files tracked in a SQLite index, with a disk quota and a TTL.
+
+    Files live at ``<root>/<k[:2]>/<k[2:4]>/<key>.<ext>`` so no directory grows past a few hundred
+    entries. A background thread expires files unused for ``ttl_seconds`` and evicts least-recently
+    used files while the store is over ``max_bytes``.
+    """
+
+    def __init__(self, root: Path, extension: str = "mp3", max_bytes: int = AUDIO_STORE_MAX_BYTES,
+                 ttl_seconds: float = AUDIO_TTL_SECONDS, url_ttl_seconds: int = AUDIO_URL_TTL_SECONDS,
+                 secret: Optional[str] = None, gc_interval_seconds: float = AUDIO_GC_INTERVAL_SECONDS,
+                 legacy_root: Optional[Path] = None):
+        self.root = Path(root)
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.url_ttl_seconds = url_ttl_seconds
+        self.gc_interval_seconds = gc_interval_seconds
+        self._secret = (secret or ensure_url_secret()).encode("utf-8")
+        os.makedirs(self.root, exist_ok=True)
+        if legacy_root is not None:
+            self._adopt_legacy_root(Path(legacy_root))
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS audio (key TEXT PRIMARY KEY, size INTEGER NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS audio_last_access ON audio(last_access)")
+        # Shared with the other workers through the index: a stream may be requested from any of them, and the
+        # segments it waits for may be rendering in another.
+        self._db.execute("CREATE TABLE IF NOT EXISTS playlists (id TEXT PRIMARY KEY, keys TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pending (key TEXT PRIMARY KEY, started_at REAL NOT NULL)")
+        self._stats_lock = threading.Lock()
+        # Access times are buffered and flushed by the GC thread so reads never write to the index.
+        self._pending_access: Dict[str, float] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions_ttl": 0, "evictions_quota": 0, "legacy_files_removed": 0}
+        self._eviction_times: deque = deque()
+        self._size_bytes = 0
+        self._entries = 0
+        self._migrate_flat_files()
+        self._refresh_totals()
+        self._gc_wakeup = threading.Event()
+        self._gc_thread = threading.Thread(target=self._gc_loop, name="audio-store-gc", daemon=True)
+        self._gc_thread.start()
+
+    @staticmethod
+    def make_key(text: str, lang: str, voice: str) -> str:
+        return hashlib.sha256(f"{voice}\0{lang}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return bool(_KEY_RE.match(key))
+
+    def path_for(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / f"{key}.{self.extension}"
+
+    def get(self, key: str) -> Optional[Path]:
+        if not self.is_valid_key(key):
+            return None
+        path = self.path_for(key)
+        found = path.exists()
+        with self._stats_lock:
+            if found:
+                self._stats["hits"] += 1
+                self._pending_access[key] = time.time()
+            else:
+                self._stats["misses"] += 1
+        record_cache_lookup("audio", found)
+        return path if found else None
+
+    def put(self, key: str, data: bytes) -> Path:
+        path = self.path_for(key)
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self._db_lock:
+            # Rewriting a key (two workers synthesizing the same text) replaces its row: count only the difference.
+            previous = self._db.execute("SELECT size FROM audio WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO audio (key, size, created_at, last_access) VALUES (?, ?, ?, ?)", (key, len(data), now, now))
+        with self._stats_lock:
+            self._size_bytes += len(data) - (previous[0] if previous else 0)
+            self._entries += 0 if previous else 1
+            over_quota = self._size_bytes > self.max_bytes
+        if over_quota:
+            self._gc_wakeup.set()
+        return path
+
+    def put_playlist(self, playlist_id: str, keys: List[str]):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO playlists (id, keys, created_at) VALUES (?, ?, ?)", (playlist_id, ",".join(keys), time.time()))
+
+    def get_playlist(self, playlist_id: str) -> Optional[List[str]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT keys FROM playlists WHERE id = ?", (playlist_id,)).fetchone()
+        return row[0].split(",") if row and row[0] else None
+
+    def mark_pending(self, key: str):
+        """Tell the other workers key is being rendered, so they wait for it instead of reporting it missing"""
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO pending (key, started_at) VALUES (?, ?)", (key, time.time()))
+
+    def clear_pending(self, key: str):
+        with self._db_lock:
+            self._db.execute("DELETE FROM pending WHERE key = ?", (key,))
+
+    def is_pending(self, key: str, max_age_seconds: float) -> bool:
+        with self._db_lock:
+            row = self._db.execute("SELECT started_at FROM pending WHERE key = ?", (key,)).fetchone()
+        return bool(row) and row[0] > time.time() - max_age_seconds
+
+    def sign(self, key: str) -> str:
+        """Query string granting access to key until the URL TTL runs out."""
+        expires = int(time.time()) + self.url_ttl_seconds
+        return f"exp={expires}&sig={self._signature(key, expires)}"
+
+    def verify(self, key: str, expires: Optional[str], signature: Optional[str]) -> bool:
+        if not expires or not signature or not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(self._signature(key, int(expires)), signature)
+
+    def _signature(self, key: str, expires: int) -> str:
+        return hmac.new(self._secret, f"{key}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    def _adopt_legacy_root(self, legacy_root: Path):
+        # Earlier releases kept the store under static/, where every clip was downloadable without a token.
+        if (self.root / "index.sqlite3").exists() or not (legacy_root / "index.sqlite3").exists():
+            return
+        for path in legacy_root.iterdir():
+            if (path.is_dir() and len(path.name) == 2) or path.name.startswith("index.sqlite3"):
+                try:
+                    shutil.move(str(path), str(self.root / path.name))
+                except OSError:
+                    # Another worker moved it first.
+                    pass
+        log.info("audio_store.moved", source=str(legacy_root), root=str(self.root))
+
+    def _migrate_flat_files(self):
+        # Earlier releases kept hash-named files directly in the root; move them into their shard.
+        for path in self.root.glob(f"*.{self.extension}"):
+            if not self.is_valid_key(path.stem):
+                continue
+            target = self.path_for(path.stem)
+            os.makedirs(target.parent, exist_ok=True)
+            os.replace(path, target)
+            stat = target.stat()
+            with self._db_lock:
+                self._db.execute("INSERT OR IGNORE INTO audio (key, size, created_at, last_access) VALUES (?, ?, ?, ?)", (path.stem, stat.st_size, stat.st_mtime, stat.st_atime))
+
+    def _refresh_totals(self):
+        with self._db_lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio").fetchone()
+        with self._stats_lock:
+            self._entries, self._size_bytes = entries, size
+
+    def _gc_loop(self):
+        while True:
+            self._gc_wakeup.wait(self.gc_interval_seconds)
+            self._gc_wakeup.clear()
+            try:
+                self.collect_garbage()
+            except Exception as e:
+                log.error("audio_store.gc_failed", error=str(e))
+
+    def collect_garbage(self):
+        now = time.time()
+        with self._stats_lock:
+            pending, self._pending_access = self._pending_access, {}
+        with self._db_lock:
+            if pending:
+                self._db.executemany("UPDATE audio SET last_access = ? WHERE key = ?", [(t, k) for k, t in pending.items()])
+            expired = self._db.execute("SELECT key FROM audio WHERE last_access < ?", (now - self.ttl_seconds,)).fetchall()
+            # A playlist is only reachable through its signed URLs; pending marks outlive any render.
+            self._db.execute("DELETE FROM playlists WHERE created_at < ?", (now - self.url_ttl_seconds,))
+            self._db.execute("DELETE FROM pending WHERE started_at < ?", (now - self.url_ttl_seconds,))
+        self._evict([key for (key,) in expired], "evictions_ttl")
+        self._refresh_totals()
+        if self._size_bytes > self.max_bytes:
+            excess = self._size_bytes - self.max_bytes
+            victims, freed = [], 0
+            with self._db_lock:
+                for key, size in self._db.execute("SELECT key, size FROM audio ORDER BY last_access ASC"):
+                    if freed >= excess:
+                        break
+                    victims.append(key)
+                    freed += size
+            self._evict(victims, "evictions_quota")
+            self._refresh_totals()
+        self._remove_legacy_files(now)
+
+    def _evict(self, keys, reason: str):
+        if not keys:
+            return
+        for key in keys:
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+        with self._db_lock:
+            self._db.executemany("DELETE FROM audio WHERE key = ?", [(key,) for key in keys])
+        now = time.time()
+        with self._stats_lock:
+            self._stats[reason] += len(keys)
+            self._eviction_times.extend([now] * len(keys))
+
+    def _remove_legacy_files(self, now: float):
+        # Untracked per-request files (response_<user>_<uuid>_<lang>.mp3) from before the store existed.
+        for path in self.root.glob("response_*"):
+            try:
+                if path.is_file() and path.stat().st_mtime < now - self.ttl_seconds:
+                    os.remove(path)
+                    with self._stats_lock:
+                        self._stats["legacy_files_removed"] += 1
+            except OSError:
+                pass
+
+    def get_stats(self) -> Dict:
+        now = time.time()
+        with self._stats_lock:
+            while self._eviction_times and self._eviction_times[0] < now - EVICTION_RATE_WINDOW_SECONDS:
+                self._eviction_times.popleft()
+            stats = dict(self._stats)
+            stats["entries"] = self._entries
+            stats["size_bytes"] = self._size_bytes
+            stats["evictions_per_minute"] = len(self._eviction_times) / (EVICTION_RATE_WINDOW_SECONDS / 60.0)
+        stats["max_bytes"] = self.max_bytes
+        stats["ttl_seconds"] = self.ttl_seconds
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,105 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from services.log import get_logger
+
+log = get_logger(__name__)
+
+class ComponentUnavailable(RuntimeError):
+    """A component failed to load; requests that need it cannot be served."""
+
+class Component:
+    """A heavy dependency (model, index, backend) built on first use or preloaded in the background.
+
+    Callers that need it while it is loading wait for that one load; a failed load is not retried
+    and every later use raises ComponentUnavailable.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._instance = None
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    def get(self) -> Any:
+        if self._instance is not None:
+            return self._instance
+        with self._lock:
+            if self._instance is None:
+                if self.state == "failed":
+                    raise ComponentUnavailable(f"{self.name} is unavailable: {self.error}")
+                self.state = "loading"
+                start = time.perf_counter()
+                try:
+                    instance = self._loader()
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = str(e)
+                    log.error("component.load_failed", component=self.name, error=str(e))
+                    raise ComponentUnavailable(f"{self.name} is unavailable: {e}") from e
+                self.load_seconds = round(time.perf_counter() - start, 2)
+                self._instance = instance
+                self.state = "ready"
+                log.info("component.ready", component=self.name, load_seconds=self.load_seconds)
+        return self._instance
+
+    def peek(self) -> Any:
+        """The instance if already loaded, without triggering a load"""
+        return self._instance
+
+    @property
+    def ready(self) -> bool:
+        return self._instance is not None
+
+    def status(self) -> Dict:
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+class ComponentRegistry:
+    def __init__(self):
+        self._components: Dict[str, Component] = {}
+
+    def register(self, name: str, loader: Callable[[], Any]) -> Component:
+        component = self._components[name] = Component(name, loader)
+        return component
+
+    def __getitem__(self, name: str) -> Component:
+        return self._components[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._components
+
+    def get(self, name: str) -> Any:
+        return self._components[name].get()
+
+    def preload(self, names: Iterable[str]) -> List[threading.Thread]:
+        """Start loading components in parallel background threads and return immediately"""
+        threads = []
+        for name in names:
+            component = self._components.get(name)
+            if component is None:
+                log.warning("component.unknown", component=name)
+                continue
+            # Daemon threads: shutting down must not wait for a model that is still loading.
+            thread = threading.Thread(target=self._preload_one, args=(component,), name=f"preload-{name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def load(self, names: Iterable[str]):
+        """Load components in parallel and wait for all of them"""
+        for thread in self.preload(names):
+            thread.join()
+
+    @staticmethod
+    def _preload_one(component: Component):
+        try:
+            component.get()
+        except ComponentUnavailable:
+            # Recorded on the component and reported by readiness checks.
+            pass
+
+    def status(self) -> Dict[str, Dict]:
+        return {name: component.status() for name, component in self._components.items()}
@@ -0,0 +1,83 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+from services.metrics import metrics
+from services.log import get_logger
+
+# Time budget of a request, carried in a contextvar so every stage (and run_in_threadpool / copied contexts) sees it.
+# Stages size their upstream timeouts from what is left, and skip optional work rather than overrun it.
+REQUEST_DEADLINE_TEXT_S = float(os.getenv("REQUEST_DEADLINE_TEXT_S", "15"))
+REQUEST_DEADLINE_AUDIO_S = float(os.getenv("REQUEST_DEADLINE_AUDIO_S", "30"))
+# Upper bound on a budget a client asks for with X-Request-Timeout-Ms.
+REQUEST_DEADLINE_MAX_S = float(os.getenv("REQUEST_DEADLINE_MAX_S", "60"))
+# Timeouts handed out never go below this, so a nearly spent budget fails fast instead of passing 0 (no timeout).
+MIN_TIMEOUT_S = 0.05
+
+log = get_logger(__name__)
+
+metrics.describe("request_degradations_total", "counter", "Optional pipeline steps skipped or cut short to meet the request deadline")
+
+class Deadline:
+    """When a request has to be answered by, and which steps were degraded to make it"""
+    __slots__ = ("expires_at", "degradations")
+
+    def __init__(self, budget_s: float):
+        self.expires_at = time.monotonic() + budget_s
+        self.degradations: List[str] = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+@contextmanager
+def request_deadline(budget_s: float) -> Iterator[Deadline]:
+    """Run the body under a budget of budget_s seconds: ``with request_deadline(15) as deadline: ...``"""
+    deadline = Deadline(budget_s)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+def budget_from_header(value: Optional[str], default_s: float) -> float:
+    """The client's X-Request-Timeout-Ms when it is a sane number, capped at REQUEST_DEADLINE_MAX_S"""
+    try:
+        requested = float(value) / 1000.0 if value else default_s
+    except ValueError:
+        requested = default_s
+    return min(REQUEST_DEADLINE_MAX_S, requested if requested > 0 else default_s)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget; None outside a request"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline else None
+
+def timeout(cap_s: float, share: float = 1.0) -> float:
+    """Timeout for one upstream call: at most cap_s, and at most share of what is left so later stages keep the rest"""
+    left = remaining()
+    if left is None:
+        return cap_s
+    return max(MIN_TIMEOUT_S, min(cap_s, left * share))
+
+def can_afford(needed_s: float) -> bool:
+    """Whether at least needed_s is left; always true outside a request"""
+    left = remaining()
+    return left is None or left >= needed_s
+
+def degrade(step: str, **fields):
+    """Record that step was skipped or cut short; the response lists it"""
+    deadline = _current.get()
+    if deadline is not None and step not in deadline.degradations:
+        deadline.degradations.append(step)
+    metrics.inc("request_degradations_total", step=step)
+    log.info("deadline.degraded", step=step, remaining_ms=round((remaining() or 0.0) * 1000), **fields)
+
+def degradations() -> List[str]:
+    deadline = _current.get()
+    return list(deadline.degradations) if deadline else []
@@ -0,0 +1,174 @@
+import os
+import sys
+import hmac
+import json
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime, timezone
+from contextvars import ContextVar, Token
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Fraction of DEBUG events kept; per-event rates can be passed as debug(..., sample=0.01).
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# What happens to personal data in log fields: "redact" (default), "hash" (keyed, for correlation) or "allow" (local debugging).
+LOG_PII_POLICY = os.getenv("LOG_PII_POLICY", "redact").lower()
+# Keyed so hashed CIN numbers or user ids cannot be recovered by hashing every candidate.
+LOG_HASH_SECRET = (os.getenv("LOG_HASH_SECRET") or secrets.token_hex(32)).encode("utf-8")
+
+# Free text and document data: dropped under "redact", hashed under "hash".
+PII_FIELDS = frozenset({"text", "query", "translated_query", "transcript", "response_text", "raw_text", "cin_number", "passport_number", "filename"})
+# Pseudonymous identifiers: hashed unless the policy is "allow", so events can still be correlated.
+IDENTIFIER_FIELDS = frozenset({"user_id", "client_ip"})
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_configure_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+_dropped_records = 0
+
+def _hash(value: Any) -> str:
+    return "h:" + hmac.new(LOG_HASH_SECRET, str(value).encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+def redact_fields(fields: Dict[str, Any], policy: str = LOG_PII_POLICY) -> Dict[str, Any]:
+    if policy == "allow":
+        return fields
+    redacted = {}
+    for key, value in fields.items():
+        if value is None:
+            redacted[key] = None
+        elif key in IDENTIFIER_FIELDS or (key in PII_FIELDS and policy == "hash"):
+            redacted[key] = _hash(value)
+        elif key in PII_FIELDS:
+            redacted[key] = f"<redacted:{len(str(value))} chars>"
+        else:
+            redacted[key] = value
+    return redacted
+
+class _RequestIdFilter(logging.Filter):
+    """Stamps records with the request id on the emitting thread, where the context var is set"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread untouched; formatting and redaction happen there, and a full queue drops"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        global _dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_records += 1
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt: str = LOG_FORMAT):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = redact_fields(getattr(record, "fields", None) or {})
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if self.fmt == "text":
+            extras = " ".join(f"{key}={value}" for key, value in entry.items() if key not in ("ts", "level", "logger", "event") and value is not None)
+            return f"{entry['ts']} {entry['level'].upper():7} {entry['logger']} {entry['event']} {extras}".rstrip()
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def _start_listener(*handlers: logging.Handler) -> "queue.Queue[logging.LogRecord]":
+    global _listener
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=False)
+    _listener.start()
+    return log_queue
+
+def _stop_listener():
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full:
+            pass
+
+def _restart_after_fork():
+    # The writer thread does not survive fork (gunicorn preload); each worker starts its own on a fresh queue.
+    if _listener is not None and _queue_handler is not None:
+        _queue_handler.queue = _start_listener(*_listener.handlers)
+
+def configure_logging(level: str = LOG_LEVEL):
+    """Route all logging through a bounded queue to one writer thread; safe to call more than once"""
+    global _queue_handler
+    with _configure_lock:
+        if _listener is not None:
+            return
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(StructuredFormatter())
+        _queue_handler = _NonBlockingQueueHandler(_start_listener(stream_handler))
+        _queue_handler.addFilter(_RequestIdFilter())
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        atexit.register(_stop_listener)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+def dropped_records() -> int:
+    return _dropped_records
+
+class EventLogger:
+    """Structured events: ``log.info("query.received", user_id=..., text=...)``; fields are redacted by policy."""
+    __slots__ = ("_logger",)
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: bool = False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, event: str, sample: Optional[float] = None, **fields: Any):
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        rate = LOG_DEBUG_SAMPLE_RATE if sample is None else sample
+        if rate < 1.0 and random.random() >= rate:
+            return
+        self._logger.log(logging.DEBUG, event, extra={"fields": fields})
+
+    def info(self, event: str, **fields: Any):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields: Any):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, exc_info: bool = False, **fields: Any):
+        self._log(logging.ERROR, event, fields, exc_info)
+
+def get_logger(name: str) -> EventLogger:
+    configure_logging()
+    return EventLogger(name)
+
+def set_request_id(request_id: str) -> Token:
+    return _request_id.set(request_id)
+
+def reset_request_id(token: Token):
+    _request_id.reset(token)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
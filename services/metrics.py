@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond lookups to slow LLM calls.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+STAGE_METRIC = "pipeline_stage_seconds"
+# With several server workers, each writes its series to a file here and /metrics merges them: counters and histograms
+# summed over workers (those that exited included, so they stay monotonic), gauges per live worker with a pid label.
+# Unset, /metrics shows the process that served it.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL_S = float(os.getenv("METRICS_FLUSH_INTERVAL_S", "5"))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Stage durations of the request being served, when a request-timing scope is open.
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+# Called with (stage, True) on entry and (stage, False) on exit, on the thread running the stage; used by profilers.
+_stage_listeners: List[Callable[[str, bool], None]] = []
+
+class Histogram:
+    """Cumulative-bucket histogram; quantiles are interpolated within the bucket they fall in."""
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                # Values past the last bucket are reported as its upper bound.
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class Metrics:
+    """Process-wide counters, histograms and callback gauges, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._callbacks: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._descriptions[name] = (kind, help_text)
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        key = tuple(sorted(labels.items()))
+        series = self._histograms.get(name)
+        histogram = series.get(key) if series else None
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, {}).setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name: str, value: float, **labels: str):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def register_gauge(self, name: str, help_text: str, callback: Callable[[], float], **labels: str):
+        """Gauge read when /metrics is scraped (queue depths, in-flight work); the last registration per label set wins"""
+        self.describe(name, "gauge", help_text)
+        with self._lock:
+            self._callbacks.setdefault(name, {})[tuple(sorted(labels.items()))] = callback
+
+    def counter_value(self, name: str, **labels: str) -> float:
+        return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    def summary(self) -> Dict:
+        """p50/p95/p99 per pipeline stage and hit rate per cache, for /api/v1/stats"""
+        stages = {}
+        for labels, histogram in list(self._histograms.get(STAGE_METRIC, {}).items()):
+            stage_name = dict(labels).get("stage", "")
+            stages[stage_name] = {"count": histogram.count, "mean_ms": round(histogram.sum / histogram.count * 1000, 2) if histogram.count else None}
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                stages[stage_name][f"p{int(q * 100)}_ms"] = round(value * 1000, 2) if value is not None else None
+        caches: Dict[str, Dict[str, float]] = {}
+        for labels, value in list(self._counters.get("cache_requests_total", {}).items()):
+            label_map = dict(labels)
+            caches.setdefault(label_map.get("cache", ""), {"hit": 0.0, "miss": 0.0})[label_map.get("result", "miss")] = value
+        for stats in caches.values():
+            lookups = stats["hit"] + stats["miss"]
+            stats["hit_rate"] = round(stats["hit"] / lookups, 3) if lookups else 0.0
+        return {"stages": stages, "caches": caches}
+
+    def snapshot(self) -> Dict:
+        """This process's series as plain JSON-able data: counters, histograms and the current gauge values"""
+        with self._lock:
+            counters = {name: list(series.items()) for name, series in self._counters.items()}
+            histograms = {name: list(series.items()) for name, series in self._histograms.items()}
+            callbacks = {name: list(series.items()) for name, series in self._callbacks.items()}
+        snapshot: Dict = {"counters": {}, "histograms": {}, "gauges": {}}
+        for name, series in counters.items():
+            snapshot["counters"][name] = [[list(labels), value] for labels, value in series]
+        for name, series in histograms.items():
+            snapshot["histograms"][name] = []
+            for labels, histogram in series:
+                with histogram._lock:
+                    snapshot["histograms"][name].append([list(labels), list(histogram.buckets), list(histogram.counts), histogram.sum, histogram.count])
+        for name, series in callbacks.items():
+            values = []
+            for labels, callback in series:
+                try:
+                    values.append([list(labels), float(callback())])
+                except Exception:
+                    continue
+            snapshot["gauges"][name] = values
+        return snapshot
+
+    def write_snapshot(self, directory: str):
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start_multiprocess_export(self, directory: str = METRICS_MULTIPROC_DIR, interval_s: float = METRICS_FLUSH_INTERVAL_S):
+        """Keep this worker's series in directory for whichever worker serves /metrics; a no-op without a directory"""
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        def flush_loop():
+            while True:
+                try:
+                    self.write_snapshot(directory)
+                except OSError:
+                    pass
+                time.sleep(interval_s)
+        threading.Thread(target=flush_loop, name="metrics-export", daemon=True).start()
+
+    def render_prometheus(self, directory: str = METRICS_MULTIPROC_DIR) -> str:
+        snapshots = {os.getpid(): self.snapshot()}
+        if directory:
+            self.write_snapshot(directory)
+            snapshots.update(_read_snapshots(directory))
+        counters: Dict[str, Dict[Labels, float]] = {}
+        histograms: Dict[str, Dict[Labels, list]] = {}
+        gauges: Dict[str, Dict[Labels, float]] = {}
+        for pid, snapshot in snapshots.items():
+            for name, series in snapshot["counters"].items():
+                merged = counters.setdefault(name, {})
+                for labels, value in series:
+                    key = _labels(labels)
+                    merged[key] = merged.get(key, 0.0) + value
+            for name, series in snapshot["histograms"].items():
+                merged_histograms = histograms.setdefault(name, {})
+                for labels, buckets, counts, value_sum, total in series:
+                    key = _labels(labels)
+                    merged_histogram = merged_histograms.get(key)
+                    if merged_histogram is None:
+                        merged_histograms[key] = [buckets, counts, value_sum, total]
+                    elif merged_histogram[0] == buckets:
+                        merged_histogram[1] = [a + b for a, b in zip(merged_histogram[1], counts)]
+                        merged_histogram[2] += value_sum
+                        merged_histogram[3] += total
+            # A dead worker's gauges describe nothing any more.
+            if directory and not _is_alive(pid):
+                continue
+            for name, series in snapshot["gauges"].items():
+                merged_gauges = gauges.setdefault(name, {})
+                for labels, value in series:
+                    merged_gauges[_labels(labels) + ((("pid", str(pid)),) if directory else ())] = value
+        lines: List[str] = []
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for labels, (buckets, counts, value_sum, total) in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {total}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value_sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {total}")
+        for name, series in sorted(gauges.items()):
+            if series:
+                self._header(lines, name, "gauge")
+                lines.extend(f"{name}{_format_labels(labels)} {value}" for labels, value in sorted(series.items()))
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str, kind: str):
+        kind, help_text = self._descriptions.get(name, (kind, name.replace("_", " ")))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+def _labels(pairs: List[List[str]]) -> Labels:
+    return tuple(sorted((key, value) for key, value in pairs))
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _read_snapshots(directory: str) -> Dict[int, Dict]:
+    snapshots = {}
+    for name in os.listdir(directory):
+        if not name.endswith(".json") or not name[:-len(".json")].isdigit():
+            continue
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                snapshots[int(name[:-len(".json")])] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    # The caller's own, fresher snapshot replaces its file.
+    snapshots.pop(os.getpid(), None)
+    return snapshots
+
+def clear_multiprocess_dir(directory: str = METRICS_MULTIPROC_DIR):
+    """Drop the previous run's worker files; call once in the server's master before workers start"""
+    if not directory or not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith((".json", ".tmp")):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+metrics = Metrics()
+metrics.describe(STAGE_METRIC, "histogram", "Duration of each pipeline stage in seconds")
+metrics.describe("cache_requests_total", "counter", "Cache lookups by cache and result")
+
+class _StageTimer:
+    __slots__ = ("name", "histogram", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.histogram = metrics.histogram(STAGE_METRIC, stage=name)
+
+    def __enter__(self):
+        for listener in _stage_listeners:
+            listener(self.name, True)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        for listener in _stage_listeners:
+            listener(self.name, False)
+        return False
+
+def stage(name: str) -> _StageTimer:
+    """Time a pipeline stage: ``with stage("embed"): ...``"""
+    return _StageTimer(name)
+
+def add_stage_listener(listener: Callable[[str, bool], None]):
+    _stage_listeners.append(listener)
+
+def remove_stage_listener(listener: Callable[[str, bool], None]):
+    _stage_listeners.remove(listener)
+
+def record_cache_lookup(cache: str, hit: bool):
+    metrics.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+def start_request_timing() -> Token:
+    return _request_timings.set({})
+
+def finish_request_timing(token: Token) -> Dict[str, float]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Server-Timing header value; durations in milliseconds"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from services.log import get_logger
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_PATH = Path(os.getenv("OCR_CACHE_PATH", str(Path(__file__).resolve().parent.parent / "cache" / "ocr_cache.sqlite3")))
+OCR_CACHE_TTL_SECONDS = float(os.getenv("OCR_CACHE_TTL_HOURS", "24")) * 3600
+PURGE_INTERVAL_SECONDS = 300
+
+log = get_logger(__name__)
+
+def ensure_encryption_key() -> Optional[str]:
+    """Fernet key for cached results, generated once per process tree when OCR_CACHE_KEY is unset.
+
+    The generated key is exported to the environment so spawned validation workers share it;
+    entries written under a previous key can no longer be decrypted and are dropped as misses.
+    """
+    if Fernet is None:
+        return None
+    key = os.getenv("OCR_CACHE_KEY")
+    if not key:
+        key = Fernet.generate_key().decode("ascii")
+        os.environ["OCR_CACHE_KEY"] = key
+    return key
+
+class OCRCache:
+    """Validation results keyed by a hash of the normalized page and the OCR settings.
+
+    Results hold identity data (document numbers, OCR text), so they are stored only as
+    Fernet-encrypted blobs; the cache is disabled when the ``cryptography`` package is missing.
+    """
+
+    def __init__(self, path: Path = OCR_CACHE_PATH, ttl_seconds: float = OCR_CACHE_TTL_SECONDS, enabled: bool = OCR_CACHE_ENABLED):
+        self.ttl_seconds = ttl_seconds
+        self._stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        key = ensure_encryption_key() if enabled else None
+        self.enabled = key is not None
+        if not self.enabled:
+            if enabled:
+                log.warning("ocr_cache.disabled", hint="install cryptography to cache encrypted validation results")
+            return
+        self._fernet = Fernet(key.encode("ascii"))
+        os.makedirs(Path(path).parent, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS ocr_results (key TEXT PRIMARY KEY, payload BLOB NOT NULL, expires_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ocr_results_expires_at ON ocr_results(expires_at)")
+        self._last_purge = 0.0
+
+    @staticmethod
+    def make_key(pixels: bytes, settings: str) -> str:
+        digest = hashlib.sha256(settings.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(pixels)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT payload, expires_at FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            result = None
+            if row and row[1] > time.time():
+                try:
+                    result = json.loads(self._fernet.decrypt(row[0]))
+                except InvalidToken:
+                    result = None
+            if row and result is None:
+                self._db.execute("DELETE FROM ocr_results WHERE key = ?", (key,))
+            self._stats["hits" if result is not None else "misses"] += 1
+        return result
+
+    def put(self, key: str, result: Dict):
+        if not self.enabled:
+            return
+        payload = self._fernet.encrypt(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO ocr_results (key, payload, expires_at) VALUES (?, ?, ?)", (key, payload, now + self.ttl_seconds))
+            if now - self._last_purge > PURGE_INTERVAL_SECONDS:
+                self._db.execute("DELETE FROM ocr_results WHERE expires_at <= ?", (now,))
+                self._last_purge = now
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["enabled"] = self.enabled
+        return stats
@@ -0,0 +1,262 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+from services.metrics import metrics, stage
+from services.deadline import current_deadline
+from services.log import get_logger
+
+# Admission control and weighted fair scheduling of the work a worker process accepts, one scheduler per process.
+# Class settings are "class=value" lists; classes are text (chat turns), audio (Whisper turns) and ocr (validation).
+WORK_CLASSES = ("text", "audio", "ocr")
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+# Requests running at once across all classes.
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "8"))
+# Share of the slots each class gets while several are backlogged; an idle class's share goes to the others.
+SCHEDULER_WEIGHTS = os.getenv("SCHEDULER_WEIGHTS", "text=6,audio=3,ocr=1")
+# Slots a class may hold at most, so a burst of expensive work always leaves room for text turns.
+SCHEDULER_CLASS_LIMITS = os.getenv("SCHEDULER_CLASS_LIMITS", "text=8,audio=4,ocr=2")
+SCHEDULER_QUEUE_LIMITS = os.getenv("SCHEDULER_QUEUE_LIMITS", "text=200,audio=50,ocr=20")
+# A request that has not started this long after admission is dropped: its client has most likely given up.
+SCHEDULER_QUEUE_DEADLINES_S = os.getenv("SCHEDULER_QUEUE_DEADLINES_S", "text=10,audio=30,ocr=60")
+# Token bucket per user_id, across classes; 0 disables rate limiting.
+SCHEDULER_USER_RATE_PER_S = float(os.getenv("SCHEDULER_USER_RATE_PER_S", "2"))
+SCHEDULER_USER_BURST = float(os.getenv("SCHEDULER_USER_BURST", "10"))
+# Service time assumed for a class's queue-wait estimate until its first request completes.
+INITIAL_SERVICE_S = 1.0
+_SERVICE_EWMA_ALPHA = 0.2
+_MAX_TRACKED_USERS = 10000
+
+log = get_logger(__name__)
+
+def _per_class(spec: str, cast=float) -> Dict[str, float]:
+    values = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        if name not in WORK_CLASSES:
+            raise ValueError(f"Unknown work class '{name}' in '{spec}'. Expected one of {', '.join(WORK_CLASSES)}.")
+        values[name] = cast(value)
+    return values
+
+class SchedulerRejected(Exception):
+    """A request refused at admission (rate_limited, queue_full) or dropped from the queue (expired)"""
+
+    def __init__(self, reason: str, status_code: int, retry_after_s: float, estimate: Optional[Dict] = None):
+        super().__init__(f"Request not scheduled: {reason}.")
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after_s = retry_after_s
+        self.estimate = estimate or {}
+
+class Ticket:
+    """One admitted request: its class, its place in the queue on admission and when it has to start by"""
+    __slots__ = ("work_class", "user_id", "admitted_at", "deadline", "position", "estimated_wait_s", "granted", "_event")
+
+    def __init__(self, work_class: str, user_id: str, admitted_at: float, deadline: float, position: int, estimated_wait_s: float):
+        self.work_class = work_class
+        self.user_id = user_id
+        self.admitted_at = admitted_at
+        self.deadline = deadline
+        # Requests of the same class queued ahead of this one when it was admitted.
+        self.position = position
+        self.estimated_wait_s = estimated_wait_s
+        self.granted = False
+        self._event: Optional[asyncio.Event] = None
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Queue-Position": str(self.position), "X-Queue-Wait-Estimate-Ms": str(round(self.estimated_wait_s * 1000))}
+
+class _TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+class Scheduler:
+    """Per-class FIFO queues served by stride scheduling over a fixed number of slots.
+
+    Each class carries a virtual pass that advances by 1/weight per request started; the backlogged class
+    with the lowest pass starts next. Runs on the event loop: admit() and slot() must be called from it.
+    """
+
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY, weights: str = SCHEDULER_WEIGHTS, class_limits: str = SCHEDULER_CLASS_LIMITS,
+                 queue_limits: str = SCHEDULER_QUEUE_LIMITS, queue_deadlines_s: str = SCHEDULER_QUEUE_DEADLINES_S,
+                 user_rate_per_s: float = SCHEDULER_USER_RATE_PER_S, user_burst: float = SCHEDULER_USER_BURST, enabled: bool = SCHEDULER_ENABLED):
+        self.enabled = enabled
+        self.concurrency = max(1, concurrency)
+        self.weights = {name: 1.0 for name in WORK_CLASSES}
+        self.weights.update(_per_class(weights))
+        self.class_limits = {name: self.concurrency for name in WORK_CLASSES}
+        self.class_limits.update({name: max(1, min(self.concurrency, limit)) for name, limit in _per_class(class_limits, int).items()})
+        self.queue_limits = {name: 100 for name in WORK_CLASSES}
+        self.queue_limits.update(_per_class(queue_limits, int))
+        self.queue_deadlines_s = {name: 30.0 for name in WORK_CLASSES}
+        self.queue_deadlines_s.update(_per_class(queue_deadlines_s))
+        self.user_rate_per_s = user_rate_per_s
+        self.user_burst = max(1.0, user_burst)
+        self._queues: Dict[str, Deque[Ticket]] = {name: deque() for name in WORK_CLASSES}
+        self._running: Dict[str, int] = {name: 0 for name in WORK_CLASSES}
+        self._pass: Dict[str, float] = {name: 0.0 for name in WORK_CLASSES}
+        self._service_s: Dict[str, float] = {name: INITIAL_SERVICE_S for name in WORK_CLASSES}
+        self._buckets: Dict[str, _TokenBucket] = {}
+        metrics.describe("scheduler_requests_total", "counter", "Requests by work class and scheduling outcome")
+        metrics.describe("scheduler_queue_wait_seconds", "histogram", "Time from admission to start, by work class")
+        for name in WORK_CLASSES:
+            metrics.register_gauge("scheduler_queue_depth", "Requests waiting for a slot, by work class", lambda name=name: len(self._queues[name]), work_class=name)
+            metrics.register_gauge("scheduler_running", "Requests holding a slot, by work class", lambda name=name: self._running[name], work_class=name)
+            metrics.register_gauge("scheduler_estimated_wait_seconds", "Queue wait a request admitted now is expected to see",
+                                   lambda name=name: self._estimate_wait(name, len(self._queues[name])), work_class=name)
+        metrics.register_gauge("scheduler_utilization", "Running plus queued requests over the slot count; above 1 means a backlog",
+                               lambda: (sum(self._running.values()) + sum(len(queue) for queue in self._queues.values())) / self.concurrency)
+
+    def _take_token(self, user_id: str, now: float) -> float:
+        """0 when the user may proceed, else seconds until the next token"""
+        if self.user_rate_per_s <= 0:
+            return 0.0
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_TRACKED_USERS:
+                # Full buckets carry no state worth keeping.
+                self._buckets = {key: value for key, value in self._buckets.items()
+                                 if value.tokens + (now - value.updated) * self.user_rate_per_s < self.user_burst}
+            bucket = self._buckets[user_id] = _TokenBucket(self.user_burst, now)
+        bucket.tokens = min(self.user_burst, bucket.tokens + (now - bucket.updated) * self.user_rate_per_s)
+        bucket.updated = now
+        if bucket.tokens < 1.0:
+            return (1.0 - bucket.tokens) / self.user_rate_per_s
+        bucket.tokens -= 1.0
+        return 0.0
+
+    def _slots_for(self, work_class: str) -> float:
+        # The slots a class can count on: its weighted share among the classes with work, within its own limit.
+        active = [name for name in WORK_CLASSES if name == work_class or self._queues[name] or self._running[name]]
+        share = self.concurrency * self.weights[work_class] / sum(self.weights[name] for name in active)
+        return max(1.0, min(float(self.class_limits[work_class]), share))
+
+    def _estimate_wait(self, work_class: str, ahead: int) -> float:
+        free = sum(self._running.values()) < self.concurrency and self._running[work_class] < self.class_limits[work_class]
+        if ahead == 0 and free:
+            return 0.0
+        return (ahead + 1) * self._service_s[work_class] / self._slots_for(work_class)
+
+    def estimate(self, work_class: str) -> Dict:
+        """Where a request of this class admitted now would stand, for clients deciding whether to send it"""
+        ahead = len(self._queues[work_class])
+        return {"work_class": work_class, "position": ahead, "estimated_wait_ms": round(self._estimate_wait(work_class, ahead) * 1000),
+                "running": self._running[work_class], "queue_limit": self.queue_limits[work_class]}
+
+    def snapshot(self) -> Dict:
+        return {"enabled": self.enabled, "concurrency": self.concurrency,
+                "classes": {name: dict(self.estimate(name), weight=self.weights[name], class_limit=self.class_limits[name],
+                                       mean_service_ms=round(self._service_s[name] * 1000)) for name in WORK_CLASSES}}
+
+    def admit(self, work_class: str, user_id: str) -> Ticket:
+        """Rate-limit and capacity checks; raises SchedulerRejected, else returns the ticket to run under slot()"""
+        if work_class not in self._queues:
+            raise ValueError(f"Unknown work class '{work_class}'. Expected one of {', '.join(WORK_CLASSES)}.")
+        now = time.monotonic()
+        ahead = len(self._queues[work_class])
+        estimate = self.estimate(work_class)
+        if not self.enabled:
+            return Ticket(work_class, user_id, now, float("inf"), 0, 0.0)
+        retry_after = self._take_token(user_id, now)
+        if retry_after:
+            metrics.inc("scheduler_requests_total", work_class=work_class, outcome="rate_limited")
+            log.info("scheduler.rate_limited", work_class=work_class, user_id=user_id, retry_after_s=round(retry_after, 2))
+            raise SchedulerRejected("rate_limited", 429, retry_after, estimate)
+        if ahead >= self.queue_limits[work_class]:
+            metrics.inc("scheduler_requests_total", work_class=work_class, outcome="queue_full")
+            log.warning("scheduler.queue_full", work_class=work_class, depth=ahead)
+            raise SchedulerRejected("queue_full", 503, self._estimate_wait(work_class, ahead), estimate)
+        metrics.inc("scheduler_requests_total", work_class=work_class, outcome="admitted")
+        expires_at = now + self.queue_deadlines_s[work_class]
+        request = current_deadline()
+        if request is not None:
+            # A request that could only start after its own deadline is not worth starting.
+            expires_at = min(expires_at, request.expires_at)
+        return Ticket(work_class, user_id, now, expires_at, ahead, self._estimate_wait(work_class, ahead))
+
+    def _next_class(self) -> Optional[str]:
+        candidates = [name for name in WORK_CLASSES if self._queues[name] and self._running[name] < self.class_limits[name]]
+        return min(candidates, key=lambda name: (self._pass[name], WORK_CLASSES.index(name))) if candidates else None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while sum(self._running.values()) < self.concurrency:
+            work_class = self._next_class()
+            if work_class is None:
+                return
+            ticket = self._queues[work_class].popleft()
+            if now > ticket.deadline:
+                # Its waiter raises on waking; the slot goes to the next request instead.
+                ticket._event.set()
+                continue
+            ticket.granted = True
+            self._running[work_class] += 1
+            self._pass[work_class] += 1.0 / self.weights[work_class]
+            ticket._event.set()
+
+    def _enqueue(self, ticket: Ticket):
+        queue = self._queues[ticket.work_class]
+        if not queue and not self._running[ticket.work_class]:
+            # A class coming back from idle starts level with the busiest backlog instead of cashing in its idle time.
+            busy = [self._pass[name] for name in WORK_CLASSES if self._queues[name] or self._running[name]]
+            if busy:
+                self._pass[ticket.work_class] = max(self._pass[ticket.work_class], min(busy))
+        ticket._event = asyncio.Event()
+        queue.append(ticket)
+        self._dispatch()
+
+    def _release(self, ticket: Ticket, service_s: Optional[float]):
+        self._running[ticket.work_class] -= 1
+        if service_s is not None:
+            previous = self._service_s[ticket.work_class]
+            self._service_s[ticket.work_class] = previous + _SERVICE_EWMA_ALPHA * (service_s - previous)
+        self._dispatch()
+
+    def _expired(self, ticket: Ticket) -> SchedulerRejected:
+        metrics.inc("scheduler_requests_total", work_class=ticket.work_class, outcome="expired")
+        log.warning("scheduler.expired", work_class=ticket.work_class, user_id=ticket.user_id,
+                    waited_ms=round((time.monotonic() - ticket.admitted_at) * 1000))
+        return SchedulerRejected("expired", 503, self._estimate_wait(ticket.work_class, len(self._queues[ticket.work_class])), self.estimate(ticket.work_class))
+
+    @asynccontextmanager
+    async def slot(self, ticket: Ticket) -> AsyncIterator[Ticket]:
+        """Wait for the ticket's turn, hold a slot for the body, then hand it on; raises SchedulerRejected on expiry"""
+        if not self.enabled:
+            yield ticket
+            return
+        try:
+            with stage("queue"):
+                self._enqueue(ticket)
+                if not ticket.granted:
+                    await asyncio.wait_for(ticket._event.wait(), timeout=max(0.0, ticket.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if not ticket.granted:
+                self._forget(ticket)
+                raise self._expired(ticket) from None
+        except BaseException:
+            # Cancelled while queued (client gone): give up the place, or the slot if it was granted meanwhile.
+            if ticket.granted:
+                self._release(ticket, None)
+            else:
+                self._forget(ticket)
+                metrics.inc("scheduler_requests_total", work_class=ticket.work_class, outcome="cancelled")
+            raise
+        if not ticket.granted:
+            raise self._expired(ticket)
+        started = time.monotonic()
+        metrics.observe("scheduler_queue_wait_seconds", started - ticket.admitted_at, work_class=ticket.work_class)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket, time.monotonic() - started)
+
+    def _forget(self, ticket: Ticket):
+        try:
+            self._queues[ticket.work_class].remove(ticket)
+        except ValueError:
+            pass
@@ -1,58 +1,225 @@
 import whisper # type: ignore
+import torch # type: ignore
 import os
-from typing import Optional
+import time
+import queue
+import threading
+from typing import Dict, List, Optional, Tuple
+from services.metrics import metrics, stage
+from services.log import get_logger
+
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("WHISPER_MAX_BATCH_SIZE", "8"))
+DEFAULT_MAX_WAIT_MS = float(os.getenv("WHISPER_MAX_WAIT_MS", "50"))
+DEFAULT_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "0")) or None
+# Languages callers are expected to speak; detection picks the most likely of these.
+SUPPORTED_LANGUAGES = [lang.strip() for lang in os.getenv("WHISPER_LANGUAGES", "ar,fr").split(",") if lang.strip()]
+
+log = get_logger(__name__)
+
+class _TranscriptionRequest:
+    """A clip waiting in the batch queue, with the slot its transcript is written to.
+
+    A ``language`` of None means it is detected from the batch's encoder output.
+    """
+    __slots__ = ("audio", "language", "done", "text", "error")
+
+    def __init__(self, audio, language: Optional[str]):
+        self.audio = audio
+        self.language = language
+        self.done = threading.Event()
+        self.text: Optional[str] = None
+        self.error: Optional[Exception] = None
 
 class TranscriptionService:
-    def __init__(self, model_name: str = "base"):
+    def __init__(self, model_name: str = "base", max_batch_size: Optional[int] = None, max_wait_ms: Optional[float] = None, beam_size: Optional[int] = DEFAULT_BEAM_SIZE):
         try:
             self.model = whisper.load_model(model_name)
-            print(f"Loaded Whisper model: {model_name}")
+            log.info("whisper.loaded", model=model_name)
         except Exception as e:
-            print(f"Error loading Whisper model ({model_name}): {e}")
+            log.error("whisper.load_failed", model=model_name, error=str(e))
             try:
-                print("Attempting to load 'tiny' Whisper model as a fallback.")
                 self.model = whisper.load_model("tiny")
-                print("Loaded Whisper model: tiny (fallback)")
+                log.warning("whisper.loaded", model="tiny", fallback=True)
             except Exception as e_fallback:
-                print(f"Error loading fallback 'tiny' Whisper model: {e_fallback}")
+                log.error("whisper.load_failed", model="tiny", error=str(e_fallback))
                 self.model = None
                 raise RuntimeError(f"Could not load Whisper model '{model_name}' or fallback 'tiny'. Please check your Whisper installation and model availability.") from e_fallback
+        self.max_batch_size = max(1, max_batch_size or DEFAULT_MAX_BATCH_SIZE)
+        self.max_wait_s = (max_wait_ms if max_wait_ms is not None else DEFAULT_MAX_WAIT_MS) / 1000.0
+        self.beam_size = beam_size
+        # Whisper installs kv-cache hooks on the decoder for every decode call, so
+        # two decodes must never run on the model at the same time.
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue[_TranscriptionRequest]" = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "clips_total": 0,
+            "batches_total": 0,
+            "long_clips_total": 0,
+            "errors_total": 0,
+            "audio_seconds_total": 0.0,
+            "processing_seconds_total": 0.0,
+            "max_batch_size_seen": 0,
+        }
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._worker_start_lock = threading.Lock()
+        self._ensure_worker()
+        metrics.register_gauge("transcription_queue_depth", "Clips waiting for the Whisper batcher", lambda: self._queue.qsize())
 
-    def transcribe_audio(self, audio_path: str) -> Optional[str]:
+    def _ensure_worker(self):
+        # Threads don't survive fork: a service loaded in a preforking master starts its batcher again in each worker.
+        if self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._worker_start_lock:
+            if self._worker_pid != os.getpid() or not self._worker.is_alive():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._batch_worker, name="whisper-batcher", daemon=True)
+                self._worker.start()
+                self._worker_pid = os.getpid()
+
+    def transcribe_audio(self, audio_path: str, language: str = "ar") -> Optional[str]:
+        text, _ = self._transcribe(audio_path, language)
+        return text
+
+    def transcribe_with_language(self, audio_path: str) -> Tuple[Optional[str], str]:
+        """Detect the spoken language and transcribe in it, from a single mel/encoder pass."""
+        return self._transcribe(audio_path, None)
+
+    def _transcribe(self, audio_path: str, language: Optional[str]) -> Tuple[Optional[str], str]:
         if not self.model:
-            print("Whisper model not loaded. Cannot transcribe.")
-            return None
+            log.error("whisper.not_loaded")
+            return None, "unknown"
         try:
             if not os.path.exists(audio_path):
-                print(f"Audio file not found: {audio_path}")
-                return None
-            result = self.model.transcribe(
-                audio_path,
-                language="ar",
-                fp16=False
-            )
-            text = result["text"].strip()
-            print(f"Transcription: {text}")
-            return text
+                log.error("transcription.audio_missing")
+                return None, "unknown"
+            audio = whisper.load_audio(audio_path)
+            request = _TranscriptionRequest(audio, language)
+            self._ensure_worker()
+            self._queue.put(request)
+            request.done.wait()
+            if request.error:
+                raise request.error
+            text = (request.text or "").strip()
+            log.debug("transcription.done", language=request.language, chars=len(text))
+            return text, request.language or "unknown"
         except Exception as e:
-            print(f"Transcription error: {e}")
-            return None
+            log.error("transcription.failed", error=str(e))
+            return None, "unknown"
+
+    def _batch_worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process_batch(batch)
+
+    def _process_batch(self, batch: List[_TranscriptionRequest]):
+        start = time.perf_counter()
+        # Clips longer than one 30s window need Whisper's sliding-window transcribe,
+        # which cannot be batched; everything else shares one encoder pass.
+        short = [r for r in batch if len(r.audio) <= whisper.audio.N_SAMPLES]
+        long = [r for r in batch if len(r.audio) > whisper.audio.N_SAMPLES]
+        with self._model_lock:
+            if short:
+                try:
+                    self._decode_batch(short)
+                except Exception as e:
+                    for request in short:
+                        request.error = e
+            for request in long:
+                try:
+                    result = self.model.transcribe(request.audio, language=request.language, fp16=False)
+                    request.text = result["text"]
+                    request.language = request.language or result.get("language")
+                except Exception as e:
+                    request.error = e
+        elapsed = time.perf_counter() - start
+        with self._metrics_lock:
+            self._metrics["clips_total"] += len(batch)
+            self._metrics["batches_total"] += 1
+            self._metrics["long_clips_total"] += len(long)
+            self._metrics["errors_total"] += sum(1 for r in batch if r.error)
+            self._metrics["audio_seconds_total"] += sum(len(r.audio) for r in batch) / whisper.audio.SAMPLE_RATE
+            self._metrics["processing_seconds_total"] += elapsed
+            self._metrics["max_batch_size_seen"] = max(self._metrics["max_batch_size_seen"], len(batch))
+        for request in batch:
+            request.done.set()
+
+    @torch.no_grad()
+    def _decode_batch(self, batch: List[_TranscriptionRequest]):
+        n_mels = self.model.dims.n_mels
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(r.audio), n_mels=n_mels)
+            for r in batch
+        ]).to(self.model.device)
+        # Encoder runs once; detection and decoding both reuse these features
+        # (whisper skips the encoder when handed tensors of the feature shape).
+        audio_features = self.model.embed_audio(mels)
+        undetected = [i for i, r in enumerate(batch) if r.language is None]
+        if undetected:
+            index = torch.tensor(undetected, device=audio_features.device)
+            with stage("transcribe_detect"):
+                _, probs = self.model.detect_language(audio_features[index])
+            for i, lang_probs in zip(undetected, probs):
+                batch[i].language = self._pick_language(lang_probs)
+        by_language: Dict[str, List[int]] = {}
+        for i, request in enumerate(batch):
+            by_language.setdefault(request.language, []).append(i)
+        for language, indices in by_language.items():
+            options = whisper.DecodingOptions(
+                task="transcribe",
+                language=language,
+                beam_size=self.beam_size,
+                without_timestamps=True,
+                fp16=False,
+            )
+            index = torch.tensor(indices, device=audio_features.device)
+            results = whisper.decode(self.model, audio_features[index], options)
+            for i, result in zip(indices, results):
+                batch[i].text = result.text
+
+    def _pick_language(self, lang_probs: Dict[str, float]) -> str:
+        candidates = {lang: p for lang, p in lang_probs.items() if lang in SUPPORTED_LANGUAGES} or lang_probs
+        return max(candidates, key=candidates.get)
+
+    def get_metrics(self) -> Dict:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        batches = metrics["batches_total"]
+        processing = metrics["processing_seconds_total"]
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["avg_batch_size"] = metrics["clips_total"] / batches if batches else 0.0
+        metrics["clips_per_second"] = metrics["clips_total"] / processing if processing else 0.0
+        metrics["real_time_factor"] = processing / metrics["audio_seconds_total"] if metrics["audio_seconds_total"] else 0.0
+        metrics["max_batch_size"] = self.max_batch_size
+        metrics["max_wait_ms"] = self.max_wait_s * 1000.0
+        return metrics
 
     def detect_language(self, audio_path: str) -> str:
         if not self.model:
-            print("Whisper model not loaded. Cannot detect language.")
+            log.error("whisper.not_loaded")
             return "unknown"
         try:
             if not os.path.exists(audio_path):
-                print(f"Audio file not found for language detection: {audio_path}")
+                log.error("transcription.audio_missing")
                 return "unknown"
             audio = whisper.load_audio(audio_path)
             audio = whisper.pad_or_trim(audio)
-            mel = whisper.log_mel_spectrogram(audio).to(self.model.device)
-            _, probs = self.model.detect_language(mel)
+            mel = whisper.log_mel_spectrogram(audio, n_mels=self.model.dims.n_mels).to(self.model.device)
+            with self._model_lock:
+                _, probs = self.model.detect_language(mel)
             detected_lang = max(probs, key=probs.get)
-            print(f"Detected language: {detected_lang}")
+            log.debug("transcription.language_detected", language=detected_lang)
             return detected_lang
         except Exception as e:
-            print(f"Language detection error: {e}")
-            return "unknown"
\ No newline at end of file
+            log.error("transcription.language_detection_failed", error=str(e))
+            return "unknown"
@@ -1,51 +1,292 @@
-from gtts import gTTS # type: ignore
-import pygame
-import io
-import tempfile
 import os
-from typing import Optional
+import wave
+import re
+import hashlib
+import time
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
+from services.audio_store import AudioStore
+from services.tts_backends import TTSBackend, create_tts_backend
+from services.metrics import metrics, stage
+from services import deadline
+from services.log import get_logger
+
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "4"))
+# Inline replies (synthesize_bytes) get their own threads, so they never queue behind warm-up or streamed segments.
+TTS_REPLY_MAX_PARALLEL = int(os.getenv("TTS_REPLY_MAX_PARALLEL", "2"))
+TTS_SEGMENT_TIMEOUT_S = float(os.getenv("TTS_SEGMENT_TIMEOUT_S", "30"))
+AUDIO_URL_PREFIX = "/api/v1/audio"
+# How often a worker checks for a segment another worker is rendering.
+SEGMENT_POLL_INTERVAL_S = 0.05
+
+_SEGMENT_BOUNDARY = re.compile(r"\n+|•|(?<=[.!?;:])\s+")
+_SPEAKABLE = re.compile(r"\w")
+
+log = get_logger(__name__)
+
+class _Render:
+    """A synthesis in flight: audio resolves to the bytes as soon as they exist, stored to the key once on disk"""
+    __slots__ = ("audio", "stored")
 
-class TTSService:
-    # Define STATIC_AUDIO_DIR as a class attribute
-    STATIC_AUDIO_DIR = Path(__file__).resolve().parent.parent / "static" / "generated_audio"
-    
     def __init__(self):
+        self.audio: Future = Future()
+        self.stored: Optional[Future] = None
+
+class TTSService:
+    # Outside static/: clips are served only through the signed /api/v1/audio routes.
+    AUDIO_DIR = Path(os.getenv("AUDIO_STORE_DIR", str(Path(__file__).resolve().parent.parent / "cache" / "audio")))
+    LEGACY_AUDIO_DIR = Path(__file__).resolve().parent.parent / "static" / "generated_audio"
+
+    def __init__(self, backend: Optional[TTSBackend] = None, store: Optional[AudioStore] = None):
         # Ensure the directory exists
-        os.makedirs(self.STATIC_AUDIO_DIR, exist_ok=True)
-        
-        try:
-            pygame.mixer.init()
-            self._pygame_initialized = True
-        except Exception as e:
-            print(f"Pygame mixer initialization failed: {e}. Local playback (speak_text) might not work.")
-            self._pygame_initialized = False
+        os.makedirs(self.AUDIO_DIR, exist_ok=True)
+        self.backend = backend or create_tts_backend()
+        log.info("tts.backend", backend=self.backend.name)
+        self.store = store or AudioStore(self.AUDIO_DIR, extension=self.backend.extension, legacy_root=self.LEGACY_AUDIO_DIR)
+        self._executor = ThreadPoolExecutor(max_workers=TTS_MAX_PARALLEL, thread_name_prefix="tts")
+        self._reply_executor = ThreadPoolExecutor(max_workers=TTS_REPLY_MAX_PARALLEL, thread_name_prefix="tts-reply")
+        self._inflight: Dict[str, _Render] = {}
+        self._inflight_lock = threading.Lock()
+        # Only local playback (speak_text) needs the mixer; the API server never initializes it.
+        self._pygame_initialized: Optional[bool] = None
+        metrics.register_gauge("tts_inflight_segments", "Segments being synthesized or queued for synthesis", lambda: len(self._inflight))
+
+    def _init_mixer(self) -> bool:
+        if self._pygame_initialized is None:
+            try:
+                import pygame
+                pygame.mixer.init()
+                self._pygame_initialized = True
+            except Exception as e:
+                log.warning("tts.mixer_init_failed", error=str(e))
+                self._pygame_initialized = False
+        return self._pygame_initialized
 
     def speak_text(self, text: str, lang: str = "fr") -> bool:
-        if not self._pygame_initialized:
-            print("Pygame not initialized. Cannot play audio directly.")
+        if not self._init_mixer():
+            log.warning("tts.mixer_unavailable")
             return False
+        import pygame
         try:
-            tts = gTTS(text=text, lang=lang, slow=False)
-            with tempfile.NamedTemporaryFile(delete=True, suffix=".mp3") as tmp_file:
-                tts.save(tmp_file.name)
-                pygame.mixer.music.load(tmp_file.name)
-                pygame.mixer.music.play()
-                while pygame.mixer.music.get_busy():
-                    pygame.time.Clock().tick(10)
+            key = self.synthesize_to_cache(text, lang)
+            if not key:
+                return False
+            pygame.mixer.music.load(str(self.store.path_for(key)))
+            pygame.mixer.music.play()
+            while pygame.mixer.music.get_busy():
+                pygame.time.Clock().tick(10)
             return True
         except Exception as e:
-            print(f"TTS local playback error: {e}")
+            log.error("tts.playback_failed", error=str(e))
             return False
 
-    def generate_audio_file(self, text: str, filename_prefix: str, lang: str = "fr") -> Optional[str]:
+    @property
+    def extension(self) -> str:
+        return self.backend.extension
+
+    @property
+    def media_type(self) -> str:
+        return self.backend.media_type
+
+    def _submit(self, text: str, lang: str, executor: Optional[ThreadPoolExecutor] = None) -> Tuple[str, Optional[_Render]]:
+        """Start synthesizing text unless it is cached or already in flight; None when it is already stored."""
+        key = self.audio_key(text, lang)
+        if self.store.get(key):
+            return key, None
+        with self._inflight_lock:
+            render = self._inflight.get(key)
+            if render is None:
+                # A render that finished since the check above stored the clip before leaving _inflight.
+                if self.store.get(key):
+                    return key, None
+                render = _Render()
+                # Run in the submitter's context so synthesis time shows in that request's timing breakdown.
+                render.stored = (executor or self._executor).submit(contextvars.copy_context().run, self._synthesize_and_store, key, text, lang, render)
+                self._inflight[key] = render
+                self.store.mark_pending(key)
+        return key, render
+
+    def _synthesize_and_store(self, key: str, text: str, lang: str, render: _Render) -> str:
+        try:
+            try:
+                with stage("tts"):
+                    audio_bytes = self.backend.synthesize(text, lang)
+            except BaseException as e:
+                render.audio.set_exception(e)
+                raise
+            # Whoever waits on the audio itself has it now; the write below only holds up waiters on the file.
+            render.audio.set_result(audio_bytes)
+            self.store.put(key, audio_bytes)
+            log.debug("tts.synthesized", audio_key=key, lang=lang, bytes=len(audio_bytes))
+            return key
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            self.store.clear_pending(key)
+
+    def audio_key(self, text: str, lang: str) -> str:
+        return AudioStore.make_key(text, lang, self.backend.voice_id(lang))
+
+    def synthesize_bytes(self, text: str, lang: str = "fr") -> Optional[bytes]:
+        """Audio for text held in memory: read from the store on a hit, else handed over as soon as it is synthesized."""
         try:
-            tts = gTTS(text=text, lang=lang, slow=False)
-            output_filename = f"{filename_prefix}_{lang}.mp3"
-            output_path = self.STATIC_AUDIO_DIR / output_filename
-            tts.save(str(output_path))
-            print(f"Generated audio file: {output_path}")
-            return os.path.join("generated_audio", output_filename) 
+            # On the pool rather than this thread, so the wait is bounded by the request's deadline; synthesis that
+            # outlives it is still stored for the next request.
+            key, render = self._submit(text, lang, self._reply_executor)
+            if render:
+                return render.audio.result(timeout=deadline.timeout(TTS_SEGMENT_TIMEOUT_S))
+            path = self.store.get(key)
+            return path.read_bytes() if path else None
+        except FutureTimeout:
+            deadline.degrade("tts_timed_out", lang=lang)
+            return None
         except Exception as e:
-            print(f"Audio generation error: {e}")
-            return None
\ No newline at end of file
+            log.error("tts.synthesis_failed", lang=lang, error=str(e))
+            return None
+
+    def synthesize_to_cache(self, text: str, lang: str = "fr") -> Optional[str]:
+        """Return the cache key for text spoken in lang, synthesizing it only on a miss."""
+        try:
+            key, render = self._submit(text, lang)
+            if render:
+                render.stored.result(timeout=deadline.timeout(TTS_SEGMENT_TIMEOUT_S))
+            return key
+        except FutureTimeout:
+            # Synthesis carries on in the background and is cached for the next request.
+            deadline.degrade("tts_timed_out", lang=lang)
+            return None
+        except Exception as e:
+            log.error("tts.synthesis_failed", lang=lang, error=str(e))
+            return None
+
+    @staticmethod
+    def split_segments(text: str) -> List[str]:
+        """Split a response at line, bullet and sentence boundaries into speakable segments."""
+        segments = [segment.strip() for segment in _SEGMENT_BOUNDARY.split(text)]
+        return [segment for segment in segments if _SPEAKABLE.search(segment)]
+
+    def create_playlist(self, text: str, lang: str = "fr") -> Optional[str]:
+        """Queue every segment of text for synthesis and return a playlist id without waiting."""
+        segments = self.split_segments(text)
+        if not segments:
+            return None
+        keys = [self._submit(segment, lang)[0] for segment in segments]
+        playlist_id = hashlib.sha256("\0".join(keys).encode("ascii")).hexdigest()
+        self.store.put_playlist(playlist_id, keys)
+        return playlist_id
+
+    def get_playlist(self, playlist_id: str) -> Optional[List[str]]:
+        return self.store.get_playlist(playlist_id)
+
+    def get_segment_path(self, key: str, timeout: float = TTS_SEGMENT_TIMEOUT_S) -> Optional[Path]:
+        """Path of a cached segment, waiting for it if it is still being synthesized."""
+        with self._inflight_lock:
+            render = self._inflight.get(key)
+        if render:
+            try:
+                render.stored.result(timeout=timeout)
+            except Exception as e:
+                log.error("tts.segment_failed", audio_key=key, error=str(e))
+                return None
+        elif not self.store.path_for(key).exists() and self.store.is_pending(key, timeout):
+            # Rendering in another worker: wait for its file to land.
+            give_up_at = time.monotonic() + timeout
+            while not self.store.path_for(key).exists() and self.store.is_pending(key, timeout) and time.monotonic() < give_up_at:
+                time.sleep(SEGMENT_POLL_INTERVAL_S)
+        return self.store.get(key)
+
+    def audio_url(self, key: str) -> str:
+        return f"{AUDIO_URL_PREFIX}/{key}.{self.extension}?{self.store.sign(key)}"
+
+    def stream_url(self, playlist_id: str) -> str:
+        return f"{AUDIO_URL_PREFIX}/stream/{playlist_id}.{self.extension}?{self.store.sign(playlist_id)}"
+
+    def playlist_url(self, playlist_id: str) -> str:
+        return f"{AUDIO_URL_PREFIX}/playlist/{playlist_id}.m3u8?{self.store.sign(playlist_id)}"
+
+    def render_playlist_m3u8(self, playlist_id: str) -> Optional[str]:
+        keys = self.get_playlist(playlist_id)
+        if not keys:
+            return None
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-MEDIA-SEQUENCE:0"]
+        durations = []
+        for key in keys:
+            path = self.store.get(key)
+            # Size-based estimate once rendered, otherwise a length-agnostic default.
+            durations.append(max(1.0, self.backend.estimate_duration(path.stat().st_size)) if path else 5.0)
+        lines.insert(2, f"#EXT-X-TARGETDURATION:{int(max(durations)) + 1}")
+        for key, duration in zip(keys, durations):
+            lines.append(f"#EXTINF:{duration:.1f},")
+            lines.append(self.audio_url(key))
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def iter_playlist_audio(self, playlist_id: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yield the playlist's audio in order, each segment as soon as it is ready."""
+        if self.backend.extension == "wav":
+            yield from self._iter_playlist_wav(playlist_id, chunk_size)
+            return
+        # MP3 frames concatenate, so segment files are sent back to back.
+        for key in self.get_playlist(playlist_id) or []:
+            path = self.get_segment_path(key)
+            if not path:
+                continue
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def _iter_playlist_wav(self, playlist_id: str, chunk_size: int) -> Iterator[bytes]:
+        # WAV files don't concatenate: send one streaming header (unknown length), then every segment's frames.
+        header_sent = False
+        for key in self.get_playlist(playlist_id) or []:
+            path = self.get_segment_path(key)
+            if not path:
+                continue
+            with wave.open(str(path), "rb") as wav_file:
+                if not header_sent:
+                    yield _streaming_wav_header(wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate())
+                    header_sent = True
+                frames_per_chunk = max(1, chunk_size // (wav_file.getsampwidth() * wav_file.getnchannels()))
+                while True:
+                    frames = wav_file.readframes(frames_per_chunk)
+                    if not frames:
+                        break
+                    yield frames
+
+    def generate_audio_file(self, text: str, filename_prefix: str, lang: str = "fr") -> Optional[str]:
+        # Identical text is served from the content-addressed cache, so filename_prefix no longer names the file;
+        # the result is a signed URL like every other link to the store.
+        key = self.synthesize_to_cache(text, lang)
+        if not key:
+            return None
+        return self.audio_url(key)
+
+    def warm_up(self, texts: Iterable[str], languages: Iterable[str]) -> Dict[str, int]:
+        """Pre-render texts so their first request is a cache hit."""
+        unique_texts = list(dict.fromkeys(texts))
+        rendered, failed = 0, 0
+        for lang in languages:
+            for text in unique_texts:
+                if self.synthesize_to_cache(text, lang):
+                    rendered += 1
+                else:
+                    failed += 1
+        log.info("tts.warmup_finished", rendered=rendered, failed=failed)
+        return {"rendered": rendered, "failed": failed}
+
+def _streaming_wav_header(channels: int, sample_width: int, frame_rate: int) -> bytes:
+    data_size = 0xFFFFFFFF - 36
+    byte_rate = frame_rate * channels * sample_width
+    return b"".join([
+        b"RIFF", (data_size + 36).to_bytes(4, "little"), b"WAVE",
+        b"fmt ", (16).to_bytes(4, "little"), (1).to_bytes(2, "little"), channels.to_bytes(2, "little"),
+        frame_rate.to_bytes(4, "little"), byte_rate.to_bytes(4, "little"),
+        (channels * sample_width).to_bytes(2, "little"), (sample_width * 8).to_bytes(2, "little"),
+        b"data", data_size.to_bytes(4, "little"),
+    ])
@@ -0,0 +1,159 @@
+import io
+import os
+import wave
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Optional
+from services.log import get_logger
+
+TTS_BACKEND = os.getenv("TTS_BACKEND", "gtts").lower()
+# gTTS "voice" is the Google Translate host the accent comes from.
+GTTS_TLD = os.getenv("TTS_VOICE", "com")
+GTTS_TIMEOUT_S = float(os.getenv("GTTS_TIMEOUT_S", "10"))
+# Comma-separated lang:model pairs, e.g. "fr:fr_FR-siwis-medium.onnx,ar:ar_JO-kareem-medium.onnx".
+PIPER_VOICES = os.getenv("PIPER_VOICES", "fr:fr_FR-siwis-medium.onnx,ar:ar_JO-kareem-medium.onnx")
+PIPER_VOICE_DIR = Path(os.getenv("PIPER_VOICE_DIR", str(Path(__file__).resolve().parent.parent / "voices")))
+# Any TTS server taking POST {"text", "lang", "voice"} and answering with MP3 bytes (also the load-test stand-in).
+TTS_HTTP_URL = os.getenv("TTS_HTTP_URL", "http://localhost:5002/api/tts")
+TTS_HTTP_VOICE = os.getenv("TTS_HTTP_VOICE", "default")
+TTS_HTTP_TIMEOUT_S = float(os.getenv("TTS_HTTP_TIMEOUT_S", "15"))
+
+log = get_logger(__name__)
+
+class TTSBackend(ABC):
+    """Turns text into encoded audio bytes; TTSService handles caching, segmentation and serving."""
+    name = "base"
+    extension = "mp3"
+    media_type = "audio/mpeg"
+
+    @abstractmethod
+    def voice_id(self, lang: str) -> str:
+        """Identifies the voice used for lang, so cache keys change when the voice does."""
+
+    @abstractmethod
+    def synthesize(self, text: str, lang: str) -> bytes:
+        """Encoded audio (in extension's format) for text spoken in lang."""
+
+    @abstractmethod
+    def estimate_duration(self, size_bytes: int) -> float:
+        """Seconds of audio in size_bytes of this backend's output."""
+
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS; needs an outbound connection per utterance."""
+    name = "gtts"
+    extension = "mp3"
+    media_type = "audio/mpeg"
+
+    def __init__(self, tld: str = GTTS_TLD, timeout_s: float = GTTS_TIMEOUT_S):
+        from gtts import gTTS # type: ignore
+        self._gtts = gTTS
+        self.tld = tld
+        self.timeout_s = timeout_s
+
+    def voice_id(self, lang: str) -> str:
+        return f"gtts:{self.tld}:{lang}"
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        buffer = io.BytesIO()
+        self._gtts(text=text, lang=lang, tld=self.tld, slow=False, timeout=self.timeout_s).write_to_fp(buffer)
+        return buffer.getvalue()
+
+    def estimate_duration(self, size_bytes: int) -> float:
+        # gTTS serves 32 kbps MP3.
+        return size_bytes / 4000.0
+
+class PiperBackend(TTSBackend):
+    """Local CPU-only neural TTS (Piper/ONNX); each voice is loaded once and synthesizes into memory."""
+    name = "piper"
+    extension = "wav"
+    media_type = "audio/wav"
+
+    def __init__(self, voices: Optional[Dict[str, str]] = None, voice_dir: Path = PIPER_VOICE_DIR):
+        try:
+            from piper.voice import PiperVoice # type: ignore
+        except ImportError as e:
+            raise RuntimeError("TTS_BACKEND=piper requires the 'piper-tts' package.") from e
+        voices = voices if voices is not None else parse_voice_config(PIPER_VOICES)
+        self._voices = {}
+        self._voice_names = {}
+        self._bytes_per_second = 44100.0
+        for lang, model in voices.items():
+            model_path = Path(model)
+            if not model_path.is_absolute():
+                model_path = voice_dir / model_path
+            if not model_path.exists():
+                raise RuntimeError(f"Piper voice for '{lang}' not found at: {model_path}")
+            self._voices[lang] = PiperVoice.load(str(model_path), use_cuda=False)
+            self._voice_names[lang] = model_path.stem
+            self._bytes_per_second = 2.0 * self._voices[lang].config.sample_rate
+            log.info("tts.piper_voice_loaded", lang=lang, voice=model_path.stem)
+
+    def _voice_for(self, lang: str):
+        voice = self._voices.get(lang)
+        if voice is None:
+            raise ValueError(f"No Piper voice configured for language '{lang}'.")
+        return voice
+
+    def voice_id(self, lang: str) -> str:
+        return f"piper:{self._voice_names.get(lang, 'none')}"
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        voice = self._voice_for(lang)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            # piper-tts >= 1.3 renamed synthesize() (which now yields chunks) to synthesize_wav().
+            synthesize_wav = getattr(voice, "synthesize_wav", None) or voice.synthesize
+            synthesize_wav(text, wav_file)
+        return buffer.getvalue()
+
+    def estimate_duration(self, size_bytes: int) -> float:
+        # Piper voices emit 16-bit mono PCM at the voice's sample rate.
+        return max(0, size_bytes - 44) / self._bytes_per_second
+
+class HTTPBackend(TTSBackend):
+    """A TTS server reached over HTTP; one keep-alive session per synthesis thread."""
+    name = "http"
+    extension = "mp3"
+    media_type = "audio/mpeg"
+
+    def __init__(self, url: str = TTS_HTTP_URL, voice: str = TTS_HTTP_VOICE, timeout_s: float = TTS_HTTP_TIMEOUT_S):
+        import requests
+        self._requests = requests
+        self.url = url
+        self.voice = voice
+        self.timeout_s = timeout_s
+        self._local = threading.local()
+
+    def voice_id(self, lang: str) -> str:
+        return f"http:{self.voice}:{lang}"
+
+    def synthesize(self, text: str, lang: str) -> bytes:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(self.url, json={"text": text, "lang": lang, "voice": self.voice}, timeout=self.timeout_s)
+        response.raise_for_status()
+        return response.content
+
+    def estimate_duration(self, size_bytes: int) -> float:
+        # Assumes 32 kbps MP3, as gTTS serves.
+        return size_bytes / 4000.0
+
+def parse_voice_config(config: str) -> Dict[str, str]:
+    voices = {}
+    for pair in config.split(","):
+        if ":" not in pair:
+            continue
+        lang, model = pair.split(":", 1)
+        voices[lang.strip()] = model.strip()
+    return voices
+
+def create_tts_backend(name: str = TTS_BACKEND) -> TTSBackend:
+    if name == "piper":
+        return PiperBackend()
+    if name == "gtts":
+        return GTTSBackend()
+    if name == "http":
+        return HTTPBackend()
+    raise ValueError(f"Unknown TTS_BACKEND '{name}'. Expected 'gtts', 'piper' or 'http'.")
@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Tuple
+from services.ocr_cache import ensure_encryption_key
+from services.metrics import metrics, record_cache_lookup, stage
+from services.log import get_logger
+
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", str(os.cpu_count() or 1)))
+VALIDATION_MAX_CONCURRENCY = int(os.getenv("VALIDATION_MAX_CONCURRENCY", str(VALIDATION_WORKERS)))
+VALIDATION_TIMEOUT_S = float(os.getenv("VALIDATION_TIMEOUT_S", "30"))
+# Extra wait past VALIDATION_TIMEOUT_S before a worker that ignores its limit (tesserocr mid-call) is killed.
+VALIDATION_KILL_GRACE_S = float(os.getenv("VALIDATION_KILL_GRACE_S", "5"))
+# OCR text of identity documents is PII; results leave the server without it.
+_PRIVATE_RESULT_FIELDS = ("raw_text",)
+
+log = get_logger(__name__)
+
+metrics.describe("ocr_pass_total", "counter", "OCR cascade passes run, by pass and outcome, to tune the cascade order")
+
+_worker_agent = None
+_cancel_flags = None
+
+def _init_worker(cancel_flags):
+    global _worker_agent, _cancel_flags
+    from agents.validation import ValidationAgent
+    _worker_agent = ValidationAgent()
+    _cancel_flags = cancel_flags
+
+def _validate_in_worker(image_path: str, doc_type: str, slot: int, timeout_s: float) -> Dict:
+    # The clock starts when a worker picks the document up, not when it was queued.
+    engine = _worker_agent.ocr_engine
+    engine.set_limit(time.monotonic() + timeout_s, lambda: _cancel_flags[slot] != 0)
+    try:
+        return _worker_agent.validate(image_path, doc_type)
+    except TimeoutError as e:
+        # As the builtin, so the API process can unpickle it without importing the OCR stack.
+        raise TimeoutError(str(e)) from None
+    finally:
+        engine.set_limit(None)
+
+class ValidationPool:
+    """Runs ValidationAgent OCR in a process pool, one Tesseract-bound document per core."""
+
+    def __init__(self, max_workers: int = VALIDATION_WORKERS, max_concurrency: int = VALIDATION_MAX_CONCURRENCY, timeout_s: float = VALIDATION_TIMEOUT_S):
+        self.max_workers = max(1, max_workers)
+        self.timeout_s = timeout_s
+        # Workers inherit the environment, so they all encrypt and decrypt the shared OCR cache with one key.
+        ensure_encryption_key()
+        # spawn, not fork: workers only need the OCR stack, not a copy of the API process and its models.
+        self._mp_context = multiprocessing.get_context("spawn")
+        # One slot per document being OCR'd, never more than there are workers, so a submitted document starts at
+        # once. Its cancel flag is shared with the worker, which gives up at the next OCR call once it is set.
+        slots = max(1, min(max_concurrency, self.max_workers))
+        self._cancel_flags = self._mp_context.Array("b", slots, lock=False)
+        self._free_slots: asyncio.Queue = asyncio.Queue()
+        for slot in range(slots):
+            self._free_slots.put_nowait(slot)
+        self._executor = self._new_executor()
+        self._inflight = 0
+        metrics.register_gauge("validation_inflight_documents", "Documents queued or being OCR'd by the validation pool", lambda: self._inflight)
+
+    async def validate_many(self, documents: List[Tuple[str, str, str]]) -> AsyncIterator[Dict]:
+        """Validate (document_id, image_path, doc_type) items, yielding each result as soon as it finishes."""
+        tasks = [asyncio.create_task(self._validate_one(*document)) for document in documents]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._mp_context,
+            initializer=_init_worker,
+            initargs=(self._cancel_flags,),
+        )
+
+    def _recycle(self, stuck: ProcessPoolExecutor):
+        """Replace a pool with a worker stuck past its limit; documents still running on it fail and are not retried"""
+        if stuck is not self._executor:
+            return
+        log.warning("validation.pool_recycled", timeout_s=self.timeout_s)
+        self._executor = self._new_executor()
+        processes = list((getattr(stuck, "_processes", None) or {}).values())
+        stuck.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    async def _validate_one(self, document_id: str, image_path: str, doc_type: str) -> Dict:
+        start = time.perf_counter()
+        self._inflight += 1
+        try:
+            slot = await self._free_slots.get()
+            self._cancel_flags[slot] = 0
+            executor, job = self._executor, None
+            try:
+                job = executor.submit(_validate_in_worker, image_path, doc_type, slot, self.timeout_s)
+                # OCR runs in worker processes, so it is timed here rather than per pass. The worker enforces the
+                # timeout itself; waiting longer only catches one that cannot be interrupted.
+                with stage("ocr"):
+                    result = await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout_s + VALIDATION_KILL_GRACE_S)
+                if "cache_hit" in result:
+                    record_cache_lookup("ocr", result["cache_hit"])
+                if not result.get("cache_hit"):
+                    # Counted here: the worker processes' own metrics are never scraped.
+                    for ocr_pass in result.get("ocr_passes_tried") or []:
+                        metrics.inc("ocr_pass_total", **{"pass": ocr_pass, "outcome": "match" if ocr_pass == result.get("ocr_pass") else "miss"})
+            except (TimeoutError, asyncio.TimeoutError):
+                if not job.done():
+                    self._recycle(executor)
+                result = {"is_valid": False, "error": f"Validation timed out after {self.timeout_s:.0f}s."}
+            except asyncio.CancelledError:
+                # The stream was closed: stop the worker at its next OCR call rather than letting it finish the scan.
+                self._cancel_flags[slot] = 1
+                raise
+            except Exception as e:
+                result = {"is_valid": False, "error": f"Validation failed: {e}"}
+            finally:
+                # The slot frees up once the worker is done with it, so the next document starts on an idle worker.
+                if job is None:
+                    self._free_slots.put_nowait(slot)
+                else:
+                    loop = asyncio.get_running_loop()
+                    job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._free_slots.put_nowait, slot))
+        finally:
+            self._inflight -= 1
+        result = {key: value for key, value in result.items() if key not in _PRIVATE_RESULT_FIELDS}
+        result.update({
+            "document_id": document_id,
+            "doc_type": doc_type,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+        # Logged here rather than in the worker process, where the request id is not set.
+        log.info("validation.completed", doc_type=doc_type, is_valid=result.get("is_valid"), ocr_pass=result.get("ocr_pass"),
+                 cache_hit=result.get("cache_hit"), elapsed_ms=result["elapsed_ms"], error=result.get("error"))
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,30 @@
+import sys
+import json
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import numpy as np
+import pytest
+from models.catalog import StaleCatalogError, compile_catalog, load_catalog, source_digest
+
+FIXTURE_PROCEDURES = Path(__file__).resolve().parent / "loadtest" / "fixtures" / "procedures.json"
+
+def _encode(texts):
+    return np.arange(len(texts) * 4, dtype=np.float32).reshape(len(texts), 4) + 1
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "procedures.cat"
+    compile_catalog(FIXTURE_PROCEDURES, path, _encode, "test-model")
+    catalog = load_catalog(path, source_digest(FIXTURE_PROCEDURES), "test-model")
+    assert [proc.procedure for proc in catalog.procedures] == [proc["procedure"] for proc in json.loads(FIXTURE_PROCEDURES.read_text(encoding="utf-8"))["procedures"]]
+    assert catalog.embeddings.shape == (len(catalog.procedures), 4)
+    assert not catalog.embeddings.flags.writeable
+    assert np.allclose(np.linalg.norm(catalog.embeddings, axis=1), 1.0)
+    assert all("Aucun context requis" not in proc.required_slots for proc in catalog.procedures)
+
+def test_rejects_stale_catalog(tmp_path):
+    path = tmp_path / "procedures.cat"
+    compile_catalog(FIXTURE_PROCEDURES, path, _encode, "test-model")
+    with pytest.raises(StaleCatalogError):
+        load_catalog(path, "0" * 64, "test-model")
+    with pytest.raises(StaleCatalogError):
+        load_catalog(path, source_digest(FIXTURE_PROCEDURES), "other-model")
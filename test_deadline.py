@@ -0,0 +1,36 @@
+import sys
+import time
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+from services import deadline
+
+def test_no_deadline_outside_requests():
+    assert deadline.remaining() is None
+    assert deadline.timeout(30) == 30
+    assert deadline.can_afford(1000)
+    deadline.degrade("translation_skipped")
+    assert deadline.degradations() == []
+
+def test_timeouts_split_the_remaining_budget():
+    with deadline.request_deadline(10):
+        assert 2.4 < deadline.timeout(30, 0.25) <= 2.5
+        assert deadline.timeout(3) == 3
+        assert deadline.can_afford(9) and not deadline.can_afford(11)
+    with deadline.request_deadline(0.01):
+        time.sleep(0.02)
+        assert deadline.timeout(30) == deadline.MIN_TIMEOUT_S
+
+def test_degradations_are_recorded_once():
+    with deadline.request_deadline(5) as current:
+        deadline.degrade("llm_intent_skipped")
+        deadline.degrade("tts_skipped", lang="fr")
+        deadline.degrade("tts_skipped", lang="fr")
+        assert deadline.degradations() == ["llm_intent_skipped", "tts_skipped"] == current.degradations
+    assert deadline.degradations() == []
+
+def test_budget_from_header():
+    assert deadline.budget_from_header("2500", 15) == 2.5
+    assert deadline.budget_from_header(None, 15) == 15
+    assert deadline.budget_from_header("soon", 15) == 15
+    assert deadline.budget_from_header("-1", 15) == 15
+    assert deadline.budget_from_header("999999999", 15) == deadline.REQUEST_DEADLINE_MAX_S
@@ -0,0 +1,35 @@
+import sys
+import logging
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+from services.log import StructuredFormatter, redact_fields, set_request_id, reset_request_id, _RequestIdFilter
+
+def test_redact_policy():
+    fields = {"text": "je veux résilier", "cin_number": "12345678", "user_id": "u42", "procedures": 2}
+    redacted = redact_fields(fields, "redact")
+    assert redacted["text"] == "<redacted:16 chars>"
+    assert redacted["cin_number"] == "<redacted:8 chars>"
+    assert redacted["user_id"].startswith("h:") and "u42" not in redacted["user_id"]
+    assert redacted["procedures"] == 2
+
+def test_hash_policy_is_stable():
+    first = redact_fields({"cin_number": "12345678"}, "hash")["cin_number"]
+    assert first == redact_fields({"cin_number": "12345678"}, "hash")["cin_number"]
+    assert "12345678" not in first
+
+def test_allow_policy():
+    fields = {"text": "bonjour", "user_id": "u42"}
+    assert redact_fields(fields, "allow") == fields
+
+def test_record_carries_request_id():
+    token = set_request_id("req-1")
+    try:
+        record = logging.LogRecord("agents.test", logging.INFO, __file__, 1, "query.received", None, None)
+        record.fields = {"user_id": "u42"}
+        _RequestIdFilter().filter(record)
+    finally:
+        reset_request_id(token)
+    line = StructuredFormatter("json").format(record)
+    assert '"request_id": "req-1"' in line
+    assert '"event": "query.received"' in line
+    assert "u42" not in line
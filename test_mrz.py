@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+from agents.mrz import check_digit, find_td3_lines, parse_td3
+
+# ICAO 9303 part 4 specimen passport.
+SPECIMEN_LINE1 = "P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<"
+SPECIMEN_LINE2 = "L898902C36UTO7408122F1204159ZE184226B<<<<<10"
+
+def test_check_digit():
+    assert check_digit("L898902C3") == 6
+    assert check_digit("740812") == 2
+    assert check_digit("120415") == 9
+    assert check_digit("<<<<<<") == 0
+
+def test_parse_specimen():
+    mrz = parse_td3(SPECIMEN_LINE1, SPECIMEN_LINE2)
+    assert mrz["is_valid"]
+    assert all(mrz["checks"].values())
+    assert mrz["document_number"] == "L898902C3"
+    assert mrz["surname"] == "ERIKSSON"
+    assert mrz["given_names"] == "ANNA MARIA"
+    assert mrz["issuing_country"] == "UTO"
+    assert mrz["birth_date"] == "1974-08-12"
+    assert mrz["expiry_date"] == "2012-04-15"
+    assert mrz["sex"] == "F"
+
+def test_misread_document_number_is_rejected():
+    # One wrong character in the number must not yield a "valid" passport.
+    mrz = parse_td3(SPECIMEN_LINE1, "L898962C36" + SPECIMEN_LINE2[10:])
+    assert not mrz["is_valid"]
+    assert not mrz["checks"]["document_number"]
+
+def test_ocr_digit_confusions_in_dates():
+    mrz = parse_td3(SPECIMEN_LINE1, SPECIMEN_LINE2[:13] + "74O8I22" + SPECIMEN_LINE2[20:])
+    assert mrz["is_valid"]
+    assert mrz["birth_date"] == "1974-08-12"
+
+def test_find_lines_in_noisy_ocr_text():
+    text = "REPUBLIQUE\nPASSPORT\n" + SPECIMEN_LINE1[:20] + " " + SPECIMEN_LINE1[20:] + "\n" + SPECIMEN_LINE2[:-2] + "\n"
+    line1, line2 = find_td3_lines(text)
+    assert line1 == SPECIMEN_LINE1
+    assert line2 == SPECIMEN_LINE2[:-2] + "<<"
+    assert find_td3_lines("no machine readable zone here") is None
+
+if __name__ == "__main__":
+    test_check_digit()
+    test_parse_specimen()
+    test_misread_document_number_is_rejected()
+    test_ocr_digit_confusions_in_dates()
+    test_find_lines_in_noisy_ocr_text()
+    print("✅ MRZ tests passed")
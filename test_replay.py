@@ -0,0 +1,100 @@
+import sys
+import json
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import pytest
+from models.responses import AgentReply
+from loadtest.replay import DEFAULT_TRANSCRIPTS, EXPECTATION_KEYS, ReplayLLM, TranscriptTranslator, check_expectations, load_transcripts, replay_conversation, write_observed
+
+PROMPT = "Procédures disponibles :\n- Transfert de crédit internet\n- Souscription à une offre internet"
+
+def test_expectations_pass_on_matching_reply():
+    reply = AgentReply("Quel est le numéro de la ligne ?", missing_context=["numéro de la ligne", "volume à transférer"])
+    assert check_expectations(reply, {
+        "is_complete": False,
+        "missing_context_contains": ["numéro de la ligne"],
+        "response_contains": ["numéro"],
+        "response_not_contains": ["Erreur"],
+    }) == []
+
+def test_expectations_report_each_mismatch():
+    reply = AgentReply("Erreur interne", todo_list=["CIN du titulaire"], is_complete=True)
+    failures = check_expectations(reply, {
+        "is_complete": False,
+        "todo_list_contains": ["CIN du titulaire", "Dernière facture"],
+        "response_not_contains": ["Erreur"],
+        "next_questions": "typo",
+    })
+    assert len(failures) == 4
+    assert failures[0] == "is_complete: expected False, got True"
+    assert "lacks ['Dernière facture']" in failures[1]
+    assert failures[2] == "response_text contains 'Erreur'"
+    assert failures[3].startswith("unknown expectation 'next_questions'")
+
+def test_shipped_transcripts_only_use_known_expectations():
+    for conversation in load_transcripts([DEFAULT_TRANSCRIPTS]):
+        expectations = [conversation.get("expect", {})] + [turn.get("expect", {}) for turn in conversation["turns"]]
+        for expect in expectations:
+            assert set(expect) <= set(EXPECTATION_KEYS), conversation["_source"]
+
+def test_stub_answers_the_first_listed_procedure():
+    llm = ReplayLLM(mode="stub")
+    assert llm(PROMPT) == "Transfert de crédit internet"
+    assert llm("no list here") == "unknown"
+    assert llm.calls == 2
+
+def test_record_then_replay(tmp_path):
+    cache_path = tmp_path / "llm_cache.json"
+    upstream_calls = []
+    def upstream(prompt, system_prompt):
+        upstream_calls.append(prompt)
+        return "Souscription à une offre internet"
+    recorder = ReplayLLM(mode="record", cache_path=cache_path, upstream=upstream)
+    assert recorder(PROMPT, "system") == "Souscription à une offre internet"
+    assert recorder(PROMPT, "system") == "Souscription à une offre internet"
+    assert len(upstream_calls) == 1 and recorder.recorded == 1
+    recorder.save()
+    assert len(json.loads(cache_path.read_text(encoding="utf-8"))) == 1
+
+    replayer = ReplayLLM(mode="replay", cache_path=cache_path)
+    assert replayer(PROMPT, "system") == "Souscription à une offre internet"
+    with pytest.raises(KeyError):
+        replayer(PROMPT, "another system prompt")
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ReplayLLM(mode="live")
+
+def test_translator_falls_back_to_the_original_text():
+    translate = TranscriptTranslator([{"turns": [{"user": "نحب نشترك", "translation": "Je veux m'abonner"}, {"user": "Bonjour"}]}])
+    assert translate("نحب نشترك", "ar") == "Je veux m'abonner"
+    assert translate("Bonjour", "fr") == "Bonjour"
+    assert translate.misses == 1
+
+class ScriptedOrchestrator:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def process_user_input(self, text, user_id, source_lang=None):
+        return self.replies[text]
+
+def test_rebaselined_transcript_replays_clean(tmp_path):
+    path = tmp_path / "transcript.jsonl"
+    path.write_text(json.dumps({"id": "transfer", "turns": [
+        {"user": "Je veux transférer du crédit", "lang": "fr", "expect": {"is_complete": True}},
+        {"user": "0612345678", "lang": "fr"},
+    ], "expect": {"is_complete": True}}, ensure_ascii=False) + "\n", encoding="utf-8")
+    orchestrator = ScriptedOrchestrator({
+        "Je veux transférer du crédit": AgentReply("Quel est le numéro ?", missing_context=["numéro de la ligne"]),
+        "0612345678": AgentReply("Voici la procédure", todo_list=["CIN du titulaire"], is_complete=True),
+    })
+    conversations = load_transcripts([path])
+    results = [replay_conversation(orchestrator, conversation) for conversation in conversations]
+    assert not results[0]["passed"]
+
+    write_observed(path, conversations, results)
+    rebaselined = load_transcripts([path.with_suffix(".observed.jsonl")])
+    for conversation in rebaselined:
+        for expect in [conversation["expect"]] + [turn["expect"] for turn in conversation["turns"]]:
+            assert set(expect) <= set(EXPECTATION_KEYS)
+    assert replay_conversation(orchestrator, rebaselined[0])["failures"] == []
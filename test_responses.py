@@ -0,0 +1,22 @@
+import sys
+import json
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import pytest
+from models.responses import AgentReply, dumps
+
+def test_reply_round_trips_through_json():
+    reply = AgentReply("Quelle est votre adresse complète ?", missing_context=["adresse du domicile"])
+    reply.detected_language = "ar"
+    payload = json.loads(dumps(reply.to_dict()))
+    assert payload["response_text"] == "Quelle est votre adresse complète ?"
+    assert payload["missing_context"] == ["adresse du domicile"]
+    assert payload["todo_list"] == [] and payload["is_complete"] is False
+    assert payload["detected_language"] == "ar" and payload["audio_base64"] is None
+
+def test_reply_matches_api_schema():
+    pytest.importorskip("pydantic")
+    from models.schemas import AgentResponse
+    fields = getattr(AgentResponse, "model_fields", None) or AgentResponse.__fields__
+    assert set(AgentReply.__slots__) == set(fields)
+    assert AgentReply("ok", is_complete=True).to_schema().is_complete
@@ -1,8 +1,12 @@
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent))
+import agents.retrieval
 from agents.retrieval import RetrievalAgent
+from services import deadline
 import os
+import time
+from loadtest.fakes import FakeServer, FakeTranslation, FaultProfile
 
 PROCEDURES_JSON_FOR_TEST = str(Path(__file__).resolve().parent.parent / "data" / "procedures.json")
 
@@ -33,6 +37,22 @@ def test_retrieval():
         else:
             print("  - No relevant procedures found.")
 
+def test_hanging_translation_degrades_within_budget(monkeypatch):
+    server = FakeServer(FakeTranslation(), FaultProfile(hang_rate=1.0, hang_s=5.0)).start()
+    monkeypatch.setattr(agents.retrieval, "TRANSLATION_API_URL", f"{server.url}/get")
+    # Only the translation path is exercised, so no model or index is loaded.
+    agent = RetrievalAgent.__new__(RetrievalAgent)
+    agent.translate_fn = None
+    try:
+        with deadline.request_deadline(3):
+            start = time.monotonic()
+            assert agent._translate_to_french("نحب نشترك في الانترنت", "ar") == "نحب نشترك في الانترنت"
+            # At most TRANSLATION_BUDGET_SHARE of the 3 s budget.
+            assert time.monotonic() - start < 1.5
+            assert deadline.degradations() == ["translation_timed_out"]
+    finally:
+        server.stop()
+
 if __name__ == "__main__":
     print("--- Running Retrieval Agent Test ---")
     test_retrieval()
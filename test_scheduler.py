@@ -0,0 +1,72 @@
+import sys
+import asyncio
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent))
+import pytest
+from services.scheduler import Scheduler, SchedulerRejected
+
+def _scheduler(**overrides) -> Scheduler:
+    settings = dict(concurrency=1, weights="text=3,audio=1,ocr=1", class_limits="", queue_limits="text=100,audio=100,ocr=100",
+                    queue_deadlines_s="text=5,audio=5,ocr=5", user_rate_per_s=0, user_burst=1, enabled=True)
+    settings.update(overrides)
+    return Scheduler(**settings)
+
+def test_weighted_fair_order():
+    async def scenario():
+        scheduler = _scheduler()
+        started = []
+        release = asyncio.Event()
+
+        async def request(work_class, user_id):
+            async with scheduler.slot(scheduler.admit(work_class, user_id)):
+                started.append(work_class)
+                if user_id == "blocker":
+                    await release.wait()
+
+        blocker = asyncio.create_task(request("text", "blocker"))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(request("audio", f"a{i}")) for i in range(4)]
+        tasks += [asyncio.create_task(request("text", f"t{i}")) for i in range(8)]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(blocker, *tasks)
+        return started[1:9]
+
+    first_eight = asyncio.run(scenario())
+    assert first_eight.count("text") == 6 and first_eight.count("audio") == 2
+
+def test_rate_limit_per_user():
+    scheduler = _scheduler(user_rate_per_s=0.01, user_burst=2)
+    scheduler.admit("text", "u1")
+    scheduler.admit("text", "u1")
+    with pytest.raises(SchedulerRejected) as rejected:
+        scheduler.admit("text", "u1")
+    assert rejected.value.status_code == 429 and rejected.value.retry_after_s > 0
+    scheduler.admit("text", "u2")
+
+def test_expired_requests_are_dropped():
+    async def scenario():
+        scheduler = _scheduler(queue_deadlines_s="text=0.05,audio=5,ocr=5")
+        async with scheduler.slot(scheduler.admit("text", "holder")):
+            waiter = asyncio.create_task(scheduler.slot(scheduler.admit("text", "late")).__aenter__())
+            await asyncio.sleep(0.1)
+        with pytest.raises(SchedulerRejected) as rejected:
+            await waiter
+        assert rejected.value.reason == "expired"
+        assert not scheduler._queues["text"] and scheduler._running["text"] == 0
+
+    asyncio.run(scenario())
+
+def test_queue_full_reports_position():
+    async def scenario():
+        scheduler = _scheduler(queue_limits="text=1,audio=1,ocr=1")
+        async with scheduler.slot(scheduler.admit("ocr", "holder")):
+            queued = scheduler.admit("ocr", "second")
+            waiter = asyncio.create_task(scheduler.slot(queued).__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(SchedulerRejected) as rejected:
+                scheduler.admit("ocr", "third")
+            assert rejected.value.status_code == 503 and rejected.value.estimate["position"] == 1
+        await waiter
+
+    asyncio.run(scenario())
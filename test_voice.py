@@ -11,6 +11,7 @@ from models.schemas import UserQuery
 import uuid
 import os
 import shutil
+from urllib.parse import urlparse
 
 PROCEDURES_JSON_FOR_TEST = str(Path(__file__).resolve().parent.parent / "data" / "procedures.json")
 if not os.path.exists(PROCEDURES_JSON_FOR_TEST):
@@ -128,8 +129,8 @@ def test_voice_flow_cli():
                         generate_tts=True
                     )
                     if agent_response and agent_response.audio_response_url:
-                        filename = os.path.basename(agent_response.audio_response_url)
-                        generated_tts_path = str(Path(orchestrator.tts_service.STATIC_AUDIO_DIR) / filename)
+                        audio_key = Path(urlparse(agent_response.audio_response_url).path).stem
+                        generated_tts_path = str(orchestrator.tts_service.store.path_for(audio_key))
             except ImportError:
                 print("⚠️ PyAudio is not installed. Cannot record audio. Try typing your query.")
                 continue
@@ -147,8 +148,8 @@ def test_voice_flow_cli():
                 generate_tts=True
             )
             if agent_response and agent_response.audio_response_url:
-                filename = os.path.basename(agent_response.audio_response_url)
-                generated_tts_path = str(Path(orchestrator.tts_service.STATIC_AUDIO_DIR) / filename)
+                audio_key = Path(urlparse(agent_response.audio_response_url).path).stem
+                generated_tts_path = str(orchestrator.tts_service.store.path_for(audio_key))
         else:
             print("Invalid choice. Please enter 1, 2, or 3.")
             continue